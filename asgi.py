@@ -2,6 +2,14 @@
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meeting_system.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
 
 application = get_asgi_application()
+
+# Web进程内的定时备份线程（多个 worker 通过文件锁只运行一个）
+# 和通知发送线程（启动时即发送重启前遗留的待发送通知）
+from booking.backup_scheduler import start_backup_scheduler  # noqa: E402
+from booking.outbox import start_outbox_dispatcher  # noqa: E402
+
+start_backup_scheduler()
+start_outbox_dispatcher()
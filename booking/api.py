@@ -1,294 +1,796 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.core.serializers.json import DjangoJSONEncoder
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from django.db.models import Count, Q
 import json
-from .models import Room, Reservation, Settings
+from .models import Room, Reservation, RoomOccupancy, Settings
+from .versioning import (
+    versioned_response, get_data_versions, make_etag, bump_data_version,
+    get_collection_etag, parse_if_match, parse_etag_header, parse_row_version, claim_row_version,
+    SCOPE_ROOMS, SCOPE_RESERVATIONS, SCOPE_SETTINGS,
+)
+from .cache import cached_payload, get_cache_stats, get_payload, set_payload
+from .occupancy import (
+    get_occupancy_masks, free_ranges, has_conflict, find_overlaps, rebuild_occupancy,
+    SLOT_FIELDS, SLOT_MINUTES,
+)
+from .transactions import run_in_write_transaction, is_lock_error
+from .outbox import enqueue_notifications
+from .webhook import get_webhook_stats
+from .settings_cache import get_all_settings
+from .changes import (
+    collect_changes, get_current_cursor, record_changes, MODEL_ROOM, MODEL_RESERVATION,
+    ACTION_CREATE, ACTION_UPDATE, ACTION_DELETE,
+)
 from django.utils import timezone
+import base64
+import binascii
 import datetime
-import requests
+import hashlib
 import logging
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-def has_reservation_changed(original_reservation, new_data, room):
-    """检查预约数据是否有变化"""
-    try:
-        # 解析新数据的日期和时间
-        date_str = new_data.get('date')
-        new_date = datetime.date.fromisoformat(date_str) if date_str else None
-        
-        # 修复字段名：前端发送的是 'start' 和 'end'，不是 'start_time' 和 'end_time'
-        start_str = new_data.get('start')
-        new_start_time = None
-        if start_str:
-            try:
-                new_start_time = datetime.datetime.strptime(start_str, '%H:%M').time()
-            except ValueError as e:
-                logger.error(f"解析开始时间失败: {start_str}, 错误: {e}")
-                return True, f"开始时间格式错误: {start_str}"
-        
-        end_str = new_data.get('end')
-        new_end_time = None
-        if end_str:
-            try:
-                new_end_time = datetime.datetime.strptime(end_str, '%H:%M').time()
-            except ValueError as e:
-                logger.error(f"解析结束时间失败: {end_str}, 错误: {e}")
-                return True, f"结束时间格式错误: {end_str}"
-        
-        # 比较各个字段
-        if original_reservation.room.id != room.id:
-            return True, "会议室变更"
-        if original_reservation.date != new_date:
-            return True, "日期变更"
-        if original_reservation.start_time != new_start_time:
-            return True, "开始时间变更"
-        if original_reservation.end_time != new_end_time:
-            return True, "结束时间变更"
-        if original_reservation.title != new_data.get('title', ''):
-            return True, "会议主题变更"
-        if original_reservation.booker != new_data.get('booker', ''):
-            return True, "预约人变更"
-        if original_reservation.department != new_data.get('department', ''):
-            return True, "部门变更"
-            
-        return False, "无变化"
-    except Exception as e:
-        logger.error(f"检查预约变化时出错: {str(e)}, 数据: {new_data}")
-        # 发生错误时，为了安全起见，假设有变化，这样不会阻止保存操作
-        return True, f"检查出错: {str(e)}"
+# load_reservations 单页最大条数
+MAX_RESERVATION_PAGE_SIZE = 1000
+# load_changes 单次最多读取的日志条数
+MAX_CHANGES_PAGE_SIZE = 1000
+# 流式输出时每批读取/编码的行数
+STREAM_CHUNK_SIZE = 500
+# 批量写入时每批的行数
+BULK_BATCH_SIZE = 500
+
+ROOM_VALUE_FIELDS = ('id', 'name', 'capacity', 'description', 'equipment', 'status', 'version')
 
-def send_wechat_notification(reservation, action='新增'):
-    """发送企业微信群机器人通知（markdown_v2格式）"""
+# 预约列表只需要的字段（通过JOIN一次取出会议室名称，避免逐行查询）
+RESERVATION_VALUE_FIELDS = (
+    'id', 'room_id', 'room__name', 'date', 'start_time', 'end_time',
+    'title', 'booker', 'department', 'created_at', 'version',
+)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@versioned_response(SCOPE_ROOMS)
+@cached_payload('rooms', SCOPE_ROOMS)
+def load_rooms(request):
+    """加载会议室数据"""
+    rooms = [serialize_room_row(row) for row in Room.objects.values(*ROOM_VALUE_FIELDS)]
+    return JsonResponse(rooms, safe=False)
+
+def serialize_room_row(row):
+    """将 values() 查询得到的会议室行转换为前端格式"""
+    return {
+        'id': str(row['id']),
+        'name': row['name'],
+        'capacity': row['capacity'],
+        'description': row['description'] or '',
+        'equipment': row['equipment'] or '',
+        'status': row['status'],
+        'version': row['version'],
+    }
+
+def serialize_reservation_row(row):
+    """将 values() 查询得到的预约行转换为前端格式"""
+    return {
+        'id': row['id'],
+        'room': str(row['room_id']),
+        'date': row['date'].isoformat(),
+        'start': row['start_time'].strftime('%H:%M'),
+        'end': row['end_time'].strftime('%H:%M'),
+        'title': row['title'],
+        'booker': row['booker'],
+        'department': row['department'] or '',
+        'room_id': row['room_id'],
+        'room_name': row['room__name'] or '',
+        'created_at': timezone.localtime(row['created_at']).strftime('%Y-%m-%d %H:%M:%S') if row['created_at'] else '',
+        'version': row['version'],
+    }
+
+def stream_json_array(rows, serialize):
+    """将行迭代器逐批编码为 JSON 数组片段，供 StreamingHttpResponse 使用"""
+    yield '['
+    buffer = []
+    first = True
+    for row in rows:
+        chunk = json.dumps(serialize(row), cls=DjangoJSONEncoder)
+        buffer.append(chunk if first else ',' + chunk)
+        first = False
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+    yield ']'
+
+def encode_reservation_cursor(row):
+    """生成分页游标：按 (日期, 开始时间, ID) 排序的最后一条记录位置"""
+    raw = f"{row['date'].isoformat()}|{row['start_time'].strftime('%H:%M:%S')}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_reservation_cursor(cursor):
+    """解析分页游标，格式错误时抛出 ValueError"""
     try:
-        # 检查调试模式
-        debug_setting = Settings.objects.filter(key='debug_mode').first()
-        debug_mode = debug_setting and debug_setting.value.lower() == 'true'
-        
-        # 从设置中获取企业微信Webhook URL；不存在则使用settings.DEFAULT_WEBHOOK_URL
-        from django.conf import settings as django_settings
-        webhook_setting = Settings.objects.filter(key='webhook_url').first()
-        webhook_url = (webhook_setting.value.strip() if (webhook_setting and webhook_setting.value) else getattr(django_settings, 'DEFAULT_WEBHOOK_URL', '').strip())
-        if not webhook_url:
-            error_msg = "Webhook URL未配置"
-            logger.warning(f"企业微信通知失败: {error_msg}")
-            if debug_mode:
-                print(f"[DEBUG] 企业微信通知失败: {error_msg}")
-            return False, error_msg
-        
-        if debug_mode:
-            print(f"[DEBUG] 使用的Webhook URL: {webhook_url}")
-            print(f"[DEBUG] 通知动作: {action}")
-            print(f"[DEBUG] 预约信息: {reservation.title} - {reservation.booker}")
-        
-        # 根据action确定标题
-        title_map = {
-            '新增': '新增会议室预约通知',
-            '修改': '会议室预约修改通知',
-            '编辑': '会议室预约修改通知',
-            '删除': '会议室预约取消(删除）通知'
-        }
-        title = title_map.get(action, '会议室预约通知')
-        
-        # 特殊字符转义函数（markdown_v2格式要求）
-        def escape_markdown_v2(text):
-            """转义markdown_v2格式中的特殊字符"""
-            if not text:
-                return text
-            # 需要转义的字符：_ * [ ] ( ) ~ ` > # + - = | { } . !
-            special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-            for char in special_chars:
-                text = text.replace(char, f'\\{char}')
-            return text
-        
-        # 构建markdown_v2格式的通知消息（转义特殊字符）
-        room_name = escape_markdown_v2(reservation.room.name)
-        title_escaped = escape_markdown_v2(reservation.title)
-        booker_escaped = escape_markdown_v2(reservation.booker)
-        department_escaped = escape_markdown_v2(reservation.department or '未填写')
-        
-        # 预先定义需要转义的字符串
-        dash_separator = "\\-"
-        triple_dash = "\\-\\-\\-"
-        date_format = reservation.date.strftime('%Y年%m月%d日')
-        time_range = f"{reservation.start_time.strftime('%H:%M')} {dash_separator} {reservation.end_time.strftime('%H:%M')}"
-        # 转为本地时区再格式化，避免显示为UTC
-        created_local = timezone.localtime(reservation.created_at)
-        created_time = created_local.strftime('%Y-%m-%d %H:%M:%S').replace('-', '\\-')
-        
-        markdown_content = f"""# 📅 {title}
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_str, time_str, res_id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|')
+        return (
+            datetime.date.fromisoformat(date_str),
+            datetime.time.fromisoformat(time_str),
+            int(res_id),
+        )
+    except (ValueError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f"分页游标无效: {cursor}") from e
 
-## 📋 会议详情
+def filter_reservations(params):
+    """
+    根据查询参数过滤预约
 
-| **项目** | **内容** |
-| :--- | :--- |
-| **会议室** | {room_name} |
-| **预约日期** | {date_format} |
-| **会议时间** | {time_range} |
-| **会议主题** | {title_escaped} |
-| **预约人** | {booker_escaped} |
-| **预约部门** | {department_escaped} |
+    支持的参数：
+        date_from / date_to: 日期范围（YYYY-MM-DD，闭区间）
+        room: 会议室ID，多个用逗号分隔
+        cursor: 上一页返回的游标
+        limit: 每页条数（不传则返回全部）
 
-{triple_dash}
+    Returns:
+        tuple: (queryset, limit)，参数无效时抛出 ValueError
+    """
+    queryset = Reservation.objects.all()
 
-> 📌 创建时间：{created_time}"""
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    try:
+        if date_from:
+            queryset = queryset.filter(date__gte=datetime.date.fromisoformat(date_from))
+        if date_to:
+            queryset = queryset.filter(date__lte=datetime.date.fromisoformat(date_to))
+    except ValueError:
+        raise ValueError('日期格式错误，应为 YYYY-MM-DD')
 
-        # 发送请求到企业微信群机器人
-        payload = {
-            "msgtype": "markdown_v2",
-            "markdown_v2": {
-                "content": markdown_content
-            }
-        }
-        
-        if debug_mode:
-            print(f"[DEBUG] 请求payload: {json.dumps(payload, ensure_ascii=False, indent=2)}")
-            # 添加编码调试信息
-            print(f"[DEBUG] markdown_v2内容编码: {markdown_content.encode('utf-8')}")
-            print(f"[DEBUG] markdown_v2内容长度: {len(markdown_content.encode('utf-8'))} 字节")
-        
-        logger.info(f"正在发送企业微信通知到: {webhook_url[:50]}...")
-        
+    room = params.get('room')
+    if room:
+        room_ids = [r.strip() for r in room.split(',') if r.strip()]
+        if not all(r.isdigit() for r in room_ids):
+            raise ValueError(f'会议室ID格式错误: {room}')
+        queryset = queryset.filter(room_id__in=[int(r) for r in room_ids])
+
+    cursor = params.get('cursor')
+    if cursor:
+        cursor_date, cursor_time, cursor_id = decode_reservation_cursor(cursor)
+        queryset = queryset.filter(
+            Q(date__gt=cursor_date) |
+            Q(date=cursor_date, start_time__gt=cursor_time) |
+            Q(date=cursor_date, start_time=cursor_time, id__gt=cursor_id)
+        )
+
+    limit = params.get('limit')
+    if limit is not None and limit != '':
         try:
-            # 禁用代理以避免代理连接问题
-            proxies = {
-                'http': None,
-                'https': None
-            }
-            
-            # 明确指定UTF-8编码的Content-Type头，确保中文字符正确传输
-            headers = {
-                'Content-Type': 'application/json; charset=utf-8'
-            }
-            
-            # 手动序列化JSON以确保UTF-8编码
-            json_data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
-            
-            if debug_mode:
-                print(f"[DEBUG] 发送的JSON数据: {json_data}")
-                print(f"[DEBUG] 请求头: {headers}")
-            
-            response = requests.post(webhook_url, data=json_data, headers=headers, timeout=10, proxies=proxies)
-            
-            if debug_mode:
-                print(f"[DEBUG] HTTP响应状态码: {response.status_code}")
-                print(f"[DEBUG] HTTP响应头: {dict(response.headers)}")
-                print(f"[DEBUG] HTTP响应内容: {response.text}")
-            
-            logger.info(f"企业微信API响应状态码: {response.status_code}")
-            
-            if response.status_code == 200:
-                try:
-                    result = response.json()
-                    if debug_mode:
-                        print(f"[DEBUG] 解析后的响应JSON: {result}")
-                    
-                    if result.get('errcode') == 0:
-                        success_msg = f"企业微信通知发送成功: {reservation.title}"
-                        logger.info(success_msg)
-                        if debug_mode:
-                            print(f"[DEBUG] {success_msg}")
-                        return True, "发送成功"
-                    else:
-                        errcode = result.get('errcode', 'unknown')
-                        errmsg = result.get('errmsg', '未知错误')
-                        error_msg = f"企业微信API错误 - errcode: {errcode}, errmsg: {errmsg}"
-                        logger.error(error_msg)
-                        if debug_mode:
-                            print(f"[DEBUG] {error_msg}")
-                        return False, f"API错误: {errcode} - {errmsg}"
-                except json.JSONDecodeError as e:
-                    error_msg = f"响应JSON解析失败: {str(e)}, 响应内容: {response.text}"
-                    logger.error(error_msg)
-                    if debug_mode:
-                        print(f"[DEBUG] {error_msg}")
-                    return False, f"响应解析失败: {response.text[:100]}"
-            else:
-                error_msg = f"HTTP请求失败 - 状态码: {response.status_code}, 响应: {response.text}"
-                logger.error(error_msg)
-                if debug_mode:
-                    print(f"[DEBUG] {error_msg}")
-                return False, f"HTTP错误: {response.status_code}"
-                
-        except requests.exceptions.Timeout:
-            error_msg = "请求超时（10秒）"
-            logger.error(f"企业微信通知发送超时: {error_msg}")
-            if debug_mode:
-                print(f"[DEBUG] {error_msg}")
-            return False, error_msg
-        except requests.exceptions.ConnectionError as e:
-            error_msg = f"网络连接错误: {str(e)}"
-            logger.error(f"企业微信通知网络错误: {error_msg}")
-            if debug_mode:
-                print(f"[DEBUG] {error_msg}")
-            return False, f"网络连接失败: {str(e)[:100]}"
-        except requests.exceptions.RequestException as e:
-            error_msg = f"请求异常: {str(e)}"
-            logger.error(f"企业微信通知请求异常: {error_msg}")
-            if debug_mode:
-                print(f"[DEBUG] {error_msg}")
-            return False, f"请求异常: {str(e)[:100]}"
-            
-    except Exception as e:
-        error_msg = f"发送企业微信通知时出现未知错误: {str(e)}"
-        logger.error(error_msg)
-        if debug_mode:
-            print(f"[DEBUG] {error_msg}")
-            import traceback
-            print(f"[DEBUG] 完整错误堆栈: {traceback.format_exc()}")
-        return False, f"未知错误: {str(e)[:100]}"
+            limit = int(limit)
+        except ValueError:
+            raise ValueError(f'limit 格式错误: {limit}')
+        if limit <= 0 or limit > MAX_RESERVATION_PAGE_SIZE:
+            raise ValueError(f'limit 必须在 1 到 {MAX_RESERVATION_PAGE_SIZE} 之间')
+    else:
+        limit = None
+
+    return queryset.order_by('date', 'start_time', 'id'), limit
 
 @csrf_exempt
 @require_http_methods(["GET"])
-def load_rooms(request):
-    """加载会议室数据"""
-    rooms = []
-    for room in Room.objects.all():
-        rooms.append({
-            'id': str(room.id),
-            'name': room.name,
-            'capacity': room.capacity,
-            'description': room.description or '',
-            'equipment': room.equipment or '',
-            'status': room.status
+@versioned_response(SCOPE_ROOMS, SCOPE_RESERVATIONS)
+@cached_payload('reservations', SCOPE_ROOMS, SCOPE_RESERVATIONS)
+def load_reservations(request):
+    """
+    加载预约数据
+
+    不带参数时返回全部预约（兼容旧前端）；可通过 date_from/date_to/room 过滤，
+    通过 limit/cursor 分页，下一页游标放在响应头 X-Next-Cursor 中。
+    """
+    try:
+        queryset, limit = filter_reservations(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    queryset = queryset.values(*RESERVATION_VALUE_FIELDS)
+    next_cursor = None
+    if limit is not None:
+        rows = list(queryset[:limit + 1])
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_reservation_cursor(rows[-1])
+    else:
+        # 服务端游标逐批读取，内存占用不随数据量增长
+        rows = queryset.iterator(chunk_size=STREAM_CHUNK_SIZE)
+
+    response = StreamingHttpResponse(
+        stream_json_array(rows, serialize_reservation_row),
+        content_type='application/json'
+    )
+    if next_cursor:
+        response['X-Next-Cursor'] = next_cursor
+    return response
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@versioned_response(SCOPE_SETTINGS)
+@cached_payload('settings', SCOPE_SETTINGS)
+def load_settings(request):
+    """加载设置数据"""
+    return JsonResponse(get_all_settings())
+
+def build_changes_payload(since, limit=MAX_CHANGES_PAGE_SIZE):
+    """读取游标之后的一页变更，并附上变更对象的当前数据（供 /api/changes/ 和事件推送使用）"""
+    changes = collect_changes(since, limit)
+    room_ids = changes['changed'][MODEL_ROOM]
+    reservation_ids = changes['changed'][MODEL_RESERVATION]
+    rooms = [serialize_room_row(row) for row in Room.objects.filter(id__in=room_ids).values(*ROOM_VALUE_FIELDS)] if room_ids else []
+    reservations = [
+        serialize_reservation_row(row)
+        for row in Reservation.objects.filter(id__in=reservation_ids).values(*RESERVATION_VALUE_FIELDS)
+    ] if reservation_ids else []
+
+    # 日志中记为修改但已不存在的对象（删除记录在后续分页中）按删除处理
+    deleted_rooms = set(changes['deleted'][MODEL_ROOM]) | (set(room_ids) - {int(r['id']) for r in rooms})
+    deleted_reservations = set(changes['deleted'][MODEL_RESERVATION]) | (set(reservation_ids) - {r['id'] for r in reservations})
+
+    return {
+        'reset': changes['reset'],
+        'cursor': changes['cursor'],
+        'has_more': changes['has_more'],
+        'rooms': rooms,
+        'reservations': reservations,
+        'deleted': {
+            'rooms': [str(room_id) for room_id in sorted(deleted_rooms)],
+            'reservations': sorted(deleted_reservations),
+        },
+    }
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def load_changes(request):
+    """
+    增量同步：返回游标之后变更的会议室/预约及删除记录
+
+    参数：
+        since: 上次返回的游标；不传时只返回当前游标（客户端随后做一次全量加载）
+        limit: 单次最多读取的日志条数
+    """
+    since = request.GET.get('since')
+    if since is None or since == '':
+        return JsonResponse({'reset': True, 'cursor': get_current_cursor()})
+    try:
+        since = int(since)
+        limit = int(request.GET.get('limit') or MAX_CHANGES_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '游标格式错误'}, status=400)
+    if since < 0 or limit <= 0 or limit > MAX_CHANGES_PAGE_SIZE:
+        return JsonResponse({'success': False, 'error': f'游标或 limit 无效（limit 最大 {MAX_CHANGES_PAGE_SIZE}）'}, status=400)
+
+    return JsonResponse(build_changes_payload(since, limit))
+
+def summarize_room_status(rooms, reservations, now_time):
+    """
+    计算每个会议室的当前/下一个会议
+
+    Args:
+        rooms: 会议室 values() 行
+        reservations: 当天预约 values() 行，按 (room_id, start_time) 排序
+        now_time: 当前本地时间
+
+    Returns:
+        tuple: (会议室状态列表, 下一个状态变化时间；当天不再变化时为None)
+    """
+    def brief(row):
+        return {
+            'id': row['id'],
+            'title': row['title'],
+            'booker': row['booker'],
+            'department': row['department'] or '',
+            'start': row['start_time'].strftime('%H:%M'),
+            'end': row['end_time'].strftime('%H:%M'),
+        }
+
+    by_room = {}
+    next_boundary = None
+    for row in reservations:
+        by_room.setdefault(row['room_id'], []).append(row)
+        for boundary in (row['start_time'], row['end_time']):
+            if boundary > now_time and (next_boundary is None or boundary < next_boundary):
+                next_boundary = boundary
+
+    summaries = []
+    for room in rooms:
+        current = None
+        upcoming = None
+        busy_until = None
+        for row in by_room.get(room['id'], []):
+            if row['start_time'] <= now_time < row['end_time']:
+                current = row
+                busy_until = row['end_time']
+            elif row['start_time'] > now_time and upcoming is None:
+                upcoming = row
+        # 连续的会议视为一直占用
+        if busy_until:
+            for row in by_room.get(room['id'], []):
+                if row['start_time'] <= busy_until < row['end_time']:
+                    busy_until = row['end_time']
+        summaries.append({
+            'id': str(room['id']),
+            'name': room['name'],
+            'capacity': room['capacity'],
+            'status': room['status'],
+            'current': brief(current) if current else None,
+            'next': brief(upcoming) if upcoming else None,
+            'busy_until': busy_until.strftime('%H:%M') if busy_until else None,
+            'free_until': upcoming['start_time'].strftime('%H:%M') if (upcoming and not current) else None,
         })
-    return JsonResponse(rooms, safe=False)
+    return summaries, next_boundary
 
 @csrf_exempt
 @require_http_methods(["GET"])
-def load_reservations(request):
-    """加载预约数据"""
-    reservations = []
-    for res in Reservation.objects.all():
-        reservations.append({
-            'id': res.id,
-            'room': str(res.room.id),
-            'date': res.date.isoformat(),
-            'start': res.start_time.strftime('%H:%M'),
-            'end': res.end_time.strftime('%H:%M'),
-            'title': res.title,
-            'booker': res.booker,
-            'department': res.department or '',
-            'room_id': res.room_id,
-            'room_name': res.room.name if res.room else '',
-            'created_at': timezone.localtime(res.created_at).strftime('%Y-%m-%d %H:%M:%S') if res.created_at else '',
+def room_status(request):
+    """
+    各会议室当前会议、下一个会议和空闲截止时间（供状态显示屏使用）
+
+    结果按数据版本缓存，有效期到当天下一个会议开始或结束的时刻为止。
+    """
+    now = timezone.localtime()
+    today = now.date()
+    now_time = now.time().replace(second=0, microsecond=0)
+    versions = get_data_versions(SCOPE_ROOMS, SCOPE_RESERVATIONS)
+    # 两次状态变化之间结果不变，缓存键只需数据版本和日期
+    cache_key = make_etag(versions, today.isoformat())
+    content = get_payload('room_status', cache_key)
+
+    if content is None:
+        rooms = Room.objects.values('id', 'name', 'capacity', 'status')
+        reservations = Reservation.objects.filter(date=today).order_by('room_id', 'start_time').values(
+            'id', 'room_id', 'start_time', 'end_time', 'title', 'booker', 'department'
+        )
+        summaries, next_boundary = summarize_room_status(rooms, reservations, now_time)
+        content = json.dumps({
+            'date': today.isoformat(),
+            'valid_until': next_boundary.strftime('%H:%M:%S') if next_boundary else None,
+            'rooms': summaries,
+        }, cls=DjangoJSONEncoder).encode('utf-8')
+
+        # 缓存到下一个状态变化时刻（当天没有变化时缓存到午夜）
+        if next_boundary:
+            expires_at = datetime.datetime.combine(today, next_boundary)
+        else:
+            expires_at = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time())
+        ttl = max(int((timezone.make_aware(expires_at) - now).total_seconds()), 1)
+        set_payload('room_status', cache_key, (SCOPE_ROOMS, SCOPE_RESERVATIONS), content, timeout=ttl)
+
+    etag = '"%s"' % hashlib.sha1(content).hexdigest()[:20]
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+def parse_time_window(params):
+    """
+    解析 date/start/end 查询参数
+
+    Returns:
+        tuple: (date, start_time, end_time)，参数无效时抛出 ValueError
+    """
+    date_str = params.get('date')
+    start_str = params.get('start')
+    end_str = params.get('end')
+    if not date_str or not start_str or not end_str:
+        raise ValueError('date、start、end 参数不能为空')
+    try:
+        date_obj = datetime.date.fromisoformat(date_str)
+    except ValueError:
+        raise ValueError('日期格式错误，应为 YYYY-MM-DD')
+    try:
+        start_time = datetime.datetime.strptime(start_str, '%H:%M').time()
+        end_time = datetime.datetime.strptime(end_str, '%H:%M').time()
+    except ValueError:
+        raise ValueError('时间格式错误，应为 HH:MM')
+    if start_time >= end_time:
+        raise ValueError('开始时间必须早于结束时间')
+    return date_obj, start_time, end_time
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@versioned_response(SCOPE_ROOMS, SCOPE_RESERVATIONS)
+@cached_payload('availability', SCOPE_ROOMS, SCOPE_RESERVATIONS)
+def availability(request):
+    """
+    查找指定时间段内可用的会议室
+
+    参数：
+        date / start / end: 日期和时间段（YYYY-MM-DD、HH:MM）
+        min_capacity: 最少容纳人数
+        equipment: 需要的设备，多个用逗号分隔（按包含匹配）
+
+    结果按容量从小到大排列，最贴合人数的会议室排在最前。
+    """
+    try:
+        date_obj, start_time, end_time = parse_time_window(request.GET)
+        min_capacity = int(request.GET.get('min_capacity') or 0)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    # 与时间段重叠的预约（使用 (date, start_time) 索引），作为子查询排除
+    busy_rooms = Reservation.objects.filter(
+        date=date_obj,
+        start_time__lt=end_time,
+        end_time__gt=start_time
+    ).values('room_id')
+
+    rooms = Room.objects.filter(status='available', capacity__gte=min_capacity).exclude(id__in=busy_rooms)
+    equipment = request.GET.get('equipment', '')
+    for item in (e.strip() for e in equipment.split(',')):
+        if item:
+            rooms = rooms.filter(equipment__icontains=item)
+
+    results = []
+    for row in rooms.order_by('capacity', 'name', 'id').values(*ROOM_VALUE_FIELDS):
+        room = serialize_room_row(row)
+        room['spare_seats'] = row['capacity'] - min_capacity if min_capacity else None
+        results.append(room)
+
+    return JsonResponse({
+        'date': date_obj.isoformat(),
+        'start': start_time.strftime('%H:%M'),
+        'end': end_time.strftime('%H:%M'),
+        'rooms': results,
+    })
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@versioned_response(SCOPE_ROOMS, SCOPE_RESERVATIONS)
+@cached_payload('free_slots', SCOPE_ROOMS, SCOPE_RESERVATIONS)
+def free_slots(request):
+    """
+    按占用位图列出会议室某天的空闲时段
+
+    参数：
+        date: 日期（YYYY-MM-DD）
+        room: 会议室ID，多个用逗号分隔（不传则为全部可用会议室）
+        day_start / day_end: 统计范围（HH:MM，默认 08:00-18:00）
+        min_minutes: 最短空闲时长（分钟，默认15）
+    """
+    try:
+        date_obj = datetime.date.fromisoformat(request.GET.get('date', ''))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '日期格式错误，应为 YYYY-MM-DD'}, status=400)
+    try:
+        day_start = datetime.datetime.strptime(request.GET.get('day_start') or '08:00', '%H:%M').time()
+        day_end = datetime.datetime.strptime(request.GET.get('day_end') or '18:00', '%H:%M').time()
+        min_minutes = int(request.GET.get('min_minutes') or SLOT_MINUTES)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '时间或时长格式错误'}, status=400)
+
+    rooms = Room.objects.all()
+    room = request.GET.get('room')
+    if room:
+        room_ids = [r.strip() for r in room.split(',') if r.strip()]
+        if not all(r.isdigit() for r in room_ids):
+            return JsonResponse({'success': False, 'error': f'会议室ID格式错误: {room}'}, status=400)
+        rooms = rooms.filter(id__in=[int(r) for r in room_ids])
+    else:
+        rooms = rooms.filter(status='available')
+
+    masks = get_occupancy_masks(date_obj)
+    results = []
+    for row in rooms.order_by('id').values('id', 'name', 'capacity', 'status'):
+        ranges = free_ranges(masks.get(row['id'], 0), day_start, day_end, min_minutes)
+        results.append({
+            'id': str(row['id']),
+            'name': row['name'],
+            'capacity': row['capacity'],
+            'status': row['status'],
+            'free': [{'start': start.strftime('%H:%M'), 'end': end.strftime('%H:%M')} for start, end in ranges],
         })
-    return JsonResponse(reservations, safe=False)
+    return JsonResponse({'date': date_obj.isoformat(), 'rooms': results})
 
 @csrf_exempt
 @require_http_methods(["GET"])
-def load_settings(request):
-    """加载设置数据"""
-    settings = {s.key: s.value for s in Settings.objects.all()}
-    return JsonResponse(settings)
+def cache_stats(request):
+    """响应缓存命中统计"""
+    return JsonResponse(get_cache_stats())
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def webhook_stats(request):
+    """本进程的Webhook调用延迟统计和熔断状态"""
+    return JsonResponse(get_webhook_stats())
+
+# 单条预约接口可写入的字段（前端使用 start/end，兼容 start_time/end_time）
+RESERVATION_WRITABLE_FIELDS = ('room', 'date', 'start', 'end', 'title', 'booker', 'department')
+
+def serialize_room(room):
+    """将会议室对象转换为与 load_rooms 一致的前端格式"""
+    return serialize_room_row({field: getattr(room, field) for field in ROOM_VALUE_FIELDS})
+
+def serialize_reservation(reservation):
+    """将预约对象转换为与 load_reservations 一致的前端格式"""
+    return serialize_reservation_row({
+        'id': reservation.id,
+        'room_id': reservation.room_id,
+        'room__name': reservation.room.name,
+        'date': reservation.date,
+        'start_time': reservation.start_time,
+        'end_time': reservation.end_time,
+        'title': reservation.title,
+        'booker': reservation.booker,
+        'department': reservation.department,
+        'created_at': reservation.created_at,
+        'version': reservation.version,
+    })
+
+def parse_reservation_data(data, reservation=None):
+    """
+    校验单条预约数据，返回可直接赋值给模型的字段
+
+    Args:
+        data: 请求数据；reservation 不为空时为部分更新，未提供的字段沿用原值
+        reservation: 被修改的预约
+
+    Raises:
+        ValueError: 数据不合法
+    """
+    if not isinstance(data, dict):
+        raise ValueError('数据格式错误：期望对象')
+    data = dict(data)
+    if 'start_time' in data and 'start' not in data:
+        data['start'] = data['start_time']
+    if 'end_time' in data and 'end' not in data:
+        data['end'] = data['end_time']
+
+    if reservation is not None:
+        current = {
+            'room': reservation.room_id,
+            'date': reservation.date.isoformat(),
+            'start': reservation.start_time.strftime('%H:%M'),
+            'end': reservation.end_time.strftime('%H:%M'),
+            'title': reservation.title,
+            'booker': reservation.booker,
+            'department': reservation.department or '',
+        }
+        current.update({key: data[key] for key in RESERVATION_WRITABLE_FIELDS if key in data})
+        data = current
+
+    title = str(data.get('title') or '').strip()
+    booker = str(data.get('booker') or '').strip()
+    if not title:
+        raise ValueError('预约标题不能为空')
+    if not booker:
+        raise ValueError('预约人不能为空')
+    if not data.get('date'):
+        raise ValueError('预约日期不能为空')
+    if not data.get('start') or not data.get('end'):
+        raise ValueError('预约时间不能为空')
+    if not data.get('room'):
+        raise ValueError('会议室不能为空')
+
+    try:
+        date_obj = datetime.date.fromisoformat(str(data['date']))
+    except ValueError:
+        raise ValueError('预约日期格式错误')
+    try:
+        start_time = datetime.datetime.strptime(str(data['start']), '%H:%M').time()
+        end_time = datetime.datetime.strptime(str(data['end']), '%H:%M').time()
+    except ValueError:
+        raise ValueError('预约时间格式错误')
+    if start_time >= end_time:
+        raise ValueError('开始时间必须早于结束时间')
+
+    room_id = str(data['room']).strip()
+    if not room_id.isdigit():
+        raise ValueError(f'会议室ID格式错误: {room_id}')
+    if reservation is not None and int(room_id) == reservation.room_id:
+        room = reservation.room
+    else:
+        room = Room.objects.filter(id=int(room_id)).first()
+    if room is None:
+        raise ValueError('会议室不存在')
+
+    return {
+        'room': room,
+        'date': date_obj,
+        'start_time': start_time,
+        'end_time': end_time,
+        'title': title,
+        'booker': booker,
+        'department': str(data.get('department') or ''),
+    }
+
+def summarize_names(names, limit=10):
+    """日志中列出名称，超过 limit 个时只列出前几个和总数"""
+    names = list(names)
+    if len(names) <= limit:
+        return ', '.join(names)
+    return f"{', '.join(names[:limit])} 等{len(names)}个"
+
+def write_error_response(action, error):
+    """写入失败：锁等待重试用尽时返回 503，提示客户端稍后重试"""
+    error_msg = f"{action}: {str(error)}"
+    logger.error(error_msg)
+    if is_lock_error(error):
+        response = JsonResponse({'success': False, 'error': '系统繁忙，请稍后重试'}, status=503)
+        response['Retry-After'] = '1'
+        return response
+    return JsonResponse({'success': False, 'error': error_msg}, status=500)
+
+def conflict_response():
+    return JsonResponse({'success': False, 'error': '该时间段与已有预约冲突，请选择其他时间', 'code': 'TIME_CONFLICT'}, status=409)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def create_reservation(request):
+    """
+    新增单条预约，只写入这一行
+
+    冲突检查和写入在先拿写锁的同一个短事务中完成，
+    多人同时预约同一时段时只有一个成功，其余返回 409。
+    列表ETag的更新见 collection_is_current。
+    """
+    try:
+        data = json.loads(request.body)
+        fields = parse_reservation_data(data)
+    except ValueError as e:
+        # json.JSONDecodeError 也是 ValueError 的子类
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    def book():
+        if has_conflict(fields['room'].id, fields['date'], fields['start_time'], fields['end_time']):
+            return None
+        reservation = Reservation.objects.create(**fields)
+        enqueue_notifications([(reservation, '新增')])
+        return reservation
+
+    def book_with_etag():
+        up_to_date = collection_is_current(request)
+        reservation = book()
+        return reservation, collection_etag_after_write(up_to_date)
+
+    try:
+        reservation, collection_etag = run_in_write_transaction(SCOPE_RESERVATIONS, book_with_etag)
+    except Exception as e:
+        return write_error_response('新增预约失败', e)
+    if reservation is None:
+        return conflict_response()
+
+    logger.info(f"新增预约ID {reservation.id}")
+    response = with_row_etag(JsonResponse({'success': True, 'reservation': serialize_reservation(reservation)}, status=201), reservation)
+    return with_collection_etag(response, collection_etag)
+
+def version_conflict_response(error, conflicts):
+    """版本冲突：返回服务器上的当前数据，由客户端合并后重试"""
+    return JsonResponse({
+        'success': False,
+        'error': error,
+        'code': 'VERSION_CONFLICT',
+        'conflicts': conflicts,
+    }, status=409)
+
+def collection_is_current(request):
+    """
+    单条写入前（在写事务内调用）：客户端持有的预约列表ETag是否仍是最新的
+
+    单条接口的 If-Match 用于行版本号，列表ETag（load_reservations 返回的ETag）
+    通过 X-Collection-ETag 请求头携带。列表是最新的时，写入成功后在同名响应头中返回
+    写入后的列表ETag，客户端更新本地列表后直接替换保存的ETag，之后整体保存不会误报冲突；
+    未返回时说明列表已过期，需要重新加载。
+    """
+    client_etag = parse_etag_header(request.headers.get('X-Collection-ETag', ''))
+    return client_etag is not None and client_etag == get_collection_etag(SCOPE_ROOMS, SCOPE_RESERVATIONS)
+
+def collection_etag_after_write(up_to_date):
+    """写入后的预约列表ETag（写入前列表已过期时为 None）"""
+    return get_collection_etag(SCOPE_ROOMS, SCOPE_RESERVATIONS) if up_to_date else None
+
+def with_collection_etag(response, collection_etag):
+    if collection_etag and response.status_code < 300:
+        response['X-Collection-ETag'] = collection_etag
+    return response
+
+def with_row_etag(response, instance):
+    """单行接口的ETag为行版本号，修改/删除时通过 If-Match 带回"""
+    response['ETag'] = f'"{instance.version}"'
+    return response
+
+@csrf_exempt
+@require_http_methods(["GET", "PATCH", "DELETE"])
+def reservation_detail(request, reservation_id):
+    """
+    单条预约接口
+
+    GET: 读取预约，ETag 为行版本号
+    PATCH: 修改预约，只需提交变化的字段
+    DELETE: 删除预约
+
+    PATCH / DELETE 可通过 If-Match 请求头（或请求体中的 version）携带读取时的版本号，
+    版本不一致时返回 409 和当前数据，而不是覆盖其他人的修改。
+    """
+    if request.method == 'GET':
+        reservation = Reservation.objects.select_related('room').filter(id=reservation_id).first()
+        if reservation is None:
+            return JsonResponse({'success': False, 'error': '预约不存在'}, status=404)
+        return with_row_etag(JsonResponse({'success': True, 'reservation': serialize_reservation(reservation)}), reservation)
+
+    data = None
+    try:
+        if request.method == 'PATCH':
+            data = json.loads(request.body)
+        expected_version = parse_row_version(request, data)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': f'数据格式错误: {str(e)}'}, status=400)
+
+    def apply():
+        if expected_version is not None and not claim_row_version(Reservation, reservation_id, expected_version):
+            current = Reservation.objects.select_related('room').filter(id=reservation_id).first()
+            if current is None:
+                return JsonResponse({'success': False, 'error': '预约不存在'}, status=404)
+            return version_conflict_response('预约已被其他人修改，请刷新后重试', [serialize_reservation(current)])
+
+        reservation = Reservation.objects.select_related('room').filter(id=reservation_id).first()
+        if reservation is None:
+            return JsonResponse({'success': False, 'error': '预约不存在'}, status=404)
+
+        if request.method == 'DELETE':
+            # 删除后对象不再有ID，先写入通知
+            enqueue_notifications([(reservation, '删除')])
+            reservation.delete()
+            logger.info(f"删除预约ID {reservation_id}")
+            return JsonResponse({'success': True})
+
+        try:
+            fields = parse_reservation_data(data, reservation)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+        current = {name: getattr(reservation, name) for name in fields}
+        # 部门为空时数据库中可能是 None
+        current['department'] = current['department'] or ''
+        changed = [name for name, value in fields.items() if current[name] != value]
+        if not changed:
+            return with_row_etag(JsonResponse({'success': True, 'reservation': serialize_reservation(reservation)}), reservation)
+
+        # 只修改标题、预约人等字段时不需要检查冲突
+        if set(changed) & set(SLOT_FIELDS) and has_conflict(
+                fields['room'].id, fields['date'], fields['start_time'], fields['end_time'],
+                exclude_id=reservation.id):
+            return conflict_response()
+        for name in changed:
+            setattr(reservation, name, fields[name])
+        reservation.save(update_fields=changed)
+        enqueue_notifications([(reservation, '编辑')])
+        logger.info(f"修改预约ID {reservation_id}，变更字段: {', '.join(changed)}")
+        return with_row_etag(JsonResponse({'success': True, 'reservation': serialize_reservation(reservation)}), reservation)
+
+    def apply_with_etag():
+        up_to_date = collection_is_current(request)
+        response = apply()
+        return with_collection_etag(response, collection_etag_after_write(up_to_date and response.status_code < 300))
+
+    try:
+        return run_in_write_transaction(SCOPE_RESERVATIONS, apply_with_etag)
+    except Exception as e:
+        return write_error_response('保存预约失败', e)
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def save_rooms(request):
-    """保存会议室数据"""
-    from django.db import transaction
-    
+    """
+    保存会议室数据
+
+    现有会议室查询一次，在内存中比较出新增、修改和删除的会议室，
+    要删除的会议室是否有预约用一次聚合查询检查，再 bulk_create / bulk_update / 删除，
+    查询次数与会议室数量无关。批量写入不触发模型信号，数据版本和变更日志在这里统一更新。
+
+    与 save_reservations 相同，每行的 version 和 If-Match（load_rooms 返回的ETag）
+    用于检测他人的修改，冲突时返回 409 和当前数据。
+    """
     try:
         data = json.loads(request.body)
         
@@ -296,7 +798,8 @@ def save_rooms(request):
         if not isinstance(data, list):
             return JsonResponse({'success': False, 'error': '数据格式错误：期望数组格式'}, status=400)
         
-        # 验证每个会议室数据
+        # 验证并解析每个会议室数据：[(会议室ID或None, 是否为临时ID, 版本号, 字段元组)]
+        parsed_rows = []
         for i, room_data in enumerate(data):
             if not isinstance(room_data, dict):
                 return JsonResponse({'success': False, 'error': f'第{i+1}个会议室数据格式错误'}, status=400)
@@ -313,131 +816,167 @@ def save_rooms(request):
                     return JsonResponse({'success': False, 'error': f'会议室"{name}"的容量必须大于0'}, status=400)
             except (ValueError, TypeError):
                 return JsonResponse({'success': False, 'error': f'会议室"{name}"的容量格式错误'}, status=400)
-        
-        # 检查是否为批量删除操作（数据量显著减少）
-        existing_count = Room.objects.count()
-        new_count = len(data)
-        
-        if existing_count > 0 and new_count < existing_count * 0.5:
-            # 如果新数据量少于现有数据的50%，认为可能是意外删除
-            logger.warning(f"检测到可能的批量删除操作：现有{existing_count}个会议室，新数据只有{new_count}个")
-            return JsonResponse({
-                'success': False, 
-                'error': f'安全检查失败：检测到可能的批量删除操作（现有{existing_count}个会议室，新数据只有{new_count}个）。如需批量删除，请使用管理后台。',
-                'code': 'BULK_DELETE_DETECTED'
-            }, status=400)
+            
+            version = room_data.get('version')
+            if version not in (None, '') and not str(version).strip().isdigit():
+                return JsonResponse({'success': False, 'error': f'会议室"{name}"的版本号格式错误'}, status=400)
+            
+            room_id = room_data.get('id')
+            parsed_rows.append((
+                int(room_id) if room_id and str(room_id).isdigit() else None,
+                bool(room_id) and str(room_id).startswith('room'),
+                int(version) if version not in (None, '') else None,
+                (
+                    name, capacity, room_data.get('description', '').strip(),
+                    room_data.get('equipment', '').strip(), room_data.get('status', 'available'),
+                ),
+            ))
         
         # 备份功能已移除 - 不再自动备份
         
         # 使用事务确保数据一致性
-        with transaction.atomic():
-            # 获取所有现有的房间ID
-            existing_rooms = {room.id: room for room in Room.objects.all()}
-            received_ids = set()
+        if_match = parse_if_match(request)
+        
+        def apply_changes():
+            existing = Room.objects.in_bulk()
+            existing_count = len(existing)
+            new_count = len(parsed_rows)
             
-            # 处理每个会议室数据
-            for room_data in data:
-                room_id = room_data.get('id')
-                name = room_data.get('name', '').strip()
-                capacity = int(room_data.get('capacity', 0))
-                description = room_data.get('description', '').strip()
-                equipment = room_data.get('equipment', '').strip()
-                status = room_data.get('status', 'available')
-                
-                if room_id and str(room_id).isdigit():
-                    # 更新现有房间
-                    room_id = int(room_id)
+            # 检查是否为批量删除操作（数据量显著减少）
+            if existing_count > 0 and new_count < existing_count * 0.5:
+                # 如果新数据量少于现有数据的50%，认为可能是意外删除
+                logger.warning(f"检测到可能的批量删除操作：现有{existing_count}个会议室，新数据只有{new_count}个")
+                return JsonResponse({
+                    'success': False, 
+                    'error': f'安全检查失败：检测到可能的批量删除操作（现有{existing_count}个会议室，新数据只有{new_count}个）。如需批量删除，请使用管理后台。',
+                    'code': 'BULK_DELETE_DETECTED'
+                }, status=400)
+            
+            up_to_date = if_match is not None and if_match == get_collection_etag(SCOPE_ROOMS)
+            
+            # 版本检查：带版本号的会议室必须与服务器一致
+            conflicts = []
+            for room_id, _, version, _ in parsed_rows:
+                if version is None or room_id is None:
+                    continue
+                room = existing.get(room_id)
+                if room is None:
+                    conflicts.append({'id': str(room_id), 'deleted': True})
+                elif room.version != version:
+                    conflicts.append(serialize_room(room))
+            if if_match is not None and not up_to_date:
+                # 列表已过期时，不在提交数据中的会议室可能是他人新增的
+                sent_ids = {room_id for room_id, _, _, _ in parsed_rows if room_id is not None}
+                conflicts.extend(serialize_room(room) for room_id, room in existing.items() if room_id not in sent_ids)
+            if conflicts:
+                logger.warning(f"保存会议室数据时发现{len(conflicts)}条版本冲突")
+                return version_conflict_response('会议室数据已被其他人修改，请刷新后重试', conflicts)
+            
+            # 临时ID（前端新建的 room_xxx）按名称匹配已有会议室，同名时取ID最小的
+            by_name = {}
+            for room in sorted(existing.values(), key=lambda room: room.id):
+                by_name.setdefault(room.name, room)
+            
+            to_create = []
+            # 同一会议室在请求中出现多次时以最后一次为准
+            to_update = {}
+            received_ids = set()
+            for room_id, temporary, _, fields in parsed_rows:
+                if room_id is not None:
+                    room = existing.get(room_id)
                     received_ids.add(room_id)
-                    
-                    room, created = Room.objects.update_or_create(
-                        id=room_id,
-                        defaults={
-                            'name': name,
-                            'capacity': capacity,
-                            'description': description,
-                            'equipment': equipment,
-                            'status': status
-                        }
-                    )
-                    
-                    if not created:
-                        logger.info(f"更新会议室: {name} (ID: {room_id})")
-                    else:
-                        logger.info(f"创建会议室: {name} (ID: {room_id})")
-                        
-                elif room_id and str(room_id).startswith('room'):
-                    # 处理临时ID，查找是否有同名房间
-                    existing_room = Room.objects.filter(name=name).first()
-                    if existing_room:
-                        # 更新现有房间
-                        received_ids.add(existing_room.id)
-                        existing_room.capacity = capacity
-                        existing_room.description = description
-                        existing_room.equipment = equipment
-                        existing_room.status = status
-                        existing_room.save()
-                        logger.info(f"更新现有会议室: {name} (ID: {existing_room.id})")
-                    else:
-                        # 创建新房间
-                        new_room = Room.objects.create(
-                            name=name,
-                            capacity=capacity,
-                            description=description,
-                            equipment=equipment,
-                            status=status
-                        )
-                        received_ids.add(new_room.id)
-                        logger.info(f"创建新会议室: {name} (ID: {new_room.id})")
+                elif temporary:
+                    room = by_name.get(fields[0])
                 else:
-                    # 创建新房间
-                    new_room = Room.objects.create(
-                        name=name,
-                        capacity=capacity,
-                        description=description,
-                        equipment=equipment,
-                        status=status
-                    )
-                    received_ids.add(new_room.id)
-                    logger.info(f"创建新会议室: {name} (ID: {new_room.id})")
-            
-            # 安全删除：只删除明确不在新数据中的房间，且需要额外确认
-            existing_ids = set(existing_rooms.keys())
-            ids_to_delete = existing_ids - received_ids
+                    room = None
+                
+                if room is None:
+                    # 新ID、没有ID或没有同名会议室：新增
+                    room = Room(id=room_id)
+                    to_create.append(room)
+                    by_name.setdefault(fields[0], room)
+                elif room.id is not None:
+                    received_ids.add(room.id)
+                
+                current = (room.name, room.capacity, room.description or '', room.equipment or '', room.status)
+                if current == fields:
+                    continue
+                room.name, room.capacity, room.description, room.equipment, room.status = fields
+                if room.id in existing and room.id not in to_update:
+                    room.version += 1
+                    to_update[room.id] = room
             
+            # 安全删除：只删除明确不在新数据中的房间，且有预约的房间不允许删除
+            ids_to_delete = sorted(existing.keys() - received_ids)
             if ids_to_delete:
-                # 检查要删除的房间是否有预约
-                rooms_with_reservations = []
-                for room_id in ids_to_delete:
-                    room = existing_rooms[room_id]
-                    if Reservation.objects.filter(room=room).exists():
-                        rooms_with_reservations.append(room.name)
-                
+                booked = Reservation.objects.filter(room_id__in=ids_to_delete).values_list('room_id').annotate(count=Count('id'))
+                rooms_with_reservations = [existing[room_id].name for room_id, _ in booked]
                 if rooms_with_reservations:
                     # 如果有预约，不允许删除
-                    raise Exception(f"无法删除有预约记录的会议室: {', '.join(rooms_with_reservations)}")
-                
-                # 删除没有预约的房间
-                deleted_rooms = [existing_rooms[room_id].name for room_id in ids_to_delete]
-                Room.objects.filter(id__in=ids_to_delete).delete()
-                logger.warning(f"删除会议室: {', '.join(deleted_rooms)}")
+                    raise ValueError(f"无法删除有预约记录的会议室: {', '.join(rooms_with_reservations)}")
+            
+            if to_create:
+                Room.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+                logger.info(f"创建会议室: {summarize_names(room.name for room in to_create)}")
+            if to_update:
+                Room.objects.bulk_update(
+                    list(to_update.values()),
+                    ['name', 'capacity', 'description', 'equipment', 'status', 'version'],
+                    batch_size=BULK_BATCH_SIZE
+                )
+                logger.info(f"更新会议室: {summarize_names(room.name for room in to_update.values())}")
+            if ids_to_delete:
+                for i in range(0, len(ids_to_delete), BULK_BATCH_SIZE):
+                    batch = ids_to_delete[i:i + BULK_BATCH_SIZE]
+                    # 没有预约的会议室也不会有占用位图，清理残留后直接删除，跳过逐行收集和信号
+                    RoomOccupancy.objects.filter(room_id__in=batch)._raw_delete(RoomOccupancy.objects.db)
+                    Room.objects.filter(id__in=batch)._raw_delete(Room.objects.db)
+                logger.warning(f"删除会议室: {summarize_names(existing[room_id].name for room_id in ids_to_delete)}")
+            
+            if to_create or to_update or ids_to_delete:
+                bump_data_version(SCOPE_ROOMS)
+                # SQLite 3.35+ 的 bulk_create 会回填自增ID
+                record_changes(MODEL_ROOM, ACTION_CREATE, [room.id for room in to_create if room.id is not None])
+                record_changes(MODEL_ROOM, ACTION_UPDATE, list(to_update))
+                record_changes(MODEL_ROOM, ACTION_DELETE, ids_to_delete)
+            new_etag = get_collection_etag(SCOPE_ROOMS) if up_to_date else None
+            
+            logger.info(
+                f"会议室数据保存成功: 新增{len(to_create)}个，修改{len(to_update)}个，删除{len(ids_to_delete)}个"
+            )
+            response = JsonResponse({
+                'success': True, 
+                'message': '会议室数据保存成功',
+                'etag': new_etag,
+            })
+            if new_etag:
+                response['ETag'] = new_etag
+            return response
         
-        logger.info("会议室数据保存成功")
-        return JsonResponse({
-            'success': True, 
-            'message': '会议室数据保存成功'
-        })
+        return run_in_write_transaction(SCOPE_ROOMS, apply_changes)
         
     except Exception as e:
-        error_msg = f"保存会议室数据失败: {str(e)}"
-        logger.error(error_msg)
-        return JsonResponse({'success': False, 'error': error_msg}, status=500)
+        return write_error_response('保存会议室数据失败', e)
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def save_reservations(request):
-    """保存预约数据"""
-    from django.db import transaction
-    
+    """
+    保存预约数据（全量提交）
+
+    整个比较和写入在先拿写锁的事务中完成（见 transactions.py），
+    新增或修改的预约与其他预约时间重叠时返回 409。
+
+    会议室和现有预约各查询一次，在内存中比较出新增、修改、未变化和删除的预约，
+    再分批 bulk_create / bulk_update / 删除，查询次数与提交的行数无关。
+    批量写入不触发模型信号，数据版本、变更日志和占用位图在这里统一更新。
+
+    并发控制：
+        每行的 version 为读取时的行版本号，与服务器不一致说明已被他人修改；
+        If-Match 为读取列表时 load_reservations 返回的ETag，列表已过期时
+        不在提交数据中的预约可能是他人新增的，不会被删除。
+        出现以上情况时返回 409 和冲突的当前数据，不写入任何内容。
+    """
     try:
         data = json.loads(request.body)
         
@@ -452,7 +991,8 @@ def save_reservations(request):
         if not isinstance(reservations_data, list):
             return JsonResponse({'success': False, 'error': '预约数据格式错误：期望数组格式'}, status=400)
         
-        # 验证每个预约数据
+        # 验证并解析每个预约数据：[(预约ID或None, 字段元组)]
+        parsed_rows = []
         for i, res_data in enumerate(reservations_data):
             if not isinstance(res_data, dict):
                 return JsonResponse({'success': False, 'error': f'第{i+1}个预约数据格式错误'}, status=400)
@@ -497,135 +1037,170 @@ def save_reservations(request):
             if start_time >= end_time:
                 return JsonResponse({'success': False, 'error': f'第{i+1}个预约的开始时间必须早于结束时间'}, status=400)
             
-            # 验证会议室存在
-            try:
-                Room.objects.get(id=room_id)
-            except Room.DoesNotExist:
+            if not str(room_id).strip().isdigit():
                 return JsonResponse({'success': False, 'error': f'第{i+1}个预约的会议室不存在'}, status=400)
+            
+            res_id = res_data.get('id')
+            if res_id not in (None, '') and not str(res_id).strip().isdigit():
+                return JsonResponse({'success': False, 'error': f'第{i+1}个预约的ID格式错误'}, status=400)
+            
+            version = res_data.get('version')
+            if version not in (None, '') and not str(version).strip().isdigit():
+                return JsonResponse({'success': False, 'error': f'第{i+1}个预约的版本号格式错误'}, status=400)
+            
+            parsed_rows.append((
+                int(res_id) if res_id not in (None, '') else None,
+                int(version) if version not in (None, '') else None,
+                (int(room_id), date_obj, start_time, end_time, title, booker, res_data.get('department', '') or ''),
+            ))
         
-        # 获取现有数据统计
-        existing_count = Reservation.objects.count()
-        new_count = len(reservations_data)
-        
-        # 批量删除安全检查
-        if existing_count > 0 and new_count < existing_count * 0.5:
-            return JsonResponse({
-                'success': False, 
-                'error': f'安全检查失败：新数据量({new_count})显著少于现有数据量({existing_count})，可能存在数据丢失风险。如确需执行此操作，请先手动备份数据。'
-            }, status=400)
+        # 一次查询验证所有会议室存在
+        rooms = Room.objects.in_bulk({fields[0] for _, _, fields in parsed_rows})
+        for i, (_, _, fields) in enumerate(parsed_rows):
+            if fields[0] not in rooms:
+                return JsonResponse({'success': False, 'error': f'第{i+1}个预约的会议室不存在'}, status=400)
         
         # 备份功能已移除 - 不再自动备份
         
         # 使用事务确保数据一致性
-        with transaction.atomic():
-            # 获取所有现有的预约ID
-            existing_ids = set(Reservation.objects.values_list('id', flat=True))
+        if_match = parse_if_match(request)
+        
+        def apply_changes():
+            existing = {r.id: r for r in Reservation.objects.select_related('room')}
+            # 客户端读取列表后数据是否未被他人修改
+            up_to_date = if_match is not None and if_match == get_collection_etag(SCOPE_ROOMS, SCOPE_RESERVATIONS)
+            existing_count = len(existing)
+            new_count = len(parsed_rows)
+
+            # 批量删除安全检查
+            if existing_count > 0 and new_count < existing_count * 0.5:
+                return JsonResponse({
+                    'success': False, 
+                    'error': f'安全检查失败：新数据量({new_count})显著少于现有数据量({existing_count})，可能存在数据丢失风险。如确需执行此操作，请先手动备份数据。'
+                }, status=400)
+
+            to_create = []
+            to_update = []
+            unchanged = 0
             received_ids = set()
+            # 需要重建占用位图的 (会议室, 日期)，以及时段有变化、需要检查重叠的预约
+            slot_pairs = set()
+            slot_changed = []
+            conflicts = []
+            for res_id, version, fields in parsed_rows:
+                if res_id is not None:
+                    # 同一请求中重复的ID只处理第一条
+                    if res_id in received_ids:
+                        continue
+                    received_ids.add(res_id)
+                room_id, date_obj, start_time, end_time, title, booker, department = fields
+                reservation = existing.get(res_id)
+                if reservation is None and version is not None:
+                    # 带版本号说明是从服务器读取的，已被他人删除，不再重新创建
+                    conflicts.append({'id': res_id, 'deleted': True})
+                    continue
+                if reservation is not None and version is not None and version != reservation.version:
+                    conflicts.append(serialize_reservation(reservation))
+                    continue
+                if reservation is None:
+                    # 新ID或没有ID：新增
+                    to_create.append(Reservation(
+                        id=res_id, room=rooms[room_id], date=date_obj, start_time=start_time,
+                        end_time=end_time, title=title, booker=booker, department=department
+                    ))
+                    slot_pairs.add((room_id, date_obj))
+                    slot_changed.append(to_create[-1])
+                    continue
+
+                current = (
+                    reservation.room_id, reservation.date, reservation.start_time, reservation.end_time,
+                    reservation.title, reservation.booker, reservation.department or '',
+                )
+                if current == fields:
+                    unchanged += 1
+                    continue
+                if current[:4] != fields[:4]:
+                    slot_pairs.add(current[:2])
+                    slot_pairs.add((room_id, date_obj))
+                    slot_changed.append(reservation)
+                reservation.room = rooms[room_id]
+                reservation.date = date_obj
+                reservation.start_time = start_time
+                reservation.end_time = end_time
+                reservation.title = title
+                reservation.booker = booker
+                reservation.department = department
+                reservation.version += 1
+                to_update.append(reservation)
+
+            to_delete = [existing[res_id] for res_id in existing.keys() - received_ids]
+            if to_delete and if_match is not None and not up_to_date:
+                # 列表已过期，无法区分客户端删除的预约和他人新增的预约
+                conflicts.extend(serialize_reservation(reservation) for reservation in to_delete)
+            if conflicts:
+                logger.warning(f"保存预约数据时发现{len(conflicts)}条版本冲突")
+                return version_conflict_response('预约数据已被其他人修改，请刷新后重试', conflicts)
             
-            for res_data in reservations_data:
-                res_id = res_data.get('id')
-                
-                # 解析日期和时间
-                date_str = res_data.get('date')
-                date_obj = datetime.date.fromisoformat(date_str)
-                
-                start_str = res_data.get('start_time') or res_data.get('start')
-                start_time = datetime.datetime.strptime(start_str, '%H:%M').time()
-                
-                end_str = res_data.get('end_time') or res_data.get('end')
-                end_time = datetime.datetime.strptime(end_str, '%H:%M').time()
-                
-                # 获取房间
-                room_id = res_data.get('room')
-                room = Room.objects.get(id=room_id)
-                    
-                if res_id:
-                    received_ids.add(int(res_id))
-                    # 更新现有预约
-                    try:
-                        reservation = Reservation.objects.get(id=res_id)
-                        
-                        # 检查是否有变化
-                        has_changed, change_reason = has_reservation_changed(reservation, res_data, room)
-                        
-                        # 更新数据
-                        reservation.room = room
-                        reservation.date = date_obj
-                        reservation.start_time = start_time
-                        reservation.end_time = end_time
-                        reservation.title = res_data.get('title', '')
-                        reservation.booker = res_data.get('booker', '')
-                        reservation.department = res_data.get('department', '')
-                        reservation.save()
-                        
-                        # 只有真正有变化时才发送编辑通知
-                        if has_changed:
-                            logger.info(f"预约ID {res_id} 有变化，发送编辑通知。变化原因: {change_reason}")
-                            success, error_msg = send_wechat_notification(reservation, '编辑')
-                            if not success:
-                                logger.warning(f"编辑通知发送失败: {error_msg}")
-                        else:
-                            logger.debug(f"预约ID {res_id} 无变化，跳过通知发送")
-                            
-                    except Reservation.DoesNotExist:
-                        # 如果ID不存在，创建新预约
-                        new_reservation = Reservation.objects.create(
-                            id=res_id,
-                            room=room,
-                            date=date_obj,
-                            start_time=start_time,
-                            end_time=end_time,
-                            title=res_data.get('title', ''),
-                            booker=res_data.get('booker', ''),
-                            department=res_data.get('department', '')
-                        )
-                        # 发送新增通知（这是真正的新增）
-                        logger.info(f"创建新预约ID {res_id}，发送新增通知")
-                        success, error_msg = send_wechat_notification(new_reservation, '新增')
-                        if not success:
-                            logger.warning(f"新增通知发送失败: {error_msg}")
-                else:
-                    # 创建新预约（没有ID的情况）
-                    new_res = Reservation.objects.create(
-                        room=room,
-                        date=date_obj,
-                        start_time=start_time,
-                        end_time=end_time,
-                        title=res_data.get('title', ''),
-                        booker=res_data.get('booker', ''),
-                        department=res_data.get('department', '')
-                    )
-                    received_ids.add(new_res.id)
-                    # 发送新增通知（这是真正的新增）
-                    logger.info(f"创建新预约ID {new_res.id}，发送新增通知")
-                    success, error_msg = send_wechat_notification(new_res, '新增')
-                    if not success:
-                        logger.warning(f"新增通知发送失败: {error_msg}")
+            # 新增和修改的预约不能与其他预约时间重叠（已有的重叠数据不影响保存）
+            deleted_ids = {reservation.id for reservation in to_delete}
+            final_rows = [r for r in existing.values() if r.id not in deleted_ids] + to_create
+            overlaps = find_overlaps(final_rows, slot_changed, slot_pairs)
+            if overlaps:
+                logger.warning(f"保存预约数据时发现{len(overlaps)}条时间冲突")
+                return JsonResponse({
+                    'success': False,
+                    'error': '预约时间与其他预约冲突，请调整后重试',
+                    'code': 'TIME_CONFLICT',
+                    'conflicts': [serialize_reservation(reservation) for reservation in overlaps],
+                }, status=409)
+
+            if to_create:
+                Reservation.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+            if to_update:
+                Reservation.objects.bulk_update(
+                    to_update,
+                    ['room', 'date', 'start_time', 'end_time', 'title', 'booker', 'department', 'version'],
+                    batch_size=BULK_BATCH_SIZE
+                )
+            if to_delete:
+                delete_ids = [reservation.id for reservation in to_delete]
+                for i in range(0, len(delete_ids), BULK_BATCH_SIZE):
+                    # 预约没有被其他表级联引用，直接删除，跳过逐行收集和信号
+                    Reservation.objects.filter(id__in=delete_ids[i:i + BULK_BATCH_SIZE])._raw_delete(Reservation.objects.db)
+                slot_pairs.update((reservation.room_id, reservation.date) for reservation in to_delete)
+                logger.warning(f"删除预约: {len(to_delete)}条记录")
+
+            if to_create or to_update or to_delete:
+                bump_data_version(SCOPE_RESERVATIONS)
+                # SQLite 3.35+ 的 bulk_create 会回填自增ID
+                record_changes(MODEL_RESERVATION, ACTION_CREATE, [r.id for r in to_create if r.id is not None])
+                record_changes(MODEL_RESERVATION, ACTION_UPDATE, [r.id for r in to_update])
+                record_changes(MODEL_RESERVATION, ACTION_DELETE, [r.id for r in to_delete])
+                rebuild_occupancy(slot_pairs)
+            # 客户端原本是最新的，保存后的列表即服务器数据，返回新ETag供下次保存使用
+            new_etag = get_collection_etag(SCOPE_ROOMS, SCOPE_RESERVATIONS) if up_to_date else None
+
+            enqueue_notifications(
+                [(r, '新增') for r in to_create] + [(r, '编辑') for r in to_update] + [(r, '删除') for r in to_delete]
+            )
             
-            # 删除未接收到的预约
-            ids_to_delete = existing_ids - received_ids
-            if ids_to_delete:
-                deleted_reservations = list(Reservation.objects.filter(id__in=ids_to_delete))
-                # 发送删除通知
-                for reservation in deleted_reservations:
-                    logger.info(f"删除预约ID {reservation.id}，发送删除通知")
-                    success, error_msg = send_wechat_notification(reservation, '删除')
-                    if not success:
-                        logger.warning(f"删除通知发送失败: {error_msg}")
-                
-                Reservation.objects.filter(id__in=ids_to_delete).delete()
-                logger.warning(f"删除预约: {len(ids_to_delete)}条记录")
+            logger.info(
+                f"预约数据保存成功: 新增{len(to_create)}条，修改{len(to_update)}条，"
+                f"未变化{unchanged}条，删除{len(to_delete)}条"
+            )
+            response = JsonResponse({
+                'success': True, 
+                'message': '预约数据保存成功',
+                'etag': new_etag,
+            })
+            if new_etag:
+                response['ETag'] = new_etag
+            return response
         
-        logger.info("预约数据保存成功")
-        return JsonResponse({
-            'success': True, 
-            'message': '预约数据保存成功'
-        })
+        return run_in_write_transaction(SCOPE_RESERVATIONS, apply_changes)
         
     except Exception as e:
-        error_msg = f"保存预约数据失败: {str(e)}"
-        logger.error(error_msg)
-        return JsonResponse({'success': False, 'error': error_msg}, status=500)
+        return write_error_response('保存预约数据失败', e)
 
 @csrf_exempt
 @require_http_methods(["POST"])
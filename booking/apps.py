@@ -4,3 +4,7 @@ class BookingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'booking'
     verbose_name = '会议室预约系统'
+
+    def ready(self):
+        # 注册模型信号（数据版本等）
+        from . import signals  # noqa: F401
@@ -1,129 +1,1033 @@
 """
 数据备份管理器
 提供自动备份、恢复和数据完整性检查功能
+
+备份文件为 JSON Lines：第一行为元数据，之后每行一条记录（{"type": "room", ...}），
+最后一行为各类记录的数量。先用 SQLite 在线备份接口按页复制出一致的临时副本
+（与快照相同，复制期间写入可以继续），再从副本逐行写入压缩流，内存占用与数据量无关。
+BACKUP_SETTINGS['COMPRESS_BACKUPS'] 为真时使用 zstd（已安装 zstandard 时）或 gzip 压缩。
+旧版本的 backup_*.json（整个文件为一个JSON对象）仍可读取和恢复。
+每个备份在 .catalog/ 下有一个目录条目，列出备份时只读取目录条目。
+
+差异备份（create_differential）只保存基础备份之后新增、修改的会议室和预约（以及全部设置），
+删除的记录写为 {"type": "deleted", "model": ..., "id": ...}。变更从变更日志（ChangeLog）中读取：
+全量备份和快照都记录了备份时的日志游标，差异备份读取基础备份游标之后的日志，
+大小和耗时与变更量成正比。基础备份可以是全量备份、快照或另一个差异备份，
+恢复差异备份时先恢复整条链的全量备份，再依次应用各个差异备份。
+
+快照备份（create_snapshot）使用 SQLite 在线备份接口按页复制整个数据库文件：
+每次复制 SNAPSHOT_PAGES 页后短暂释放锁，写入请求不会被长时间阻塞，
+复制期间数据库被其他连接修改时 SQLite 会重新开始复制，得到的始终是一致的快照。
+恢复时同样按页写回，比逐行导出导入快得多。
 """
 import os
+import io
+import gzip
 import json
+import hashlib
 import shutil
+import sqlite3
 import logging
-from datetime import datetime, timedelta
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
 from django.conf import settings
 from django.core import serializers
-from django.db import transaction
-from .models import Room, Reservation, Settings
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.db.migrations.recorder import MigrationRecorder
+from django.utils import timezone
+from .models import ChangeLog, DataVersion, NotificationOutbox, Room, RoomOccupancy, Reservation, Settings
+from .occupancy import rebuild_occupancy
+from .integrity import find_integrity_issues, make_issue, SEVERITY_ERROR
+from .changes import (
+    get_current_cursor, get_journal_floor, record_changes, MODEL_ROOM, MODEL_RESERVATION,
+    ACTION_CREATE, ACTION_UPDATE, ACTION_DELETE, JOURNAL_FLOOR_SCOPE,
+)
+from .versioning import bump_data_version, get_data_versions, ALL_SCOPES, SCOPE_ROOMS, SCOPE_RESERVATIONS, SCOPE_SETTINGS
+from .settings_cache import invalidate_settings_cache
+from .transactions import run_in_write_transaction
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，未安装时使用 gzip
+    zstandard = None
 
 logger = logging.getLogger(__name__)
 
+FORMAT_VERSION = '2.0'
+# 备份文件扩展名，按优先顺序匹配
+BACKUP_EXTENSIONS = ('.jsonl.zst', '.jsonl.gz', '.jsonl', '.json', '.sqlite3.zst', '.sqlite3.gz', '.sqlite3')
+SNAPSHOT_EXTENSIONS = ('.sqlite3.zst', '.sqlite3.gz', '.sqlite3')
+# 写入快照副本中的元数据表（恢复时删除）
+SNAPSHOT_METADATA_TABLE = 'backup_metadata'
+COPY_CHUNK_SIZE = 1024 * 1024
+# 备份目录下的备份目录：每个备份一个小 JSON 文件（类型、说明、数量、大小、校验和），
+# 列出备份时只读这些文件，不打开备份本身
+CATALOG_DIR = '.catalog'
+DIFF_BACKUP_TYPE = 'diff'
+# 记录类型与 load_backup 返回的数据键
+RECORD_KEYS = {'room': 'rooms', 'reservation': 'reservations', 'setting': 'settings'}
+ITERATOR_CHUNK_SIZE = 1000
+# 恢复时每批写入的行数
+RESTORE_BATCH_SIZE = 1000
+
+
+def get_backup_config():
+    """读取 settings.BACKUP_SETTINGS 配置"""
+    config = {
+        'BACKUP_DIR': os.path.join(settings.BASE_DIR, 'data', 'backups'),
+        'MAX_BACKUPS': 30,
+        'COMPRESS_BACKUPS': True,
+        'COMPRESSION': 'auto',  # auto / zstd / gzip
+        'COMPRESS_LEVEL': 6,
+        'SNAPSHOT_PAGES': 1024,  # 快照每步复制的页数
+        'SNAPSHOT_SLEEP': 0.005,  # 每步之间释放锁的时间（秒）
+        'KEEP_DAYS': 30,  # 备份保留天数（与 MAX_BACKUPS 同时生效）
+        'AUTO_BACKUP_ENABLED': True,
+        'AUTO_BACKUP_INTERVAL': 6 * 3600,  # 定时备份间隔（秒），数据未变化时跳过
+        'AUTO_BACKUP_SNAPSHOT': False,  # 定时备份使用快照而不是 JSON Lines
+        'AUTO_BACKUP_DIFFERENTIAL': False,  # 定时备份在两次全量备份之间只创建差异备份
+        'FULL_BACKUP_INTERVAL': 24 * 3600,  # 开启差异备份时全量备份的间隔（秒）
+        'SCHEDULER_IN_PROCESS': True,  # 是否在Web进程内启动定时备份线程
+        'SCHEDULER_LOCK_RETRY': 60,  # 未拿到定时备份文件锁的进程重试的间隔（秒）
+    }
+    config.update(getattr(settings, 'BACKUP_SETTINGS', {}))
+    return config
+
+
+def backup_extension(config=None, base='.jsonl', compress=None):
+    """新建备份使用的扩展名（base 为 .jsonl 或快照的 .sqlite3）"""
+    config = config or get_backup_config()
+    if compress is None:
+        compress = config['COMPRESS_BACKUPS']
+    if not compress:
+        return base
+    compression = config['COMPRESSION']
+    if compression == 'zstd' and zstandard is None:
+        logger.warning("未安装 zstandard，备份改用 gzip 压缩")
+    if compression in ('auto', 'zstd') and zstandard is not None:
+        return base + '.zst'
+    return base + '.gz'
+
+
+def is_snapshot(path):
+    """是否为 SQLite 快照备份"""
+    return path.endswith(SNAPSHOT_EXTENSIONS)
+
+
+def file_checksum(path):
+    """文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def current_data_versions():
+    """当前各数据范围的版本号 {scope: version}，用于判断备份之后数据是否变化"""
+    return {scope: version for scope, (version, _) in get_data_versions(*ALL_SCOPES).items()}
+
+
+def is_backup_filename(filename):
+    return filename.startswith('backup_') and filename.endswith(BACKUP_EXTENSIONS)
+
+
+def open_backup(path, mode='r', level=6, binary=False):
+    """按扩展名打开备份文件（mode 为 'r' 或 'w'），返回文本流，binary 为真时返回字节流"""
+    if path.endswith('.zst') or path.endswith('.zst.partial'):
+        if zstandard is None:
+            raise RuntimeError("读取 .zst 备份需要安装 zstandard")
+        if mode == 'w':
+            raw = zstandard.ZstdCompressor(level=level).stream_writer(open(path, 'wb'))
+        else:
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+        return raw if binary else io.TextIOWrapper(raw, encoding='utf-8')
+    if path.endswith('.gz') or path.endswith('.gz.partial'):
+        if binary:
+            return gzip.open(path, mode + 'b', compresslevel=level)
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=level)
+    return open(path, mode + 'b') if binary else open(path, mode, encoding='utf-8')
+
+
+def iter_backup_records(path):
+    """
+    逐条读取备份记录，兼容新旧两种格式
+
+    Yields:
+        tuple: (记录类型, 数据)，记录类型为 metadata / room / reservation / setting / summary
+    """
+    if is_snapshot(path):
+        yield from _iter_snapshot_records(path)
+        return
+
+    if path.endswith('.json'):
+        # 旧格式：整个文件为一个JSON对象
+        with open(path, 'r', encoding='utf-8') as f:
+            backup_data = json.load(f)
+        yield 'metadata', backup_data.get('metadata', {})
+        for kind, key in RECORD_KEYS.items():
+            for record in backup_data.get(key, []):
+                yield kind, record
+        yield 'summary', {'counts': {key: len(backup_data.get(key, [])) for key in RECORD_KEYS.values()}}
+        return
+
+    with open_backup(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record.pop('type'), record
+
+
+def _snapshot_tables():
+    return {
+        'room': (Room._meta.db_table, ('id', 'name', 'capacity', 'description', 'equipment', 'status', 'version')),
+        'reservation': (Reservation._meta.db_table, (
+            'id', 'room_id', 'date', 'start_time', 'end_time', 'title', 'booker', 'department', 'created_at', 'version',
+        )),
+        'setting': (Settings._meta.db_table, ('key', 'value')),
+    }
+
+
+@contextmanager
+def open_snapshot(path):
+    """
+    以只读方式打开快照备份，返回 sqlite3 连接
+    压缩的快照先解压到临时文件，退出时删除。
+    """
+    temp_path = None
+    conn = None
+    try:
+        db_path = path
+        if not path.endswith('.sqlite3'):
+            fd, temp_path = tempfile.mkstemp(suffix='.sqlite3')
+            with os.fdopen(fd, 'wb') as out, open_backup(path, binary=True) as src:
+                shutil.copyfileobj(src, out, COPY_CHUNK_SIZE)
+            db_path = temp_path
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+        yield conn
+    finally:
+        if conn is not None:
+            conn.close()
+        if temp_path:
+            os.remove(temp_path)
+
+
+def _read_snapshot_metadata(conn):
+    rows = dict(conn.execute(f'SELECT key, value FROM {SNAPSHOT_METADATA_TABLE}'))
+    return json.loads(rows.get('metadata', '{}')), json.loads(rows.get('counts', '{}'))
+
+
+def _iter_snapshot_records(path):
+    """快照备份的记录：先给出元数据和数量，再逐行给出数据"""
+    with open_snapshot(path) as conn:
+        metadata, counts = _read_snapshot_metadata(conn)
+        yield 'metadata', metadata
+        yield 'summary', {'counts': counts}
+        for kind, (table, columns) in _snapshot_tables().items():
+            cursor = conn.execute(f'SELECT {", ".join(columns)} FROM {table} ORDER BY 1')
+            for row in cursor:
+                record = dict(zip(columns, row))
+                if kind == 'reservation':
+                    # 与 JSON Lines 备份一致，时间只保留到分钟
+                    record['start_time'] = record['start_time'][:5]
+                    record['end_time'] = record['end_time'][:5]
+                yield kind, record
+
+
+def read_backup_metadata(path):
+    """只读取备份的元数据"""
+    records = iter_backup_records(path)
+    try:
+        for kind, record in records:
+            if kind == 'metadata':
+                return record
+        return {}
+    finally:
+        records.close()
+
+
+def _copy_state(conn):
+    """数据库副本中的数据版本和变更日志游标（与副本中的数据一致）"""
+    data_versions = dict(conn.execute(
+        f'SELECT scope, version FROM {DataVersion._meta.db_table} WHERE scope IN ({", ".join("?" * len(ALL_SCOPES))})',
+        ALL_SCOPES
+    ))
+    journal_cursor = max(
+        conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {ChangeLog._meta.db_table}').fetchone()[0],
+        conn.execute(
+            f'SELECT COALESCE(MAX(version), 0) FROM {DataVersion._meta.db_table} WHERE scope = ?',
+            (JOURNAL_FLOOR_SCOPE,)
+        ).fetchone()[0],
+    )
+    return data_versions, journal_cursor
+
+
+def _iter_copy_records(conn, kind):
+    """从数据库副本逐行读取一类记录，格式与 JSON Lines 备份相同"""
+    table, columns = _snapshot_tables()[kind]
+    for row in conn.execute(f'SELECT {", ".join(columns)} FROM {table} ORDER BY 1'):
+        record = dict(zip(columns, row))
+        if kind == 'reservation':
+            record['start_time'] = record['start_time'][:5]
+            record['end_time'] = record['end_time'][:5]
+            if record['created_at']:
+                record['created_at'] = _parse_created_at(record['created_at']).isoformat()
+        yield record
+
+
+def load_backup(path):
+    """
+    读取整个备份文件
+
+    Returns:
+        dict: {'metadata': {...}, 'rooms': [...], 'reservations': [...], 'settings': [...],
+               'deleted': [...]}，deleted 只出现在差异备份中
+    """
+    backup_data = {'metadata': {}, 'rooms': [], 'reservations': [], 'settings': [], 'deleted': []}
+    for kind, record in iter_backup_records(path):
+        if kind == 'metadata':
+            backup_data['metadata'] = record
+        elif kind == 'deleted':
+            backup_data['deleted'].append(record)
+        elif kind in RECORD_KEYS:
+            backup_data[RECORD_KEYS[kind]].append(record)
+    return backup_data
+
+
+# 批量恢复预约时直接写入的列
+RESERVATION_COLUMNS = (
+    'id', 'room_id', 'date', 'start_time', 'end_time', 'title', 'booker', 'department', 'created_at', 'version',
+)
+
+
+def _parse_created_at(value):
+    """备份中的创建时间（JSON Lines 为带时区的 ISO 格式，快照中为 UTC 时间），旧备份没有时为当前时间"""
+    if not value:
+        return timezone.now()
+    created_at = datetime.fromisoformat(value)
+    if timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at, dt_timezone.utc)
+    return created_at
+
+
+class BulkRestore:
+    """
+    批量恢复引擎：按备份中的记录顺序（会议室、预约、设置）每 RESTORE_BATCH_SIZE 行写入一次
+    
+    预约的外键用内存中的会议室ID集合校验，不逐行查询；写入绕过逐行信号，
+    结束时统一递增数据版本、写入变更日志并重建占用位图。需在事务中使用。
+    
+    行版本号（乐观锁）不能回退：客户端可能持有恢复前的版本号，恢复后的版本号与之相同
+    就会接受基于另一份数据的修改。恢复的行版本号取备份中的版本号与恢复前该表最大版本号加一中的较大值。
+    """
+    
+    def __init__(self, restore_options, progress=None):
+        """
+        Args:
+            restore_options: 恢复选项 {'rooms': True, 'reservations': True, 'settings': True}
+            progress: 进度回调 progress(记录类型, 已写入行数)，每批写入后调用
+        """
+        self.options = restore_options
+        self.progress = progress
+        self.counts = {'rooms': 0, 'reservations': 0, 'settings': 0, 'skipped': 0}
+        self.pending = {'room': [], 'reservation': [], 'setting': []}
+        self.cleared = set()
+        self.room_ids = None  # 恢复后存在的会议室ID，写入第一条预约前确定
+        self.version_floor = {}  # 恢复前各表的最大行版本号
+        self.before_ids = {}
+        self.restored_ids = {MODEL_ROOM: set(), MODEL_RESERVATION: set()}
+        self.slot_pairs = set()
+    
+    def add(self, kind, record):
+        """加入一条备份记录"""
+        if kind not in self.pending or not self.options.get(RECORD_KEYS[kind], True):
+            return
+        if kind == 'reservation':
+            self._flush_rooms()
+            if record['room_id'] not in self.room_ids:
+                logger.warning(f"恢复预约时找不到会议室 ID: {record['room_id']}")
+                self.counts['skipped'] += 1
+                return
+        self.pending[kind].append(record)
+        # 会议室在写入第一条预约前统一写入，之后才能确定会议室ID集合
+        if kind != 'room' and len(self.pending[kind]) >= RESTORE_BATCH_SIZE:
+            self._flush(kind)
+    
+    def finish(self):
+        """写入剩余记录并更新数据版本、变更日志和占用位图，返回各类数据的数量"""
+        self._flush_rooms()
+        self._flush('reservation')
+        self._flush('setting')
+        
+        if 'room' in self.cleared and 'reservation' not in self.cleared:
+            # 只恢复会议室时，删除关联会议室已不存在的预约（与级联删除一致）
+            orphans = Reservation.objects.exclude(room_id__in=self.room_ids)
+            orphan_ids = list(orphans.values_list('id', flat=True))
+            orphans._raw_delete(orphans.db)
+            RoomOccupancy.objects.exclude(room_id__in=self.room_ids)._raw_delete(RoomOccupancy.objects.db)
+            self.before_ids[MODEL_RESERVATION] = set(orphan_ids)
+            bump_data_version(SCOPE_RESERVATIONS)
+        
+        for model, scope in ((MODEL_ROOM, SCOPE_ROOMS), (MODEL_RESERVATION, SCOPE_RESERVATIONS)):
+            if model not in self.before_ids:
+                continue
+            before, restored = self.before_ids[model], self.restored_ids[model]
+            bump_data_version(scope)
+            record_changes(model, ACTION_UPDATE, sorted(restored & before))
+            record_changes(model, ACTION_CREATE, sorted(restored - before))
+            record_changes(model, ACTION_DELETE, sorted(before - restored))
+        if 'reservation' in self.cleared:
+            rebuild_occupancy(self.slot_pairs)
+        return self.counts
+    
+    def _clear(self, kind):
+        """第一次写入某类数据前清空现有数据"""
+        if kind in self.cleared:
+            return
+        self.cleared.add(kind)
+        if kind == 'room':
+            self.before_ids[MODEL_ROOM] = set(Room.objects.values_list('id', flat=True))
+            self.version_floor[kind] = Room.objects.aggregate(floor=Max('version'))['floor'] or 0
+            # 会议室恢复后ID可能对应不同的会议室，位图在结束时按预约重建
+            RoomOccupancy.objects.all()._raw_delete(RoomOccupancy.objects.db)
+            Room.objects.all()._raw_delete(Room.objects.db)
+        elif kind == 'reservation':
+            self.before_ids[MODEL_RESERVATION] = set(Reservation.objects.values_list('id', flat=True))
+            self.version_floor[kind] = Reservation.objects.aggregate(floor=Max('version'))['floor'] or 0
+            RoomOccupancy.objects.all()._raw_delete(RoomOccupancy.objects.db)
+            Reservation.objects.all()._raw_delete(Reservation.objects.db)
+        else:
+            Settings.objects.all()._raw_delete(Settings.objects.db)
+            bump_data_version(SCOPE_SETTINGS)
+            invalidate_settings_cache()
+            transaction.on_commit(invalidate_settings_cache)
+    
+    def _row_version(self, kind, data):
+        """恢复的行版本号（见类说明）"""
+        return max(data.get('version') or 1, self.version_floor[kind] + 1)
+    
+    def _flush_rooms(self):
+        if self.room_ids is not None:
+            return
+        if self.options.get('rooms', True):
+            self._clear('room')
+            self._flush('room')
+            self.room_ids = self.restored_ids[MODEL_ROOM]
+        else:
+            self.room_ids = set(Room.objects.values_list('id', flat=True))
+    
+    def _flush(self, kind):
+        rows = self.pending[kind]
+        if not self.options.get(RECORD_KEYS[kind], True) or (not rows and kind in self.cleared):
+            return
+        self._clear(kind)
+        if not rows:
+            return
+        self.pending[kind] = []
+        if kind == 'room':
+            objects = [
+                Room(
+                    id=data['id'],
+                    name=data['name'],
+                    capacity=data['capacity'],
+                    description=data.get('description', ''),
+                    equipment=data.get('equipment', ''),
+                    status=data.get('status', 'available'),
+                    version=self._row_version(kind, data),
+                )
+                for data in rows
+            ]
+            Room.objects.bulk_create(objects, batch_size=RESTORE_BATCH_SIZE)
+            self.restored_ids[MODEL_ROOM].update(room.id for room in objects)
+        elif kind == 'reservation':
+            self._insert_reservations(rows)
+        else:
+            Settings.objects.bulk_create(
+                [Settings(key=data['key'], value=data['value']) for data in rows],
+                batch_size=RESTORE_BATCH_SIZE
+            )
+        key = RECORD_KEYS[kind]
+        self.counts[key] += len(rows)
+        if self.progress:
+            self.progress(key, self.counts[key])
+    
+    def _insert_reservations(self, rows):
+        """
+        用一条 executemany 写入一批预约
+        
+        预约数量可达数十万行，逐个构造模型实例并由 bulk_create 转换字段值的开销远大于写入本身；
+        这里只用数据库后端的 adapt_* 转换日期时间，其他字段原样写入。
+        """
+        ops = connection.ops
+        params = []
+        for data in rows:
+            reservation_date = date.fromisoformat(data['date'])
+            params.append((
+                data['id'],
+                data['room_id'],
+                ops.adapt_datefield_value(reservation_date),
+                ops.adapt_timefield_value(time.fromisoformat(data['start_time'])),
+                ops.adapt_timefield_value(time.fromisoformat(data['end_time'])),
+                data['title'],
+                data['booker'],
+                data.get('department', ''),
+                ops.adapt_datetimefield_value(_parse_created_at(data.get('created_at'))),
+                self._row_version('reservation', data),
+            ))
+            self.restored_ids[MODEL_RESERVATION].add(data['id'])
+            self.slot_pairs.add((data['room_id'], reservation_date))
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            ops.quote_name(Reservation._meta.db_table),
+            ', '.join(ops.quote_name(column) for column in RESERVATION_COLUMNS),
+            ', '.join(['%s'] * len(RESERVATION_COLUMNS)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+
 class BackupManager:
     """数据备份管理器"""
     
-    def __init__(self):
-        self.backup_dir = os.path.join(settings.BASE_DIR, 'data', 'backups')
+    def __init__(self, backup_dir=None):
+        self.backup_dir = str(backup_dir or get_backup_config()['BACKUP_DIR'])
         self.ensure_backup_directory()
     
     def ensure_backup_directory(self):
         """确保备份目录存在"""
         os.makedirs(self.backup_dir, exist_ok=True)
         
-    def create_backup(self, backup_type='manual', description=''):
+    def create_backup(self, backup_type='manual', description='', compress=None):
         """
-        创建数据备份
+        创建数据备份（流式写入，先写临时文件，完成后再改名）
         
         Args:
             backup_type: 备份类型 ('manual', 'auto', 'pre_operation')
             description: 备份描述
+            compress: 是否压缩，为空时按 BACKUP_SETTINGS['COMPRESS_BACKUPS']
             
         Returns:
             tuple: (success, backup_file_path, message)
         """
+        partial_path = None
+        copy_path = None
         try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_filename = f"backup_{backup_type}_{timestamp}.json"
-            backup_path = os.path.join(self.backup_dir, backup_filename)
+            config = get_backup_config()
+            backup_path = self._new_backup_path(backup_type, backup_extension(config, compress=compress))
+            backup_filename = os.path.basename(backup_path)
+            partial_path = backup_path + '.partial'
             
-            # 收集所有数据
-            backup_data = {
-                'metadata': {
-                    'backup_time': datetime.now().isoformat(),
+            copy_path = backup_path + '.copy.partial'
+            started = datetime.now()
+            counts = {}
+            # 各表数据与记录的数据版本、变更日志游标一致
+            with self._backup_source(copy_path, config) as (data_versions, journal_cursor, read_records), \
+                    open_backup(partial_path, 'w', level=config['COMPRESS_LEVEL']) as f:
+                metadata = {
+                    'backup_time': started.isoformat(),
                     'backup_type': backup_type,
                     'description': description,
-                    'version': '1.0'
-                },
-                'rooms': self._serialize_rooms(),
-                'reservations': self._serialize_reservations(),
-                'settings': self._serialize_settings()
-            }
-            
-            # 写入备份文件
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, ensure_ascii=False, indent=2)
+                    'version': FORMAT_VERSION,
+                    'data_versions': data_versions,
+                    # 差异备份以此为起点读取变更日志
+                    'journal_cursor': journal_cursor,
+                }
+                self._write_record(f, 'metadata', metadata)
+                for kind, key in RECORD_KEYS.items():
+                    counts[key] = self._write_records(f, kind, read_records(kind))
+                self._write_record(f, 'summary', {'counts': counts})
+            os.replace(partial_path, backup_path)
+            self._write_catalog_entry(backup_path, metadata, counts)
             
             # 记录备份信息
-            logger.info(f"数据备份成功: {backup_filename}")
-            
-            # 清理旧备份
-            self._cleanup_old_backups()
+            logger.info(
+                f"数据备份成功: {backup_filename}（会议室{counts['rooms']}个，预约{counts['reservations']}条，"
+                f"设置{counts['settings']}项，{os.path.getsize(backup_path)}字节）"
+            )
             
             return True, backup_path, f"备份创建成功: {backup_filename}"
             
         except Exception as e:
+            for path in {partial_path, copy_path}:
+                if path and os.path.exists(path):
+                    os.remove(path)
             error_msg = f"创建备份失败: {str(e)}"
             logger.error(error_msg)
             return False, None, error_msg
     
-    def _serialize_rooms(self):
-        """序列化会议室数据"""
-        rooms = []
-        for room in Room.objects.all():
-            rooms.append({
-                'id': room.id,
-                'name': room.name,
-                'capacity': room.capacity,
-                'description': room.description,
-                'equipment': room.equipment,
-                'status': room.status
-            })
-        return rooms
+    @contextmanager
+    def _backup_source(self, copy_path, config):
+        """
+        备份的数据来源，返回 (数据版本, 变更日志游标, 按记录类型逐行读取的函数)
+        
+        数据库使用 journal_mode=delete，整个导出期间持有读事务会阻塞所有写入的提交，
+        因此先按页复制出一致的副本（见 _copy_database），再从副本读取，结束后删除副本。
+        调用方已处于事务中时（如 restore_backup 命令中的恢复前备份）锁已由外层事务持有，
+        且未提交的数据只有本连接可见，直接在该事务中读取。
+        """
+        if connection.in_atomic_block:
+            readers = {
+                'room': self._serialize_rooms,
+                'reservation': self._serialize_reservations,
+                'setting': self._serialize_settings,
+            }
+            yield current_data_versions(), get_current_cursor(), lambda kind: readers[kind]()
+            return
+        self._copy_database(copy_path, config)
+        copy = sqlite3.connect(copy_path)
+        try:
+            data_versions, journal_cursor = _copy_state(copy)
+            yield data_versions, journal_cursor, lambda kind: _iter_copy_records(copy, kind)
+        finally:
+            copy.close()
+            os.remove(copy_path)
     
-    def _serialize_reservations(self):
-        """序列化预约数据"""
-        reservations = []
-        for reservation in Reservation.objects.all():
-            reservations.append({
-                'id': reservation.id,
-                'room_id': reservation.room.id,
-                'date': reservation.date.isoformat(),
-                'start_time': reservation.start_time.strftime('%H:%M'),
-                'end_time': reservation.end_time.strftime('%H:%M'),
-                'title': reservation.title,
-                'booker': reservation.booker,
-                'department': reservation.department,
-                'created_at': reservation.created_at.isoformat() if reservation.created_at else None
-            })
-        return reservations
+    def _new_backup_path(self, backup_type, extension):
+        """新备份的路径（同一秒内多次备份时加序号，避免覆盖）"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup_path = os.path.join(self.backup_dir, f"backup_{backup_type}_{timestamp}{extension}")
+        suffix = 1
+        while os.path.exists(backup_path):
+            backup_path = os.path.join(self.backup_dir, f"backup_{backup_type}_{timestamp}_{suffix}{extension}")
+            suffix += 1
+        return backup_path
+    
+    @staticmethod
+    def _write_record(f, kind, record):
+        f.write(json.dumps({'type': kind, **record}, ensure_ascii=False, separators=(',', ':')))
+        f.write('\n')
+    
+    def _write_records(self, f, kind, records):
+        """逐行写入记录，返回数量"""
+        count = 0
+        for record in records:
+            self._write_record(f, kind, record)
+            count += 1
+        return count
+    
+    @staticmethod
+    def _iter_values(model, fields, ids=None):
+        """按ID顺序逐行读取，ids 不为空时只读取这些ID（分批查询）"""
+        if ids is None:
+            yield from model.objects.order_by('id').values(*fields).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+            return
+        ids = sorted(ids)
+        for i in range(0, len(ids), ITERATOR_CHUNK_SIZE):
+            yield from model.objects.filter(id__in=ids[i:i + ITERATOR_CHUNK_SIZE]).order_by('id').values(*fields)
+    
+    def _serialize_rooms(self, ids=None):
+        """逐个生成会议室数据"""
+        yield from self._iter_values(Room, ('id', 'name', 'capacity', 'description', 'equipment', 'status', 'version'), ids)
+    
+    def _serialize_reservations(self, ids=None):
+        """逐条生成预约数据"""
+        # 直接读取外键列 room_id，避免逐行查询会议室
+        rows = self._iter_values(Reservation, (
+            'id', 'room_id', 'date', 'start_time', 'end_time',
+            'title', 'booker', 'department', 'created_at', 'version'
+        ), ids)
+        for row in rows:
+            yield {
+                'id': row['id'],
+                'room_id': row['room_id'],
+                'date': row['date'].isoformat(),
+                'start_time': row['start_time'].strftime('%H:%M'),
+                'end_time': row['end_time'].strftime('%H:%M'),
+                'title': row['title'],
+                'booker': row['booker'],
+                'department': row['department'],
+                'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+                'version': row['version'],
+            }
     
     def _serialize_settings(self):
-        """序列化设置数据"""
-        settings_data = []
-        for setting in Settings.objects.all():
-            settings_data.append({
-                'key': setting.key,
-                'value': setting.value,
-                'description': setting.description
+        """逐项生成设置数据"""
+        rows = Settings.objects.order_by('key').values('key', 'value').iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+        for row in rows:
+            yield row
+    
+    def resolve_backup_path(self, backup_file):
+        """备份文件名（在备份目录中查找）或路径 -> 完整路径"""
+        backup_file = str(backup_file)
+        if os.path.isabs(backup_file) or os.path.exists(backup_file):
+            return backup_file
+        return os.path.join(self.backup_dir, backup_file)
+    
+    def validate_backup(self, backup_file):
+        """
+        检查备份文件能否完整读取
+        
+        Returns:
+            bool: 是否有效
+        """
+        path = self.resolve_backup_path(backup_file)
+        if not os.path.exists(path):
+            logger.error(f"备份文件不存在: {path}")
+            return False
+        try:
+            expected = None
+            if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.backup_dir):
+                try:
+                    with open(self._catalog_path(os.path.basename(path)), 'r', encoding='utf-8') as f:
+                        expected = json.load(f).get('sha256')
+                except (OSError, ValueError):
+                    pass
+            if expected and file_checksum(path) != expected:
+                raise ValueError("校验和与备份目录记录不一致")
+            # 差异备份的基础备份必须存在且未被改动
+            self.backup_chain(path)
+            if is_snapshot(path):
+                with open_snapshot(path) as conn:
+                    result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+                    if result != 'ok':
+                        raise ValueError(f"快照数据库损坏: {result}")
+                    _read_snapshot_metadata(conn)
+                return True
+            has_metadata = False
+            for kind, _ in iter_backup_records(path):
+                has_metadata = has_metadata or kind == 'metadata'
+            return has_metadata
+        except Exception as e:
+            logger.error(f"备份文件验证失败: {path}: {str(e)}")
+            return False
+    
+    def create_snapshot(self, backup_type='manual', description='', compress=None):
+        """
+        用 SQLite 在线备份接口创建数据库快照
+        
+        每步复制 SNAPSHOT_PAGES 页后暂停 SNAPSHOT_SLEEP 秒，期间写入请求可以继续；
+        compress 为空时按 BACKUP_SETTINGS['COMPRESS_BACKUPS'] 决定是否压缩。
+        
+        Returns:
+            tuple: (success, backup_file_path, message)
+        """
+        raw_path = None
+        partial_path = None
+        try:
+            config = get_backup_config()
+            extension = backup_extension(config, base='.sqlite3', compress=compress)
+            backup_path = self._new_backup_path(backup_type, extension)
+            backup_filename = os.path.basename(backup_path)
+            partial_path = backup_path + '.partial'
+            raw_path = partial_path if extension == '.sqlite3' else backup_path + '.raw.partial'
+            
+            started = datetime.now()
+            self._copy_database(raw_path, config)
+            target = sqlite3.connect(raw_path)
+            try:
+                data_versions, journal_cursor = _copy_state(target)
+                counts = {
+                    RECORD_KEYS[kind]: target.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for kind, (table, _) in _snapshot_tables().items()
+                }
+                metadata = {
+                    'backup_time': started.isoformat(),
+                    'backup_type': backup_type,
+                    'description': description,
+                    'version': FORMAT_VERSION,
+                    'format': 'sqlite',
+                    'data_versions': data_versions,
+                    'journal_cursor': journal_cursor,
+                }
+                target.execute(f'CREATE TABLE {SNAPSHOT_METADATA_TABLE} (key TEXT PRIMARY KEY, value TEXT)')
+                target.executemany(
+                    f'INSERT INTO {SNAPSHOT_METADATA_TABLE} (key, value) VALUES (?, ?)',
+                    [('metadata', json.dumps(metadata, ensure_ascii=False)), ('counts', json.dumps(counts))]
+                )
+                target.commit()
+            finally:
+                target.close()
+            
+            if raw_path != partial_path:
+                with open(raw_path, 'rb') as src, open_backup(partial_path, 'w', level=config['COMPRESS_LEVEL'], binary=True) as out:
+                    shutil.copyfileobj(src, out, COPY_CHUNK_SIZE)
+                os.remove(raw_path)
+            os.replace(partial_path, backup_path)
+            self._write_catalog_entry(backup_path, metadata, counts)
+            
+            elapsed = (datetime.now() - started).total_seconds()
+            logger.info(
+                f"数据库快照成功: {backup_filename}（会议室{counts['rooms']}个，预约{counts['reservations']}条，"
+                f"{os.path.getsize(backup_path)}字节，{elapsed:.2f}秒）"
+            )
+            return True, backup_path, f"快照创建成功: {backup_filename}"
+        
+        except Exception as e:
+            for path in {raw_path, partial_path}:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            error_msg = f"创建快照失败: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+    
+    @staticmethod
+    def _copy_database(target_path, config):
+        """
+        用 SQLite 在线备份接口把数据库复制到 target_path
+        
+        每步复制 SNAPSHOT_PAGES 页后暂停 SNAPSHOT_SLEEP 秒，期间写入请求可以继续；
+        复制期间数据库被其他连接修改时 SQLite 重新开始复制，得到的始终是一致的副本。
+        """
+        connection.ensure_connection()
+        target = sqlite3.connect(target_path)
+        try:
+            connection.connection.backup(target, pages=config['SNAPSHOT_PAGES'], sleep=config['SNAPSHOT_SLEEP'])
+        finally:
+            target.close()
+    
+    def restore_snapshot(self, backup_file, pre_restore=True):
+        """
+        按页把快照写回数据库（不能在事务中调用）
+        
+        恢复后数据版本递增（客户端缓存和ETag失效），变更日志改为记录恢复前后的差异，
+        快照中尚未发送的通知标记为发送失败，不会重复发送。
+        快照缺少当前程序的数据库迁移时，恢复后自动执行 migrate。
+        pre_restore 为 False 时不再创建恢复前快照（调用方已自行创建）。
+        
+        Returns:
+            tuple: (success, message)
+        """
+        path = self.resolve_backup_path(backup_file)
+        if connection.in_atomic_block:
+            return False, "数据恢复失败: 快照恢复不能在事务中执行"
+        try:
+            config = get_backup_config()
+            applied = set(MigrationRecorder(connection).applied_migrations())
+            with open_snapshot(path) as snapshot:
+                snapshot_migrations = set(snapshot.execute('SELECT app, name FROM django_migrations'))
+                newer = snapshot_migrations - applied
+                if newer:
+                    raise ValueError(f"快照来自更新版本的程序（包含未知迁移 {sorted(newer)[0]}）")
+                
+                # 恢复前的状态，用于恢复后调整数据版本和变更日志
+                before_versions = dict(DataVersion.objects.values_list('scope', 'version'))
+                before_cursor = get_current_cursor()
+                before_ids = {
+                    MODEL_ROOM: set(Room.objects.values_list('id', flat=True)),
+                    MODEL_RESERVATION: set(Reservation.objects.values_list('id', flat=True)),
+                }
+                before_row_versions = {
+                    model: model.objects.aggregate(floor=Max('version'))['floor'] or 0
+                    for model in (Room, Reservation)
+                }
+                if pre_restore:
+                    self.create_snapshot('pre_restore', f'恢复前自动备份 - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
+                
+                started = datetime.now()
+                connection.ensure_connection()
+                snapshot.backup(connection.connection, pages=config['SNAPSHOT_PAGES'], sleep=config['SNAPSHOT_SLEEP'])
+            
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {SNAPSHOT_METADATA_TABLE}')
+            if applied - snapshot_migrations:
+                from django.core.management import call_command
+                call_command('migrate', verbosity=0)
+            with transaction.atomic():
+                self._after_page_restore(before_versions, before_cursor, before_ids, before_row_versions)
+            
+            elapsed = (datetime.now() - started).total_seconds()
+            logger.info(f"快照恢复成功: {path}（{elapsed:.2f}秒）")
+            return True, "数据恢复成功"
+        
+        except Exception as e:
+            error_msg = f"数据恢复失败: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+    
+    def _after_page_restore(self, before_versions, before_cursor, before_ids, before_row_versions):
+        """按页恢复后：数据版本和行版本号不能回退，变更日志和发件箱与恢复后的数据保持一致"""
+        # 版本号回退会使客户端旧的ETag重新匹配，从两者中较大的值继续递增
+        for scope in ALL_SCOPES:
+            restored = DataVersion.objects.filter(scope=scope).values_list('version', flat=True).first() or 0
+            DataVersion.objects.update_or_create(scope=scope, defaults={
+                'version': max(restored, before_versions.get(scope, 0)),
             })
-        return settings_data
+        bump_data_version(*ALL_SCOPES)
+        # 行版本号（乐观锁）同理：整体加上恢复前的最大版本号，客户端持有的旧版本号都不会再匹配
+        for model, floor in before_row_versions.items():
+            if floor:
+                model.objects.update(version=F('version') + floor)
+        
+        # 快照中的变更日志属于另一段历史：清空后从恢复前后较大的游标继续，
+        # 游标落后的客户端全量重新加载，恢复前已同步的客户端按差异更新
+        floor = max(before_cursor, get_current_cursor())
+        ChangeLog.objects.all().delete()
+        DataVersion.objects.update_or_create(scope=JOURNAL_FLOOR_SCOPE, defaults={'version': floor})
+        entries = []
+        for model, queryset in ((MODEL_ROOM, Room.objects), (MODEL_RESERVATION, Reservation.objects)):
+            current_ids = set(queryset.values_list('id', flat=True))
+            entries += [(model, ACTION_UPDATE, object_id) for object_id in sorted(current_ids)]
+            entries += [(model, ACTION_DELETE, object_id) for object_id in sorted(before_ids[model] - current_ids)]
+        ChangeLog.objects.bulk_create(
+            [ChangeLog(id=floor + i, model=model, action=action, object_id=object_id)
+             for i, (model, action, object_id) in enumerate(entries, start=1)],
+            batch_size=1000
+        )
+        
+        # 快照时尚未发送的通知大多已经发送过，不再自动发送
+        NotificationOutbox.objects.filter(status='pending').update(
+            status='dead', last_error='从快照恢复，未重新发送'
+        )
     
-    def restore_backup(self, backup_file_path, restore_options=None):
+    def create_differential(self, base=None, description='', compress=None):
         """
-        从备份文件恢复数据
+        创建差异备份：只保存基础备份之后变更的会议室、预约和删除记录
         
         Args:
-            backup_file_path: 备份文件路径
+            base: 基础备份文件名，为空时使用最新的全量备份（或快照）
+            description: 备份描述
+            compress: 是否压缩，为空时按 BACKUP_SETTINGS['COMPRESS_BACKUPS']
+        
+        基础备份之后的变更日志已被压缩（compact_changes）时无法创建，需改为全量备份。
+        
+        Returns:
+            tuple: (success, backup_file_path, message)
+        """
+        partial_path = None
+        try:
+            config = get_backup_config()
+            base_filename = os.path.basename(str(base)) if base else self._latest_full_backup()
+            if not base_filename:
+                raise ValueError("没有可作为基础的全量备份")
+            base_path = os.path.join(self.backup_dir, base_filename)
+            entry = self.get_catalog_entry(base_filename) if os.path.exists(base_path) else None
+            if entry is None:
+                raise ValueError(f"基础备份不存在或无法读取: {base_filename}")
+            since = entry.get('journal_cursor')
+            if since is None:
+                raise ValueError(f"基础备份 {base_filename} 没有记录变更日志游标")
+            
+            backup_path = self._new_backup_path(DIFF_BACKUP_TYPE, backup_extension(config, compress=compress))
+            backup_filename = os.path.basename(backup_path)
+            partial_path = backup_path + '.partial'
+            
+            counts = {}
+            with open_backup(partial_path, 'w', level=config['COMPRESS_LEVEL']) as f, transaction.atomic():
+                if since < get_journal_floor():
+                    raise ValueError(f"基础备份 {base_filename} 之后的变更日志已被压缩")
+                cursor = get_current_cursor()
+                changed, deleted = self._collect_journal(since, cursor)
+                metadata = {
+                    'backup_time': datetime.now().isoformat(),
+                    'backup_type': DIFF_BACKUP_TYPE,
+                    'description': description,
+                    'version': FORMAT_VERSION,
+                    'data_versions': current_data_versions(),
+                    'journal_cursor': cursor,
+                    'base': base_filename,
+                    'base_sha256': entry['sha256'],
+                    'since_cursor': since,
+                }
+                self._write_record(f, 'metadata', metadata)
+                counts['rooms'] = self._write_records(f, 'room', self._serialize_rooms(changed[MODEL_ROOM]))
+                counts['reservations'] = self._write_records(
+                    f, 'reservation', self._serialize_reservations(changed[MODEL_RESERVATION])
+                )
+                counts['settings'] = self._write_records(f, 'setting', self._serialize_settings())
+                counts['deleted'] = self._write_records(f, 'deleted', (
+                    {'model': model, 'id': object_id}
+                    for model in (MODEL_ROOM, MODEL_RESERVATION) for object_id in sorted(deleted[model])
+                ))
+                self._write_record(f, 'summary', {'counts': counts})
+            os.replace(partial_path, backup_path)
+            self._write_catalog_entry(backup_path, metadata, counts)
+            
+            logger.info(
+                f"差异备份成功: {backup_filename}（基础 {base_filename}，会议室{counts['rooms']}个，"
+                f"预约{counts['reservations']}条，删除{counts['deleted']}条，{os.path.getsize(backup_path)}字节）"
+            )
+            return True, backup_path, f"差异备份创建成功: {backup_filename}"
+        
+        except Exception as e:
+            if partial_path and os.path.exists(partial_path):
+                os.remove(partial_path)
+            error_msg = f"创建差异备份失败: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+    
+    @staticmethod
+    def _collect_journal(since, cursor):
+        """
+        读取 (since, cursor] 之间的变更日志，每个对象只看最后一次操作
+        
+        Returns:
+            tuple: ({model: 新增或修改的ID集合}, {model: 删除的ID集合})
+        """
+        last_actions = {}
+        entries = ChangeLog.objects.filter(id__gt=since, id__lte=cursor).order_by('id').values_list(
+            'model', 'object_id', 'action'
+        ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+        for model, object_id, action in entries:
+            last_actions[(model, object_id)] = action
+        changed = {MODEL_ROOM: set(), MODEL_RESERVATION: set()}
+        deleted = {MODEL_ROOM: set(), MODEL_RESERVATION: set()}
+        for (model, object_id), action in last_actions.items():
+            if model in changed:
+                (deleted if action == ACTION_DELETE else changed)[model].add(object_id)
+        return changed, deleted
+    
+    def _latest_full_backup(self):
+        """最新的、记录了变更日志游标的全量备份或快照的文件名"""
+        for backup in self.list_backups():
+            if backup['base'] is None and backup['journal_cursor'] is not None:
+                return backup['filename']
+        return None
+    
+    def backup_chain(self, backup_file):
+        """
+        差异备份的恢复链（基础备份与差异备份在同一目录中）
+        
+        Returns:
+            list: [全量备份路径, 差异备份路径, ...]，全量备份和快照只有自身
+        
+        Raises:
+            ValueError: 基础备份缺失、被改动或链中出现循环
+        """
+        path = self.resolve_backup_path(backup_file)
+        chain = [path]
+        while not is_snapshot(path):
+            metadata = read_backup_metadata(path)
+            base = metadata.get('base')
+            if not base:
+                break
+            base_path = os.path.join(os.path.dirname(path), base)
+            if not os.path.exists(base_path):
+                raise ValueError(f"找不到差异备份 {os.path.basename(path)} 的基础备份: {base}")
+            if base_path in chain:
+                raise ValueError(f"备份链中出现循环: {base}")
+            if metadata.get('base_sha256') and file_checksum(base_path) != metadata['base_sha256']:
+                raise ValueError(f"基础备份 {base} 在创建差异备份后被改动")
+            chain.insert(0, base_path)
+            path = base_path
+        return chain
+    
+    def restore_backup(self, backup_file_path, restore_options=None, progress=None):
+        """
+        从备份文件恢复数据（支持新旧两种格式）
+        
+        Args:
+            backup_file_path: 备份文件名或路径，快照备份按页恢复（见 restore_snapshot），
+                差异备份按恢复链恢复（见 backup_chain）
             restore_options: 恢复选项 {'rooms': True, 'reservations': True, 'settings': True}
+            progress: 进度回调 progress(记录类型, 已写入行数)
             
         Returns:
             tuple: (success, message)
         """
+        backup_file_path = self.resolve_backup_path(backup_file_path)
+        try:
+            chain = self.backup_chain(backup_file_path)
+        except Exception as e:
+            return False, f"数据恢复失败: {str(e)}"
+        if len(chain) > 1:
+            if restore_options and not all(restore_options.values()):
+                return False, "数据恢复失败: 差异备份只能整体恢复"
+            return self._restore_chain(chain, progress)
+        if is_snapshot(backup_file_path):
+            if restore_options and not all(restore_options.values()):
+                return False, "数据恢复失败: 快照只能整体恢复"
+            return self.restore_snapshot(backup_file_path)
         if restore_options is None:
             restore_options = {'rooms': True, 'reservations': True, 'settings': True}
         
@@ -131,24 +1035,17 @@ class BackupManager:
             # 在恢复前创建当前数据的备份
             self.create_backup('pre_restore', f'恢复前自动备份 - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
             
-            # 读取备份文件
-            with open(backup_file_path, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
-            
-            with transaction.atomic():
-                # 恢复会议室数据
-                if restore_options.get('rooms', True):
-                    self._restore_rooms(backup_data.get('rooms', []))
-                
-                # 恢复预约数据
-                if restore_options.get('reservations', True):
-                    self._restore_reservations(backup_data.get('reservations', []))
-                
-                # 恢复设置数据
-                if restore_options.get('settings', True):
-                    self._restore_settings(backup_data.get('settings', []))
+            # 逐条读取备份文件，分批写入；锁等待超时时整体重新读取并重试
+            started = datetime.now()
+            counts = run_in_write_transaction(
+                SCOPE_RESERVATIONS, self._restore_records, backup_file_path, restore_options, progress
+            )
             
-            logger.info(f"数据恢复成功: {backup_file_path}")
+            elapsed = (datetime.now() - started).total_seconds()
+            logger.info(
+                f"数据恢复成功: {backup_file_path}（会议室{counts['rooms']}个，预约{counts['reservations']}条，"
+                f"设置{counts['settings']}项，跳过{counts['skipped']}条，{elapsed:.2f}秒）"
+            )
             return True, "数据恢复成功"
             
         except Exception as e:
@@ -156,101 +1053,315 @@ class BackupManager:
             logger.error(error_msg)
             return False, error_msg
     
-    def _restore_rooms(self, rooms_data):
-        """恢复会议室数据"""
-        # 清空现有数据
-        Room.objects.all().delete()
-        
-        # 恢复数据
-        for room_data in rooms_data:
-            Room.objects.create(
-                id=room_data['id'],
-                name=room_data['name'],
-                capacity=room_data['capacity'],
-                description=room_data.get('description', ''),
-                equipment=room_data.get('equipment', ''),
-                status=room_data.get('status', 'available')
-            )
+    def _restore_records(self, backup_file_path, restore_options, progress=None):
+        """在事务中批量恢复备份记录，返回各类数据的数量"""
+        restore = BulkRestore(restore_options, progress)
+        for kind, record in iter_backup_records(backup_file_path):
+            restore.add(kind, record)
+        return restore.finish()
     
-    def _restore_reservations(self, reservations_data):
-        """恢复预约数据"""
-        # 清空现有数据
-        Reservation.objects.all().delete()
+    def _restore_chain(self, chain, progress=None):
+        """
+        恢复全量备份后依次应用差异备份
         
-        # 恢复数据
-        for reservation_data in reservations_data:
-            try:
-                room = Room.objects.get(id=reservation_data['room_id'])
-                Reservation.objects.create(
-                    id=reservation_data['id'],
-                    room=room,
-                    date=datetime.fromisoformat(reservation_data['date']).date(),
-                    start_time=datetime.strptime(reservation_data['start_time'], '%H:%M').time(),
-                    end_time=datetime.strptime(reservation_data['end_time'], '%H:%M').time(),
-                    title=reservation_data['title'],
-                    booker=reservation_data['booker'],
-                    department=reservation_data.get('department', '')
+        快照按页恢复后单独提交，之后应用差异备份失败时自动恢复恢复前快照，数据回到恢复前的状态。
+        """
+        base_path, diff_paths = chain[0], chain[1:]
+        try:
+            started = datetime.now()
+            if is_snapshot(base_path):
+                success, pre_restore_path, message = self.create_snapshot(
+                    'pre_restore', f'恢复前自动备份 - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
                 )
-            except Room.DoesNotExist:
-                logger.warning(f"恢复预约时找不到会议室 ID: {reservation_data['room_id']}")
-                continue
+                if not success:
+                    return False, f"数据恢复失败: {message}"
+                success, message = self.restore_snapshot(base_path, pre_restore=False)
+                if not success:
+                    return False, message
+                try:
+                    run_in_write_transaction(SCOPE_RESERVATIONS, self._apply_differentials, diff_paths, progress)
+                except Exception as e:
+                    return False, self._rollback_chain(pre_restore_path, e)
+            else:
+                self.create_backup('pre_restore', f'恢复前自动备份 - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
+                run_in_write_transaction(
+                    SCOPE_RESERVATIONS, self._restore_chain_records, base_path, diff_paths, progress
+                )
+            
+            elapsed = (datetime.now() - started).total_seconds()
+            logger.info(
+                f"数据恢复成功: {chain[-1]}（全量备份 {os.path.basename(base_path)} "
+                f"及{len(diff_paths)}个差异备份，{elapsed:.2f}秒）"
+            )
+            return True, "数据恢复成功"
+        
+        except Exception as e:
+            error_msg = f"数据恢复失败: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
     
-    def _restore_settings(self, settings_data):
-        """恢复设置数据"""
-        # 清空现有数据
-        Settings.objects.all().delete()
-        
-        # 恢复数据
-        for setting_data in settings_data:
-            Settings.objects.create(
-                key=setting_data['key'],
-                value=setting_data['value'],
-                description=setting_data.get('description', '')
+    def _rollback_chain(self, pre_restore_path, error):
+        """应用差异备份失败时恢复恢复前快照，返回说明数据状态的错误信息"""
+        pre_restore_file = os.path.basename(pre_restore_path)
+        success, message = self.restore_snapshot(pre_restore_path, pre_restore=False)
+        if success:
+            error_msg = f"数据恢复失败: {str(error)}，已回滚到恢复前的数据"
+        else:
+            error_msg = (
+                f"数据恢复失败: {str(error)}，回滚失败（{message}），"
+                f"数据停留在全量快照状态，可手动恢复 {pre_restore_file}"
             )
+        logger.error(error_msg)
+        return error_msg
+    
+    def _restore_chain_records(self, base_path, diff_paths, progress=None):
+        full_options = {'rooms': True, 'reservations': True, 'settings': True}
+        self._restore_records(base_path, full_options, progress)
+        self._apply_differentials(diff_paths, progress)
+    
+    def _apply_differentials(self, diff_paths, progress=None):
+        for diff_path in diff_paths:
+            self._apply_differential(diff_path, progress)
+    
+    def _apply_differential(self, diff_path, progress=None):
+        """
+        在事务中应用一个差异备份：按ID写入（存在则更新）变更的行，删除已删除的行，替换全部设置
+        
+        差异备份的行数与变更量相当，直接读入内存并用 bulk_create 的冲突更新写入。
+        """
+        data = load_backup(diff_path)
+        deleted = {MODEL_ROOM: set(), MODEL_RESERVATION: set()}
+        for record in data['deleted']:
+            deleted[record['model']].add(record['id'])
+        
+        # 会议室
+        room_versions = dict(Room.objects.values_list('id', 'version'))
+        rooms = [
+            Room(
+                id=row['id'],
+                name=row['name'],
+                capacity=row['capacity'],
+                description=row.get('description', ''),
+                equipment=row.get('equipment', ''),
+                status=row.get('status', 'available'),
+                version=room_versions.get(row['id'], 0) + 1,
+            )
+            for row in data['rooms']
+        ]
+        Room.objects.bulk_create(
+            rooms, batch_size=RESTORE_BATCH_SIZE, update_conflicts=True, unique_fields=['id'],
+            update_fields=['name', 'capacity', 'description', 'equipment', 'status', 'version'],
+        )
+        deleted_rooms = deleted[MODEL_ROOM] & set(room_versions)
+        
+        # 预约：先记下被修改、删除的预约原来的时段，占用位图按新旧时段重建
+        touched_ids = sorted({row['id'] for row in data['reservations']} | deleted[MODEL_RESERVATION])
+        old_rows = {}
+        for i in range(0, len(touched_ids), RESTORE_BATCH_SIZE):
+            old_rows.update(
+                (res_id, (room_id, res_date, version))
+                for res_id, room_id, res_date, version in Reservation.objects.filter(
+                    id__in=touched_ids[i:i + RESTORE_BATCH_SIZE]
+                ).values_list('id', 'room_id', 'date', 'version')
+            )
+        slot_pairs = {(room_id, res_date) for room_id, res_date, _ in old_rows.values()}
+        
+        # 会议室被删除时其预约一并删除（与级联删除一致）
+        cascaded = Reservation.objects.filter(room_id__in=deleted_rooms)
+        deleted_reservations = (deleted[MODEL_RESERVATION] & set(old_rows)) | set(cascaded.values_list('id', flat=True))
+        cascaded._raw_delete(cascaded.db)
+        ids = sorted(deleted_reservations)
+        for i in range(0, len(ids), RESTORE_BATCH_SIZE):
+            batch = Reservation.objects.filter(id__in=ids[i:i + RESTORE_BATCH_SIZE])
+            batch._raw_delete(batch.db)
+        occupancy = RoomOccupancy.objects.filter(room_id__in=deleted_rooms)
+        occupancy._raw_delete(occupancy.db)
+        rooms_to_delete = Room.objects.filter(id__in=deleted_rooms)
+        rooms_to_delete._raw_delete(rooms_to_delete.db)
+        
+        room_ids = (set(room_versions) | {room.id for room in rooms}) - deleted_rooms
+        reservations = []
+        skipped = 0
+        for row in data['reservations']:
+            if row['room_id'] not in room_ids:
+                logger.warning(f"应用差异备份时找不到会议室 ID: {row['room_id']}")
+                skipped += 1
+                continue
+            old = old_rows.get(row['id'])
+            reservations.append(Reservation(
+                id=row['id'],
+                room_id=row['room_id'],
+                date=date.fromisoformat(row['date']),
+                start_time=time.fromisoformat(row['start_time']),
+                end_time=time.fromisoformat(row['end_time']),
+                title=row['title'],
+                booker=row['booker'],
+                department=row.get('department', ''),
+                created_at=_parse_created_at(row.get('created_at')),
+                version=old[2] + 1 if old else 1,
+            ))
+            slot_pairs.add((row['room_id'], reservations[-1].date))
+        Reservation.objects.bulk_create(
+            reservations, batch_size=RESTORE_BATCH_SIZE, update_conflicts=True, unique_fields=['id'],
+            update_fields=[column for column in RESERVATION_COLUMNS if column != 'id'],
+        )
+        
+        # 设置（差异备份中保存的是全部设置）
+        Settings.objects.all()._raw_delete(Settings.objects.db)
+        Settings.objects.bulk_create([Settings(key=row['key'], value=row['value']) for row in data['settings']])
+        bump_data_version(SCOPE_SETTINGS)
+        invalidate_settings_cache()
+        transaction.on_commit(invalidate_settings_cache)
+        
+        bump_data_version(SCOPE_ROOMS, SCOPE_RESERVATIONS)
+        for model, rows, before, removed in (
+            (MODEL_ROOM, rooms, set(room_versions), deleted_rooms),
+            (MODEL_RESERVATION, reservations, set(old_rows), deleted_reservations),
+        ):
+            written = {row.id for row in rows}
+            record_changes(model, ACTION_UPDATE, sorted(written & before))
+            record_changes(model, ACTION_CREATE, sorted(written - before))
+            record_changes(model, ACTION_DELETE, sorted(removed))
+        rebuild_occupancy(slot_pairs)
+        
+        if progress:
+            progress('rooms', len(rooms))
+            progress('reservations', len(reservations))
+            progress('settings', len(data['settings']))
+        logger.info(
+            f"应用差异备份: {os.path.basename(diff_path)}（会议室{len(rooms)}个，预约{len(reservations)}条，"
+            f"删除{len(deleted_rooms) + len(deleted_reservations)}条，跳过{skipped}条）"
+        )
+    
+    def prune_backups(self, max_backups=None, keep_days=None):
+        """
+        按数量和时间清理旧备份：只保留最近 max_backups 个，删除早于 keep_days 天的备份
+        
+        最新的一个备份总是保留（数据长期未变化时定时备份会跳过，最新备份可能早于保留期限）；
+        保留的差异备份所依赖的基础备份也保留。
+        
+        Returns:
+            list: 删除的备份文件名
+        """
+        config = get_backup_config()
+        max_backups = config['MAX_BACKUPS'] if max_backups is None else max_backups
+        keep_days = config['KEEP_DAYS'] if keep_days is None else keep_days
+        cutoff_date = datetime.now() - timedelta(days=keep_days)
+        
+        backups = self.list_backups()
+        bases = {backup['filename']: backup['base'] for backup in backups}
+        keep = set()
+        for index, backup in enumerate(backups):
+            if index == 0 or (index < max_backups and backup['created_time'] >= cutoff_date):
+                filename = backup['filename']
+                while filename and filename not in keep:
+                    keep.add(filename)
+                    filename = bases.get(filename)
+        
+        removed = []
+        for backup in backups:
+            if backup['filename'] in keep:
+                continue
+            try:
+                self._remove_backup(backup['filename'])
+                removed.append(backup['filename'])
+                logger.info(f"清理旧备份文件: {backup['filename']}")
+            except OSError as e:
+                logger.warning(f"清理旧备份文件 {backup['filename']} 时出错: {str(e)}")
+        return removed
+    
+    def _remove_backup(self, filename):
+        """删除备份文件及其目录条目"""
+        os.remove(os.path.join(self.backup_dir, filename))
+        catalog_path = self._catalog_path(filename)
+        if os.path.exists(catalog_path):
+            os.remove(catalog_path)
+    
+    def _catalog_path(self, filename):
+        return os.path.join(self.backup_dir, CATALOG_DIR, filename + '.json')
+    
+    def _write_catalog_entry(self, backup_path, metadata, counts):
+        """写入备份的目录条目（先写临时文件再改名），返回条目"""
+        filename = os.path.basename(backup_path)
+        entry = {
+            'filename': filename,
+            'backup_time': metadata.get('backup_time'),
+            'backup_type': metadata.get('backup_type', 'unknown'),
+            'description': metadata.get('description', ''),
+            'data_versions': metadata.get('data_versions'),
+            'journal_cursor': metadata.get('journal_cursor'),
+            'base': metadata.get('base'),
+            'format': 'sqlite' if is_snapshot(filename) else 'jsonl',
+            'counts': counts,
+            'size': os.path.getsize(backup_path),
+            'sha256': file_checksum(backup_path),
+        }
+        catalog_path = self._catalog_path(filename)
+        os.makedirs(os.path.dirname(catalog_path), exist_ok=True)
+        with open(catalog_path + '.partial', 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(catalog_path + '.partial', catalog_path)
+        return entry
     
-    def _cleanup_old_backups(self, keep_days=30):
-        """清理旧备份文件"""
+    def get_catalog_entry(self, filename, size=None):
+        """
+        读取备份的目录条目
+        
+        没有条目或文件大小与条目不一致（旧备份、外部复制或改动过的文件）时读取备份补写条目。
+        
+        Returns:
+            dict: 目录条目，备份无法读取时为 None
+        """
+        file_path = os.path.join(self.backup_dir, filename)
+        if size is None:
+            size = os.path.getsize(file_path)
         try:
-            cutoff_date = datetime.now() - timedelta(days=keep_days)
-            
-            for filename in os.listdir(self.backup_dir):
-                if filename.startswith('backup_') and filename.endswith('.json'):
-                    file_path = os.path.join(self.backup_dir, filename)
-                    file_time = datetime.fromtimestamp(os.path.getctime(file_path))
-                    
-                    if file_time < cutoff_date:
-                        os.remove(file_path)
-                        logger.info(f"清理旧备份文件: {filename}")
-                        
+            with open(self._catalog_path(filename), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if entry.get('size') == size:
+                return entry
+        except (OSError, ValueError):
+            pass
+        
+        metadata = {}
+        counts = None
+        try:
+            for kind, record in iter_backup_records(file_path):
+                if kind == 'metadata':
+                    metadata = record
+                elif kind == 'summary':
+                    counts = record.get('counts', {})
+                    break
+            return self._write_catalog_entry(file_path, metadata, counts or {})
         except Exception as e:
-            logger.warning(f"清理旧备份文件时出错: {str(e)}")
+            logger.warning(f"读取备份文件 {filename} 失败: {str(e)}")
+            return None
     
     def list_backups(self):
-        """列出所有备份文件"""
+        """列出所有备份文件及其元数据和各类数据数量（读取备份目录条目，不打开备份文件）"""
         backups = []
         try:
-            for filename in os.listdir(self.backup_dir):
-                if filename.startswith('backup_') and filename.endswith('.json'):
-                    file_path = os.path.join(self.backup_dir, filename)
-                    file_stat = os.stat(file_path)
-                    
-                    # 尝试读取备份元数据
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            backup_data = json.load(f)
-                            metadata = backup_data.get('metadata', {})
-                    except:
-                        metadata = {}
-                    
+            with os.scandir(self.backup_dir) as entries:
+                for item in entries:
+                    if not is_backup_filename(item.name):
+                        continue
+                    file_stat = item.stat()
+                    entry = self.get_catalog_entry(item.name, file_stat.st_size) or {}
+                    counts = entry.get('counts', {})
                     backups.append({
-                        'filename': filename,
-                        'file_path': file_path,
+                        'filename': item.name,
+                        'file_path': item.path,
                         'size': file_stat.st_size,
                         'created_time': datetime.fromtimestamp(file_stat.st_ctime),
-                        'backup_type': metadata.get('backup_type', 'unknown'),
-                        'description': metadata.get('description', ''),
-                        'rooms_count': len(backup_data.get('rooms', [])) if 'rooms' in locals() else 0,
-                        'reservations_count': len(backup_data.get('reservations', [])) if 'reservations' in locals() else 0
+                        'backup_type': entry.get('backup_type', 'unknown'),
+                        'description': entry.get('description', ''),
+                        'rooms_count': counts.get('rooms', 0),
+                        'reservations_count': counts.get('reservations', 0),
+                        'settings_count': counts.get('settings', 0),
+                        'sha256': entry.get('sha256'),
+                        'data_versions': entry.get('data_versions'),
+                        'journal_cursor': entry.get('journal_cursor'),
+                        'base': entry.get('base'),
                     })
             
             # 按创建时间排序
@@ -261,50 +1372,20 @@ class BackupManager:
         
         return backups
     
-    def validate_data_integrity(self):
-        """验证数据完整性"""
-        issues = []
+    def validate_data_integrity(self, workers=1):
+        """
+        验证数据完整性
+        
+        Args:
+            workers: 检查预约的并行进程数（见 integrity.find_integrity_issues）
         
+        Returns:
+            list: 问题列表 [{'code', 'severity', 'ids', 'message'}, ...]
+        """
         try:
-            # 检查会议室数据
-            rooms = Room.objects.all()
-            if not rooms.exists():
-                issues.append("警告: 没有会议室数据")
-            
-            for room in rooms:
-                if not room.name or not room.name.strip():
-                    issues.append(f"错误: 会议室 ID {room.id} 名称为空")
-                if room.capacity <= 0:
-                    issues.append(f"错误: 会议室 '{room.name}' 容量无效: {room.capacity}")
-            
-            # 检查预约数据
-            reservations = Reservation.objects.all()
-            for reservation in reservations:
-                if not reservation.room:
-                    issues.append(f"错误: 预约 ID {reservation.id} 关联的会议室不存在")
-                if reservation.start_time >= reservation.end_time:
-                    issues.append(f"错误: 预约 '{reservation.title}' 时间设置无效")
-                if not reservation.title or not reservation.title.strip():
-                    issues.append(f"警告: 预约 ID {reservation.id} 标题为空")
-                if not reservation.booker or not reservation.booker.strip():
-                    issues.append(f"警告: 预约 '{reservation.title}' 预约人为空")
-            
-            # 检查重复预约
-            for reservation in reservations:
-                conflicts = Reservation.objects.filter(
-                    room=reservation.room,
-                    date=reservation.date,
-                    start_time__lt=reservation.end_time,
-                    end_time__gt=reservation.start_time
-                ).exclude(id=reservation.id)
-                
-                if conflicts.exists():
-                    issues.append(f"错误: 预约 '{reservation.title}' 存在时间冲突")
-            
+            return find_integrity_issues(workers)
         except Exception as e:
-            issues.append(f"数据完整性检查时出错: {str(e)}")
-        
-        return issues
+            return [make_issue('CHECK_FAILED', SEVERITY_ERROR, [], f"数据完整性检查时出错: {str(e)}")]
 
 # 全局备份管理器实例
 backup_manager = BackupManager()
\ No newline at end of file
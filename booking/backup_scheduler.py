@@ -0,0 +1,144 @@
+"""
+定时备份
+每隔 AUTO_BACKUP_INTERVAL 秒检查一次：数据版本自上一个备份以来有变化才创建备份，
+之后按 MAX_BACKUPS / KEEP_DAYS 清理旧备份。备份和清理都不在请求中执行。
+开启 AUTO_BACKUP_DIFFERENTIAL 时，最近的全量备份未超过 FULL_BACKUP_INTERVAL 秒就只创建差异备份。
+
+Web进程内由后台线程运行（SCHEDULER_IN_PROCESS），也可以用
+`python manage.py backup_scheduler --loop` 单独运行。多个进程（gunicorn worker、命令）
+通过备份目录下的文件锁保证同一时间只有一个在运行；其他进程每隔 SCHEDULER_LOCK_RETRY 秒
+重试获取锁，持有锁的进程退出后很快由其他进程接替。
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from django.db import close_old_connections
+from .backup_manager import BackupManager, current_data_versions, get_backup_config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILENAME = '.scheduler.lock'
+
+
+class SchedulerLock:
+    """备份目录下的进程间文件锁（非阻塞，进程退出时由操作系统释放）"""
+
+    def __init__(self, backup_dir):
+        self.path = os.path.join(backup_dir, LOCK_FILENAME)
+        self.file = None
+
+    def acquire(self):
+        """尝试获取锁，已持有时直接返回 True"""
+        if self.file is not None:
+            return True
+        f = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def versions_equal(a, b):
+    """两组数据版本是否相同（缺失的范围视为0）"""
+    a, b = a or {}, b or {}
+    return all(a.get(scope, 0) == b.get(scope, 0) for scope in set(a) | set(b))
+
+
+def run_scheduled_backup(manager=None):
+    """
+    执行一次定时备份和清理
+
+    Returns:
+        dict: {'created': 新备份路径或 None, 'skipped': 数据未变化而跳过, 'removed': [删除的备份]}
+    """
+    manager = manager or BackupManager()
+    config = get_backup_config()
+    result = {'created': None, 'skipped': False, 'removed': []}
+
+    backups = manager.list_backups()
+    latest_versions = backups[0]['data_versions'] if backups else None
+    # 旧备份没有记录数据版本，无法判断，照常备份
+    if latest_versions is not None and versions_equal(latest_versions, current_data_versions()):
+        result['skipped'] = True
+        logger.debug(f"数据自上次备份（{backups[0]['filename']}）以来没有变化，跳过定时备份")
+    else:
+        result['created'] = _create_backup(manager, config, backups)
+
+    result['removed'] = manager.prune_backups()
+    return result
+
+
+def _create_backup(manager, config, backups):
+    """创建一个定时备份：可以时创建差异备份，否则（或差异备份失败时）创建全量备份，返回路径"""
+    if config['AUTO_BACKUP_DIFFERENTIAL']:
+        full = next((b for b in backups if b['base'] is None and b['journal_cursor'] is not None), None)
+        if full and datetime.now() - full['created_time'] < timedelta(seconds=config['FULL_BACKUP_INTERVAL']):
+            success, path, message = manager.create_differential(full['filename'], '定时差异备份')
+            if success:
+                return path
+            logger.warning(f"{message}，改为创建全量备份")
+    create = manager.create_snapshot if config['AUTO_BACKUP_SNAPSHOT'] else manager.create_backup
+    success, path, message = create('auto', '定时自动备份')
+    if not success:
+        raise RuntimeError(message)
+    return path
+
+
+class BackupScheduler:
+    """本进程的定时备份线程：拿到文件锁的进程按备份间隔执行备份，其他进程按较短的间隔重试获取锁"""
+
+    def __init__(self):
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='backup-scheduler', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        manager = BackupManager()
+        file_lock = SchedulerLock(manager.backup_dir)
+        while True:
+            config = get_backup_config()
+            if not file_lock.acquire():
+                time.sleep(config['SCHEDULER_LOCK_RETRY'])
+                continue
+            close_old_connections()
+            try:
+                run_scheduled_backup(manager)
+            except Exception as e:
+                logger.error(f"定时备份出错: {str(e)}")
+            finally:
+                close_old_connections()
+            time.sleep(config['AUTO_BACKUP_INTERVAL'])
+
+
+_scheduler = BackupScheduler()
+
+
+def start_backup_scheduler():
+    """在Web进程内启动定时备份线程（AUTO_BACKUP_ENABLED 且 SCHEDULER_IN_PROCESS 时）"""
+    config = get_backup_config()
+    if config['AUTO_BACKUP_ENABLED'] and config['SCHEDULER_IN_PROCESS']:
+        _scheduler.start()
@@ -0,0 +1,168 @@
+"""
+接口响应缓存
+缓存 load_* 接口序列化后的JSON字节（连同视图设置的响应头，如分页游标 X-Next-Cursor），
+缓存键包含数据版本（即ETag），
+任何写入都会递增版本，旧缓存不会再被命中；写入提交后再主动删除旧条目释放空间。
+
+缓存后端由 settings.CACHES 配置：默认进程内存（locmem），
+多worker部署时使用 file 或 db 后端在进程间共享缓存和命中统计。
+"""
+import logging
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'booking'
+STATS_NAMES = ('hits', 'misses', 'stores', 'invalidations')
+
+
+def get_cache_config():
+    """读取 settings.BOOKING_CACHE 配置"""
+    config = {
+        'ALIAS': 'default',
+        'TIMEOUT': 3600,
+        'MAX_PAYLOAD_BYTES': 5 * 1024 * 1024,
+    }
+    config.update(getattr(settings, 'BOOKING_CACHE', {}))
+    return config
+
+
+def get_cache():
+    return caches[get_cache_config()['ALIAS']]
+
+
+def _payload_key(name, etag):
+    return '%s:payload:%s:%s' % (KEY_PREFIX, name, etag.strip('"'))
+
+
+def _index_key(scope):
+    return f"{KEY_PREFIX}:index:{scope}"
+
+
+def _stats_key(name):
+    return f"{KEY_PREFIX}:stats:{name}"
+
+
+def _incr_stat(name):
+    cache = get_cache()
+    key = _stats_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # 计数器不存在时初始化（并发初始化时最多少计一次）
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+
+def get_payload(name, etag):
+    """读取缓存的响应内容，未命中返回None"""
+    content = get_cache().get(_payload_key(name, etag))
+    _incr_stat('hits' if content is not None else 'misses')
+    return content
+
+
+def set_payload(name, etag, scopes, content, timeout=None, headers=None):
+    """
+    写入响应内容，并登记到各数据范围的索引中以便失效时删除
+
+    headers 不为空时与内容一起保存为 (content, headers)，命中时原样恢复这些响应头。
+    """
+    config = get_cache_config()
+    if len(content) > config['MAX_PAYLOAD_BYTES']:
+        return
+    cache = get_cache()
+    key = _payload_key(name, etag)
+    value = content if headers is None else (content, headers)
+    cache.set(key, value, timeout=min(timeout, config['TIMEOUT']) if timeout else config['TIMEOUT'])
+    for scope in scopes:
+        index_key = _index_key(scope)
+        keys = cache.get(index_key) or []
+        if key not in keys:
+            keys.append(key)
+            cache.set(index_key, keys, timeout=config['TIMEOUT'])
+    _incr_stat('stores')
+
+
+def invalidate_payloads(*scopes):
+    """删除依赖指定数据范围的所有缓存条目"""
+    cache = get_cache()
+    for scope in scopes:
+        index_key = _index_key(scope)
+        keys = cache.get(index_key) or []
+        cache.delete_many(keys + [index_key])
+    _incr_stat('invalidations')
+
+
+def get_cache_stats():
+    """读取命中统计（共享后端下为所有worker的合计）"""
+    cache = get_cache()
+    values = cache.get_many([_stats_key(name) for name in STATS_NAMES])
+    stats = {name: values.get(_stats_key(name), 0) for name in STATS_NAMES}
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    stats['backend'] = settings.CACHES[get_cache_config()['ALIAS']]['BACKEND'].rsplit('.', 1)[-1]
+    return stats
+
+
+def reset_cache_stats():
+    get_cache().delete_many([_stats_key(name) for name in STATS_NAMES])
+
+
+def _tee_stream(chunks, name, etag, scopes, headers):
+    """边输出边收集流式响应，完整输出且不超过上限时写入缓存"""
+    limit = get_cache_config()['MAX_PAYLOAD_BYTES']
+    collected = []
+    size = 0
+    for chunk in chunks:
+        if collected is not None:
+            size += len(chunk)
+            if size > limit:
+                collected = None
+            else:
+                collected.append(chunk)
+        yield chunk
+    if collected is not None:
+        set_payload(name, etag, scopes, b''.join(collected), headers=headers)
+
+
+def cached_payload(name, *scopes):
+    """
+    响应缓存装饰器，需放在 versioning.versioned_response 之内使用，
+    以复用其计算出的 request.data_etag 作为缓存键。
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            etag = getattr(request, 'data_etag', None)
+            if etag is None:
+                return view_func(request, *args, **kwargs)
+
+            cached = get_payload(name, etag)
+            if cached is not None:
+                content, headers = cached if isinstance(cached, tuple) else (cached, {})
+                response = HttpResponse(content, content_type='application/json')
+                for header, value in headers.items():
+                    response[header] = value
+                return response
+
+            response = view_func(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            # 视图设置的响应头（内容类型和长度由命中时的新响应重新生成）
+            headers = {
+                header: value for header, value in response.items()
+                if header.lower() not in ('content-type', 'content-length')
+            }
+            if isinstance(response, StreamingHttpResponse):
+                response.streaming_content = _tee_stream(response.streaming_content, name, etag, scopes, headers)
+            else:
+                set_payload(name, etag, scopes, response.content, headers=headers)
+            return response
+        return wrapper
+    return decorator
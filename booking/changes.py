@@ -0,0 +1,112 @@
+"""
+数据变更日志（增量同步）
+记录会议室和预约的新增、修改、删除事件；客户端保存游标后
+只需拉取游标之后的变更，无需重新下载全部数据。
+"""
+import logging
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+from .models import ChangeLog, DataVersion
+
+logger = logging.getLogger(__name__)
+
+MODEL_ROOM = 'room'
+MODEL_RESERVATION = 'reservation'
+
+ACTION_CREATE = 'create'
+ACTION_UPDATE = 'update'
+ACTION_DELETE = 'delete'
+
+# 记录已压缩（删除）的最大日志ID，早于该游标的客户端需要全量重新加载
+JOURNAL_FLOOR_SCOPE = 'journal_floor'
+
+
+def record_changes(model, action, object_ids):
+    """
+    批量写入变更日志（在调用方事务内执行）
+
+    恢复备份等操作一次写入数十万条，用 executemany 直接插入，不逐条构造模型实例。
+    """
+    ops = connection.ops
+    created_at = ops.adapt_datetimefield_value(timezone.now())
+    params = [(model, action, object_id, created_at) for object_id in object_ids]
+    if not params:
+        return
+    sql = 'INSERT INTO {} ({}, {}, {}, {}) VALUES (%s, %s, %s, %s)'.format(
+        ops.quote_name(ChangeLog._meta.db_table),
+        *(ops.quote_name(column) for column in ('model', 'action', 'object_id', 'created_at'))
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def get_journal_floor():
+    """已压缩的最大日志ID"""
+    return DataVersion.objects.filter(scope=JOURNAL_FLOOR_SCOPE).values_list('version', flat=True).first() or 0
+
+
+def get_current_cursor():
+    """当前最新游标"""
+    latest = ChangeLog.objects.aggregate(latest=Max('id'))['latest']
+    return max(latest or 0, get_journal_floor())
+
+
+def collect_changes(since, limit=1000):
+    """
+    读取游标之后的变更并按对象合并（同一对象只保留最后一次操作）
+
+    Returns:
+        dict: {
+            'reset': 游标已被压缩，需要全量重新加载,
+            'cursor': 新游标,
+            'has_more': 是否还有更多变更,
+            'changed': {model: [object_id, ...]},
+            'deleted': {model: [object_id, ...]},
+        }
+    """
+    result = {
+        'reset': False,
+        'cursor': since,
+        'has_more': False,
+        'changed': {MODEL_ROOM: [], MODEL_RESERVATION: []},
+        'deleted': {MODEL_ROOM: [], MODEL_RESERVATION: []},
+    }
+    if since < get_journal_floor():
+        result['reset'] = True
+        result['cursor'] = get_current_cursor()
+        return result
+
+    entries = list(
+        ChangeLog.objects.filter(id__gt=since).order_by('id')
+        .values_list('id', 'model', 'object_id', 'action')[:limit + 1]
+    )
+    if len(entries) > limit:
+        entries = entries[:limit]
+        result['has_more'] = True
+
+    last_action = {}
+    for entry_id, model, object_id, action in entries:
+        last_action[(model, object_id)] = action
+        result['cursor'] = entry_id
+
+    for (model, object_id), action in last_action.items():
+        bucket = 'deleted' if action == ACTION_DELETE else 'changed'
+        result[bucket].setdefault(model, []).append(object_id)
+    return result
+
+
+def compact_journal(before):
+    """
+    删除早于指定时间的变更日志，并记录压缩位置
+
+    Returns:
+        int: 删除的日志条数
+    """
+    floor = ChangeLog.objects.filter(created_at__lt=before).aggregate(floor=Max('id'))['floor']
+    if floor is None:
+        return 0
+    deleted, _ = ChangeLog.objects.filter(id__lte=floor).delete()
+    DataVersion.objects.update_or_create(scope=JOURNAL_FLOOR_SCOPE, defaults={'version': floor})
+    logger.info(f"压缩变更日志: 删除{deleted}条，压缩位置 #{floor}")
+    return deleted
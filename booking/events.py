@@ -0,0 +1,248 @@
+"""
+Server-Sent Events 推送
+状态显示屏通过 /api/events/ 订阅会议室和预约的变更，替代定时轮询。
+
+每个进程只有一个后台任务轮询变更日志，再把变更分发给所有订阅者，
+空闲连接只占用一个等待中的协程，单个异步worker即可保持数百个连接。
+需要通过 asgi.py 以 ASGI 方式部署（如 uvicorn），WSGI 下返回 503，
+前端会自动退回到 /api/changes/ 轮询。
+"""
+import asyncio
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from .api import build_changes_payload
+from .changes import get_current_cursor
+
+logger = logging.getLogger(__name__)
+
+
+def get_event_config():
+    """读取 settings.EVENT_STREAM 配置"""
+    config = {
+        'POLL_INTERVAL': 1.0,  # 变更日志轮询间隔（秒）
+        'HEARTBEAT_INTERVAL': 15,  # 无事件时发送心跳的间隔（秒）
+        'MAX_CONNECTION_AGE': 600,  # 单个连接最长保持时间（秒），到期后由客户端带 Last-Event-ID 重连
+        'RETRY_MS': 3000,  # 建议客户端的重连间隔（毫秒）
+        'QUEUE_SIZE': 100,  # 每个订阅者最多积压的事件数
+    }
+    config.update(getattr(settings, 'EVENT_STREAM', {}))
+    return config
+
+
+def format_sse(data=None, event=None, event_id=None, retry=None, comment=None):
+    """按 text/event-stream 格式编码一条消息"""
+    lines = []
+    if comment is not None:
+        lines.append(f': {comment}')
+    if retry is not None:
+        lines.append(f'retry: {retry}')
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    if data is not None:
+        for line in json.dumps(data, ensure_ascii=False).splitlines():
+            lines.append(f'data: {line}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def filter_payload(payload, room_ids):
+    """按订阅的会议室过滤变更；删除的预约无法得知所属会议室，原样保留"""
+    if not room_ids:
+        return payload
+    filtered = dict(payload)
+    filtered['rooms'] = [room for room in payload['rooms'] if room['id'] in room_ids]
+    filtered['reservations'] = [res for res in payload['reservations'] if res['room'] in room_ids]
+    filtered['deleted'] = {
+        'rooms': [room_id for room_id in payload['deleted']['rooms'] if room_id in room_ids],
+        'reservations': payload['deleted']['reservations'],
+    }
+    return filtered
+
+
+def has_changes(payload):
+    return bool(
+        payload['rooms'] or payload['reservations'] or
+        payload['deleted']['rooms'] or payload['deleted']['reservations']
+    )
+
+
+class Subscriber:
+    """单个SSE连接的事件队列"""
+
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # 积压过多时丢弃队列并通知客户端重新全量加载
+        self.lagged = False
+
+    def push(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.lagged = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+
+class ChangeBroadcaster:
+    """轮询变更日志并分发给本进程所有订阅者（每个事件循环一个实例）"""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.cursor = None
+        self.task = None
+
+    async def subscribe(self, subscriber):
+        if self.cursor is None:
+            self.cursor = await sync_to_async(get_current_cursor)()
+        self.subscribers.add(subscriber)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def _run(self):
+        interval = get_event_config()['POLL_INTERVAL']
+        while self.subscribers:
+            try:
+                await self._poll()
+            except Exception as e:
+                logger.error(f"事件推送轮询出错: {str(e)}")
+            await asyncio.sleep(interval)
+        # 没有订阅者时退出，下次订阅重新读取游标
+        self.cursor = None
+
+    async def _poll(self):
+        latest = await sync_to_async(get_current_cursor)()
+        while latest > self.cursor:
+            payload = await sync_to_async(build_changes_payload)(self.cursor)
+            if payload['reset'] or payload['cursor'] <= self.cursor:
+                payload['reset'] = True
+                self.cursor = latest
+            else:
+                self.cursor = payload['cursor']
+            for subscriber in list(self.subscribers):
+                subscriber.push(payload)
+            if payload['reset']:
+                break
+
+
+_broadcasters = {}
+
+
+def get_broadcaster():
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = _broadcasters[loop] = ChangeBroadcaster()
+    return broadcaster
+
+
+def parse_room_filter(value):
+    """解析 room 参数（逗号分隔的会议室ID）"""
+    if not value:
+        return set()
+    room_ids = {r.strip() for r in value.split(',') if r.strip()}
+    if not all(r.isdigit() for r in room_ids):
+        raise ValueError(f'会议室ID格式错误: {value}')
+    return room_ids
+
+
+async def event_generator(room_ids, last_event_id, clock=None):
+    """
+    单个连接的事件流
+
+    先补发 Last-Event-ID 之后的变更，再持续推送广播的变更；
+    空闲时发送心跳注释，连接到期后结束，由客户端自动重连。
+    """
+    config = get_event_config()
+    loop = asyncio.get_running_loop()
+    clock = clock or loop.time
+    deadline = clock() + config['MAX_CONNECTION_AGE']
+
+    subscriber = Subscriber(config['QUEUE_SIZE'])
+    broadcaster = get_broadcaster()
+    # 先订阅再补发，补发期间产生的变更会留在队列中
+    await broadcaster.subscribe(subscriber)
+    try:
+        yield format_sse(retry=config['RETRY_MS'], comment='connected')
+
+        if last_event_id is None:
+            cursor = await sync_to_async(get_current_cursor)()
+            yield format_sse(data={'cursor': cursor}, event='ready', event_id=cursor)
+        else:
+            cursor = last_event_id
+            while True:
+                payload = await sync_to_async(build_changes_payload)(cursor)
+                if payload['reset']:
+                    cursor = payload['cursor']
+                    yield format_sse(data={'cursor': cursor}, event='reset', event_id=cursor)
+                    break
+                if payload['cursor'] > cursor:
+                    cursor = payload['cursor']
+                    payload = filter_payload(payload, room_ids)
+                    if has_changes(payload):
+                        yield format_sse(data=payload, event='changes', event_id=cursor)
+                if not payload['has_more']:
+                    break
+
+        while clock() < deadline:
+            if subscriber.lagged:
+                subscriber.lagged = False
+                cursor = await sync_to_async(get_current_cursor)()
+                yield format_sse(data={'cursor': cursor}, event='reset', event_id=cursor)
+                continue
+            timeout = min(config['HEARTBEAT_INTERVAL'], max(deadline - clock(), 0))
+            try:
+                payload = await asyncio.wait_for(subscriber.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                yield format_sse(comment='heartbeat')
+                continue
+            if payload['reset']:
+                cursor = payload['cursor']
+                yield format_sse(data={'cursor': cursor}, event='reset', event_id=cursor)
+                continue
+            # 补发阶段已发送过的变更
+            if payload['cursor'] <= cursor:
+                continue
+            cursor = payload['cursor']
+            payload = filter_payload(payload, room_ids)
+            if has_changes(payload):
+                yield format_sse(data=payload, event='changes', event_id=cursor)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def event_stream(request):
+    """
+    SSE 事件流接口
+
+    参数：
+        room: 只订阅指定会议室（逗号分隔的ID）
+        last_event_id: 首次连接时的起始游标；重连时浏览器自动发送 Last-Event-ID 请求头
+    """
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'error': '仅支持GET请求'}, status=405)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'success': False, 'error': '事件推送需要以ASGI方式部署，请使用 /api/changes/ 轮询'}, status=503)
+
+    try:
+        room_ids = parse_room_filter(request.GET.get('room'))
+        last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id not in (None, '') else None
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    response = StreamingHttpResponse(
+        event_generator(room_ids, last_event_id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # 禁止反向代理缓冲事件流
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,146 @@
+"""
+数据完整性检查
+会议室数据量很小，整体读入内存检查；预约按 (会议室, 日期, 开始时间) 排序后流式读取，
+一次扫描找出时间重叠：同一会议室同一天内，开始时间早于此前最晚结束时间的预约与结束最晚的那条重叠。
+排序由 booking_res_room_date_idx 索引完成，检查本身是线性的。
+
+不同日期的预约不会互相重叠，数据量很大时可按日期分段，在进程池中并行检查。
+"""
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.db import connection, connections
+from .models import Room, Reservation
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_ERROR = 'error'
+SEVERITY_WARNING = 'warning'
+
+# 并行检查时每个进程分到的日期段数，段数多一些可以平衡各段的预约数量
+PARTITIONS_PER_WORKER = 4
+ITERATOR_CHUNK_SIZE = 2000
+
+
+def make_issue(code, severity, ids, message):
+    """
+    Returns:
+        dict: {'code': 问题代码, 'severity': error / warning, 'ids': [相关记录ID], 'message': 说明}
+    """
+    return {'code': code, 'severity': severity, 'ids': list(ids), 'message': message}
+
+
+def check_rooms():
+    """检查会议室数据，返回 (问题列表, 会议室ID集合)"""
+    issues = []
+    room_ids = set()
+    for room_id, name, capacity in Room.objects.values_list('id', 'name', 'capacity'):
+        room_ids.add(room_id)
+        if not name or not name.strip():
+            issues.append(make_issue('ROOM_NAME_EMPTY', SEVERITY_ERROR, [room_id], f"会议室 ID {room_id} 名称为空"))
+        if capacity is None or capacity <= 0:
+            issues.append(make_issue('ROOM_CAPACITY_INVALID', SEVERITY_ERROR, [room_id],
+                                     f"会议室 '{name}' 容量无效: {capacity}"))
+    if not room_ids:
+        issues.append(make_issue('NO_ROOMS', SEVERITY_WARNING, [], "没有会议室数据"))
+    return issues, room_ids
+
+
+def check_reservations(room_ids, date_from=None, date_to=None):
+    """
+    一次扫描检查预约（可限定日期范围，包含两端）
+
+    Args:
+        room_ids: 存在的会议室ID集合，用于在内存中检查外键
+    """
+    issues = []
+    queryset = Reservation.objects.all()
+    if date_from is not None:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(date__lte=date_to)
+    rows = queryset.order_by('room_id', 'date', 'start_time').values_list(
+        'id', 'room_id', 'date', 'start_time', 'end_time', 'title', 'booker'
+    ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+    current_key = None
+    latest_end = None  # 当前会议室日期内最晚的结束时间
+    latest_id = None
+    for res_id, room_id, date, start_time, end_time, title, booker in rows:
+        if room_id not in room_ids:
+            issues.append(make_issue('RESERVATION_ROOM_MISSING', SEVERITY_ERROR, [res_id],
+                                     f"预约 ID {res_id} 关联的会议室不存在"))
+        if start_time >= end_time:
+            issues.append(make_issue('RESERVATION_TIME_INVALID', SEVERITY_ERROR, [res_id],
+                                     f"预约 '{title}' 时间设置无效"))
+        if not title or not title.strip():
+            issues.append(make_issue('RESERVATION_TITLE_EMPTY', SEVERITY_WARNING, [res_id],
+                                     f"预约 ID {res_id} 标题为空"))
+        if not booker or not booker.strip():
+            issues.append(make_issue('RESERVATION_BOOKER_EMPTY', SEVERITY_WARNING, [res_id],
+                                     f"预约 '{title}' 预约人为空"))
+
+        if (room_id, date) != current_key:
+            current_key = (room_id, date)
+            latest_end, latest_id = end_time, res_id
+            continue
+        if start_time < latest_end:
+            issues.append(make_issue('RESERVATION_OVERLAP', SEVERITY_ERROR, [latest_id, res_id],
+                                     f"预约 '{title}' 存在时间冲突（与预约 ID {latest_id}）"))
+        if end_time > latest_end:
+            latest_end, latest_id = end_time, res_id
+    return issues
+
+
+def _date_partitions(parts):
+    """按预约日期把数据分为最多 parts 段，返回 [(起始日期, 结束日期), ...]"""
+    dates = list(Reservation.objects.order_by('date').values_list('date', flat=True).distinct())
+    if not dates:
+        return []
+    size = -(-len(dates) // parts)
+    return [(dates[i], dates[min(i + size, len(dates)) - 1]) for i in range(0, len(dates), size)]
+
+
+def _check_partition(room_ids, date_from, date_to):
+    """进程池中执行：检查一段日期内的预约"""
+    try:
+        return check_reservations(room_ids, date_from, date_to)
+    finally:
+        connections.close_all()
+
+
+def _pool_options():
+    """
+    进程池参数：支持 fork 时直接继承已初始化的 Django；
+    只支持 spawn 时（Windows、macOS 默认）子进程是全新的解释器，需先执行 django.setup()
+    （DJANGO_SETTINGS_MODULE 从父进程的环境变量继承）
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return {'mp_context': multiprocessing.get_context('fork')}
+    return {'mp_context': multiprocessing.get_context('spawn'), 'initializer': django.setup}
+
+
+def find_integrity_issues(workers=1):
+    """
+    检查会议室和预约数据
+
+    Args:
+        workers: 大于1时按日期分段在进程池中并行检查预约（各进程使用自己的数据库连接）；
+            在事务中调用时其他进程看不到未提交的数据，仍在本进程中检查
+
+    Returns:
+        list: 问题列表（见 make_issue），会议室的问题在前
+    """
+    issues, room_ids = check_rooms()
+    if workers <= 1 or connection.in_atomic_block:
+        return issues + check_reservations(room_ids)
+
+    partitions = _date_partitions(workers * PARTITIONS_PER_WORKER)
+    # 子进程不能共用父进程的数据库连接
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, **_pool_options()) as executor:
+        futures = [executor.submit(_check_partition, room_ids, date_from, date_to) for date_from, date_to in partitions]
+        for future in futures:
+            issues.extend(future.result())
+    return issues
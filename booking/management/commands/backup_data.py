@@ -0,0 +1,71 @@
+"""
+数据备份命令
+创建 JSON Lines 备份，或使用 SQLite 在线备份接口创建整库快照，
+或创建只包含基础备份之后变更的差异备份
+"""
+import os
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from booking.backup_manager import BackupManager
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '备份会议室、预约和系统设置'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--snapshot',
+            action='store_true',
+            help='按页复制整个数据库（速度更快，只能整体恢复）'
+        )
+        parser.add_argument(
+            '--differential',
+            action='store_true',
+            help='只备份基础备份之后的变更（默认以最新的全量备份为基础）'
+        )
+        parser.add_argument(
+            '--base',
+            default=None,
+            help='差异备份的基础备份文件名（可以是另一个差异备份）'
+        )
+        parser.add_argument(
+            '--no-compress',
+            action='store_true',
+            help='不压缩备份文件'
+        )
+        parser.add_argument(
+            '--type',
+            default='manual',
+            help='备份类型，写入文件名（默认 manual）'
+        )
+        parser.add_argument(
+            '--description',
+            default='',
+            help='备份说明'
+        )
+
+    def handle(self, *args, **options):
+        backup_manager = BackupManager()
+        compress = False if options['no_compress'] else None
+        if options['base'] and not options['differential']:
+            raise CommandError('--base 只能与 --differential 一起使用')
+        if options['differential']:
+            success, path, message = backup_manager.create_differential(
+                options['base'], options['description'], compress=compress
+            )
+        elif options['snapshot']:
+            success, path, message = backup_manager.create_snapshot(
+                options['type'], options['description'], compress=compress
+            )
+        else:
+            success, path, message = backup_manager.create_backup(
+                options['type'], options['description'], compress=compress
+            )
+        if not success:
+            raise CommandError(message)
+        self.stdout.write(
+            self.style.SUCCESS(f'{message}（{os.path.getsize(path)} 字节）')
+        )
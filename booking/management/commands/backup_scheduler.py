@@ -0,0 +1,46 @@
+"""
+定时备份命令
+数据有变化时创建备份并按 MAX_BACKUPS / KEEP_DAYS 清理旧备份；
+未在Web进程内运行定时备份时（BACKUP_SETTINGS['SCHEDULER_IN_PROCESS'] = False）以 --loop 方式常驻运行。
+"""
+import logging
+import time
+from django.core.management.base import BaseCommand
+from booking.backup_manager import BackupManager, get_backup_config
+from booking.backup_scheduler import SchedulerLock, run_scheduled_backup
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '数据有变化时创建备份，并清理超出保留数量或期限的旧备份'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='常驻运行，按 AUTO_BACKUP_INTERVAL 间隔持续检查'
+        )
+
+    def handle(self, *args, **options):
+        manager = BackupManager()
+        file_lock = SchedulerLock(manager.backup_dir)
+        while True:
+            config = get_backup_config()
+            locked = file_lock.acquire()
+            if locked:
+                result = run_scheduled_backup(manager)
+                if result['created']:
+                    self.stdout.write(self.style.SUCCESS(f"已创建备份: {result['created']}"))
+                elif result['skipped']:
+                    self.stdout.write('数据自上次备份以来没有变化，跳过备份')
+                if result['removed']:
+                    logger.info(f"清理旧备份: {len(result['removed'])}个")
+                    self.stdout.write(f"已删除 {len(result['removed'])} 个旧备份")
+            elif not options['loop']:
+                self.stdout.write(self.style.WARNING('其他进程正在运行定时备份'))
+            if not options['loop']:
+                return
+            # 未拿到锁时按较短间隔重试，持锁进程退出后尽快接替
+            time.sleep(config['AUTO_BACKUP_INTERVAL'] if locked else config['SCHEDULER_LOCK_RETRY'])
@@ -0,0 +1,34 @@
+"""
+变更日志压缩命令
+删除过期的变更日志；游标早于压缩位置的客户端会收到 reset 并重新全量加载
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from booking.changes import compact_journal
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '压缩变更日志，删除过期的增量同步记录'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days',
+            type=int,
+            default=getattr(settings, 'CHANGE_JOURNAL', {}).get('KEEP_DAYS', 7),
+            help='保留最近多少天的变更日志（默认取 CHANGE_JOURNAL["KEEP_DAYS"]）'
+        )
+
+    def handle(self, *args, **options):
+        keep_days = options['keep_days']
+        cutoff = timezone.now() - timedelta(days=keep_days)
+        deleted = compact_journal(cutoff)
+        logger.info(f'变更日志压缩完成: 删除{deleted}条')
+        self.stdout.write(
+            self.style.SUCCESS(f'已删除 {deleted} 条早于 {keep_days} 天的变更日志')
+        )
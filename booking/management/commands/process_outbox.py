@@ -0,0 +1,82 @@
+"""
+通知发件箱处理命令
+发送到期的企业微信通知、重新投递死信或清理已发送的记录；
+未在Web进程内发送时（NOTIFICATION_OUTBOX['IN_PROCESS'] = False）以 --loop 方式常驻运行。
+"""
+import logging
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from booking.outbox import get_outbox_config, get_outbox_stats, process_outbox, purge_sent, replay_dead
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '发送待发送的企业微信通知，重新投递或清理通知'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=get_outbox_config()['WORKERS'],
+            help='并发发送的线程数（默认取 NOTIFICATION_OUTBOX["WORKERS"]）'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='常驻运行，按 POLL_INTERVAL 间隔持续发送'
+        )
+        parser.add_argument(
+            '--replay-dead',
+            action='store_true',
+            help='把发送失败（死信）的通知重新放回队列后再发送'
+        )
+        parser.add_argument(
+            '--ids',
+            type=int,
+            nargs='+',
+            help='与 --replay-dead 一起使用，只重新投递指定ID的通知'
+        )
+        parser.add_argument(
+            '--purge-sent-days',
+            type=int,
+            help='删除早于指定天数已发送的通知'
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='只显示各状态的通知数量'
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = get_outbox_stats()
+            self.stdout.write(
+                f"待发送: {stats['pending']}  已发送: {stats['sent']}  发送失败: {stats['dead']}"
+            )
+            return
+
+        if options['replay_dead']:
+            count = replay_dead(options['ids'])
+            logger.info(f'重新投递死信通知: {count}条')
+            self.stdout.write(self.style.SUCCESS(f'已重新投递 {count} 条发送失败的通知'))
+
+        if options['purge_sent_days'] is not None:
+            cutoff = timezone.now() - timedelta(days=options['purge_sent_days'])
+            deleted = purge_sent(cutoff)
+            logger.info(f'清理已发送通知: {deleted}条')
+            self.stdout.write(self.style.SUCCESS(f'已删除 {deleted} 条已发送的通知'))
+            if not options['loop']:
+                return
+
+        while True:
+            result = process_outbox(workers=options['workers'])
+            if result['sent'] or result['failed']:
+                logger.info(f"通知发送完成: 成功{result['sent']}条，失败{result['failed']}条")
+                self.stdout.write(f"成功 {result['sent']} 条，失败 {result['failed']} 条")
+            if not options['loop']:
+                break
+            time.sleep(get_outbox_config()['POLL_INTERVAL'])
@@ -0,0 +1,34 @@
+"""
+重建会议室占用位图
+在绕过ORM直接修改数据库、或位图与预约表不一致时使用
+"""
+import logging
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from booking.models import Reservation, RoomOccupancy
+from booking.occupancy import rebuild_occupancy
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '根据预约记录重建会议室占用位图'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            pairs = set(Reservation.objects.values_list('room_id', 'date').distinct())
+            # 已没有预约的位图直接删除
+            stale_ids = [
+                occ_id for occ_id, room_id, date in RoomOccupancy.objects.values_list('id', 'room_id', 'date')
+                if (room_id, date) not in pairs
+            ]
+            for i in range(0, len(stale_ids), 500):
+                RoomOccupancy.objects.filter(id__in=stale_ids[i:i + 500]).delete()
+            stale = len(stale_ids)
+            rebuild_occupancy(pairs)
+
+        logger.info(f'占用位图重建完成: {len(pairs)} 个会议室日期，删除过期位图 {stale} 个')
+        self.stdout.write(
+            self.style.SUCCESS(f'已重建 {len(pairs)} 个会议室日期的占用位图，删除过期位图 {stale} 个')
+        )
@@ -4,9 +4,11 @@
 """
 import os
 import logging
+from contextlib import nullcontext
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
-from booking.backup_manager import BackupManager
+from booking.backup_manager import BackupManager, is_snapshot
+from booking.integrity import SEVERITY_ERROR
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -18,7 +20,7 @@ class Command(BaseCommand):
         parser.add_argument(
             'backup_file',
             type=str,
-            help='要恢复的备份文件名（不含路径）'
+            help='要恢复的备份文件名（在备份目录中查找）或路径'
         )
         parser.add_argument(
             '--force',
@@ -37,12 +39,42 @@ class Command(BaseCommand):
             default=True,
             help='恢复后验证数据完整性（默认启用）'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='完整性验证的并行进程数（数据量很大时使用）'
+        )
         parser.add_argument(
             '--dry-run',
             action='store_true',
             help='仅验证备份文件，不实际恢复数据'
         )
     
+    def report_progress(self, key, count):
+        """恢复进度（预约每一万条输出一次）"""
+        if key != 'reservations' or count % 10000 == 0:
+            labels = {'rooms': '会议室', 'reservations': '预约', 'settings': '设置'}
+            self.stdout.write(f'  {labels[key]}: 已恢复 {count} 条')
+    
+    def rollback_snapshot(self, backup_manager, current_backup_file, error):
+        """
+        快照恢复已经提交后验证失败：恢复到恢复前的备份，返回错误说明
+        
+        没有恢复前的备份或回滚失败时明确提示数据未回滚。
+        """
+        if not current_backup_file:
+            return f'{error}\n快照数据已写入数据库且未回滚（未创建恢复前的备份）'
+        self.stdout.write(self.style.WARNING('快照数据已写入数据库，正在回滚到恢复前的数据...'))
+        success, message = backup_manager.restore_backup(current_backup_file)
+        if success:
+            return f'{error}\n已回滚到恢复前的数据: {current_backup_file}'
+        return (
+            f'{error}\n快照数据已写入数据库，回滚失败（{message}），数据未回滚。\n'
+            f'可以使用以下命令恢复到恢复前状态:\n'
+            f'python manage.py restore_backup {current_backup_file} --force'
+        )
+    
     def handle(self, *args, **options):
         backup_file = options['backup_file']
         force = options['force']
@@ -54,9 +86,12 @@ class Command(BaseCommand):
             backup_manager = BackupManager()
             
             # 1. 验证备份文件
+            backup_file = backup_manager.resolve_backup_path(backup_file)
             self.stdout.write('正在验证备份文件...')
             if not backup_manager.validate_backup(backup_file):
                 raise CommandError(f'备份文件验证失败: {backup_file}')
+            # 差异备份从链首的全量备份开始恢复，链首为快照时同样不能在事务中执行
+            snapshot = is_snapshot(backup_manager.backup_chain(backup_file)[0])
             
             if dry_run:
                 self.stdout.write(
@@ -86,27 +121,34 @@ class Command(BaseCommand):
             current_backup_file = None
             if backup_current and (existing_rooms > 0 or existing_reservations > 0 or existing_settings > 0):
                 self.stdout.write('正在备份当前数据...')
-                current_backup_file = backup_manager.create_backup(
+                create = backup_manager.create_snapshot if snapshot else backup_manager.create_backup
+                created, current_backup_file, message = create(
                     backup_type='manual',
-                    description=f'恢复前的自动备份 - {backup_file}'
+                    description=f'恢复前的自动备份 - {os.path.basename(backup_file)}'
                 )
+                if not created:
+                    raise CommandError(message)
                 self.stdout.write(
                     self.style.SUCCESS(f'当前数据备份已创建: {current_backup_file}')
                 )
             
-            # 4. 在事务中恢复数据
+            # 4. 在事务中恢复数据（快照按页恢复，不能在事务中执行，验证失败时由 rollback_snapshot 回滚）
             self.stdout.write('正在恢复数据...')
-            with transaction.atomic():
+            restored = False
+            with (nullcontext() if snapshot else transaction.atomic()):
                 try:
-                    success = backup_manager.restore_backup(backup_file)
+                    success, message = backup_manager.restore_backup(backup_file, progress=self.report_progress)
                     if not success:
-                        raise CommandError('数据恢复失败')
+                        raise CommandError(message)
+                    restored = True
                     
                     # 5. 验证数据完整性
                     if verify_data:
                         self.stdout.write('正在验证数据完整性...')
-                        if not backup_manager.validate_data_integrity():
-                            raise CommandError('数据完整性验证失败')
+                        issues = backup_manager.validate_data_integrity(options['workers'])
+                        errors = [issue['message'] for issue in issues if issue['severity'] == SEVERITY_ERROR]
+                        if errors:
+                            raise CommandError(f'数据完整性验证失败（{len(errors)}个错误）:\n' + '\n'.join(errors[:20]))
                     
                     self.stdout.write(
                         self.style.SUCCESS(
@@ -129,6 +171,8 @@ class Command(BaseCommand):
                     )
                     
                 except Exception as e:
+                    if snapshot and restored:
+                        raise CommandError(self.rollback_snapshot(backup_manager, current_backup_file, e))
                     # 如果有当前数据备份，提示可以恢复
                     if current_backup_file:
                         self.stdout.write(
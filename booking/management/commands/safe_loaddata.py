@@ -11,10 +11,14 @@ from django.db import transaction
 from django.conf import settings
 from booking.models import Room, Reservation, Settings
 from booking.backup_manager import BackupManager
+from booking.integrity import find_integrity_issues, SEVERITY_ERROR
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 加载数据时只作为警告输出的问题：现有数据中可能已存在时间重叠的预约，不阻止加载
+WARNING_ONLY_CODES = {'RESERVATION_OVERLAP'}
+
 class Command(BaseCommand):
     help = '安全地加载初始数据，包含备份和验证机制'
     
@@ -204,45 +208,25 @@ class Command(BaseCommand):
             return None
     
     def verify_loaded_data(self):
-        """验证加载的数据完整性"""
+        """验证加载的数据完整性（有错误级别的问题时失败，警告和预约时间重叠只输出）"""
         try:
-            # 验证会议室数据
-            rooms = Room.objects.all()
-            for room in rooms:
-                if not room.name or not room.name.strip():
-                    self.stdout.write(
-                        self.style.ERROR(f'会议室名称为空: ID {room.id}')
-                    )
-                    return False
-                
-                if room.capacity <= 0:
-                    self.stdout.write(
-                        self.style.ERROR(f'会议室容量无效: {room.name}')
-                    )
-                    return False
-            
-            # 验证预约数据
-            reservations = Reservation.objects.all()
-            for reservation in reservations:
-                if not reservation.room:
-                    self.stdout.write(
-                        self.style.ERROR(f'预约缺少会议室: ID {reservation.id}')
-                    )
-                    return False
-                
-                if reservation.start_time >= reservation.end_time:
-                    self.stdout.write(
-                        self.style.ERROR(f'预约时间无效: ID {reservation.id}')
-                    )
-                    return False
-            
+            issues = find_integrity_issues()
+            failed = False
+            for issue in issues:
+                is_error = issue['severity'] == SEVERITY_ERROR and issue['code'] not in WARNING_ONLY_CODES
+                failed = failed or is_error
+                style = self.style.ERROR if is_error else self.style.WARNING
+                self.stdout.write(style(issue['message']))
+            if failed:
+                return False
             self.stdout.write(
                 self.style.SUCCESS('数据完整性验证通过')
             )
             return True
             
         except Exception as e:
+            logger.error(f'数据完整性验证出错: {str(e)}')
             self.stdout.write(
                 self.style.ERROR(f'数据完整性验证失败: {str(e)}')
             )
-            return False
\ No newline at end of file
+            return False
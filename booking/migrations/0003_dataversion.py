@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_initial_versions(apps, schema_editor):
+    DataVersion = apps.get_model('booking', 'DataVersion')
+    for scope in ('rooms', 'reservations', 'settings'):
+        DataVersion.objects.get_or_create(scope=scope, defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0002_reservation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=50, unique=True, verbose_name='数据范围')),
+                ('version', models.BigIntegerField(default=0, verbose_name='版本号')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '数据版本',
+                'verbose_name_plural': '数据版本',
+            },
+        ),
+        migrations.RunPython(create_initial_versions, migrations.RunPython.noop),
+    ]
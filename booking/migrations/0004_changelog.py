@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0003_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('room', '会议室'), ('reservation', '预约')], max_length=20, verbose_name='数据类型')),
+                ('object_id', models.BigIntegerField(verbose_name='对象ID')),
+                ('action', models.CharField(choices=[('create', '新增'), ('update', '修改'), ('delete', '删除')], max_length=10, verbose_name='操作')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='记录时间')),
+            ],
+            options={
+                'verbose_name': '变更日志',
+                'verbose_name_plural': '变更日志',
+            },
+        ),
+    ]
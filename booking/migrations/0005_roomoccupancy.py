@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_occupancy(apps, schema_editor):
+    """为已有预约生成占用位图（15分钟一位）"""
+    Reservation = apps.get_model('booking', 'Reservation')
+    RoomOccupancy = apps.get_model('booking', 'RoomOccupancy')
+    masks = {}
+    for room_id, date, start_time, end_time in Reservation.objects.values_list('room_id', 'date', 'start_time', 'end_time'):
+        first = (start_time.hour * 60 + start_time.minute) // 15
+        last = -(-(end_time.hour * 60 + end_time.minute) // 15)
+        if last > first:
+            masks[(room_id, date)] = masks.get((room_id, date), 0) | (((1 << (last - first)) - 1) << first)
+    RoomOccupancy.objects.bulk_create(
+        [RoomOccupancy(room_id=room_id, date=date, slots=mask.to_bytes(12, 'little')) for (room_id, date), mask in masks.items()],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0004_changelog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日期')),
+                ('slots', models.BinaryField(max_length=12, verbose_name='占用位图')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='booking.room', verbose_name='会议室')),
+            ],
+            options={
+                'verbose_name': '会议室占用位图',
+                'verbose_name_plural': '会议室占用位图',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='roomoccupancy',
+            constraint=models.UniqueConstraint(fields=('room', 'date'), name='booking_occupancy_room_date_uniq'),
+        ),
+        migrations.RunPython(build_occupancy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0005_roomoccupancy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='version',
+            field=models.PositiveIntegerField(default=1, verbose_name='版本号'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='version',
+            field=models.PositiveIntegerField(default=1, verbose_name='版本号'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:22
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0006_row_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=10, verbose_name='操作')),
+                ('reservation_id', models.BigIntegerField(blank=True, null=True, verbose_name='预约ID')),
+                ('payload', models.JSONField(verbose_name='预约快照')),
+                ('status', models.CharField(choices=[('pending', '待发送'), ('sent', '已发送'), ('dead', '发送失败')], default='pending', max_length=10, verbose_name='状态')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='已尝试次数')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='下次发送时间')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='领取到期时间')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='最近错误')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='发送时间')),
+            ],
+            options={
+                'verbose_name': '通知发件箱',
+                'verbose_name_plural': '通知发件箱',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='booking_outbox_due_idx')],
+            },
+        ),
+    ]
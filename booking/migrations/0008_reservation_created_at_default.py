@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:44
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0007_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reservation',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='创建时间'),
+        ),
+    ]
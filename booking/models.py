@@ -1,6 +1,22 @@
 ﻿from django.db import models
+from django.utils import timezone
 
-class Room(models.Model):
+class VersionedModel(models.Model):
+    """带行版本号的模型：每次保存递增版本，用于乐观并发控制（If-Match）"""
+    version = models.PositiveIntegerField(default=1, verbose_name="版本号")
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version'}
+        super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+class Room(VersionedModel):
     """会议室模型"""
     name = models.CharField(max_length=100, verbose_name="会议室名称")
     capacity = models.IntegerField(verbose_name="容量")
@@ -19,7 +35,7 @@ class Room(models.Model):
         verbose_name = "会议室"
         verbose_name_plural = "会议室"
 
-class Reservation(models.Model):
+class Reservation(VersionedModel):
     """预约模型"""
     room = models.ForeignKey(Room, on_delete=models.CASCADE, verbose_name="会议室")
     date = models.DateField(verbose_name="日期")
@@ -28,7 +44,8 @@ class Reservation(models.Model):
     title = models.CharField(max_length=255, verbose_name="会议主题")
     booker = models.CharField(max_length=100, verbose_name="预约人")
     department = models.CharField(max_length=100, blank=True, null=True, verbose_name="预约部门")
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    # 不使用 auto_now_add：恢复备份时需要写入原来的创建时间
+    created_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name="创建时间")
 
     def __str__(self):
         return f"{self.title} - {self.room.name} ({self.date})"
@@ -36,6 +53,12 @@ class Reservation(models.Model):
     class Meta:
         verbose_name = "预约记录"
         verbose_name_plural = "预约记录"
+        indexes = [
+            # 按会议室+日期查询当天预约（状态屏、冲突检查）
+            models.Index(fields=['room', 'date', 'start_time'], name='booking_res_room_date_idx'),
+            # 不限会议室的日期范围查询
+            models.Index(fields=['date', 'start_time'], name='booking_res_date_idx'),
+        ]
 
 class Settings(models.Model):
     """系统设置模型"""
@@ -48,3 +71,84 @@ class Settings(models.Model):
     class Meta:
         verbose_name = "系统设置"
         verbose_name_plural = "系统设置"
+
+class DataVersion(models.Model):
+    """数据版本模型：每次写入会议室/预约/设置时递增，用于条件请求和缓存校验"""
+    scope = models.CharField(max_length=50, unique=True, verbose_name="数据范围")
+    version = models.BigIntegerField(default=0, verbose_name="版本号")
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name="更新时间")
+
+    def __str__(self):
+        return f"{self.scope}: {self.version}"
+
+    class Meta:
+        verbose_name = "数据版本"
+        verbose_name_plural = "数据版本"
+
+class ChangeLog(models.Model):
+    """数据变更日志：按顺序记录会议室和预约的增删改，自增ID即增量同步游标"""
+    MODEL_CHOICES = [
+        ('room', '会议室'),
+        ('reservation', '预约'),
+    ]
+    ACTION_CHOICES = [
+        ('create', '新增'),
+        ('update', '修改'),
+        ('delete', '删除'),
+    ]
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES, verbose_name="数据类型")
+    object_id = models.BigIntegerField(verbose_name="对象ID")
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, verbose_name="操作")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="记录时间")
+
+    def __str__(self):
+        return f"#{self.id} {self.model}:{self.object_id} {self.action}"
+
+    class Meta:
+        verbose_name = "变更日志"
+        verbose_name_plural = "变更日志"
+
+class RoomOccupancy(models.Model):
+    """会议室每日占用位图：一天按15分钟划分为96个时段，每个时段占1位"""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, verbose_name="会议室")
+    date = models.DateField(verbose_name="日期")
+    slots = models.BinaryField(max_length=12, verbose_name="占用位图")
+
+    def __str__(self):
+        return f"{self.room_id} {self.date}"
+
+    class Meta:
+        verbose_name = "会议室占用位图"
+        verbose_name_plural = "会议室占用位图"
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'date'], name='booking_occupancy_room_date_uniq'),
+        ]
+
+class NotificationOutbox(models.Model):
+    """通知发件箱：与预约写入在同一事务中记录，事务提交后由后台worker发送"""
+    STATUS_CHOICES = [
+        ('pending', '待发送'),
+        ('sent', '已发送'),
+        ('dead', '发送失败'),
+    ]
+    action = models.CharField(max_length=10, verbose_name="操作")
+    reservation_id = models.BigIntegerField(null=True, blank=True, verbose_name="预约ID")
+    payload = models.JSONField(verbose_name="预约快照")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name="状态")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="已尝试次数")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="下次发送时间")
+    # 被某个worker领取后的租约到期时间，worker异常退出后到期可被重新领取
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name="领取到期时间")
+    last_error = models.TextField(blank=True, default='', verbose_name="最近错误")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="发送时间")
+
+    def __str__(self):
+        return f"#{self.id} {self.action} {self.status}"
+
+    class Meta:
+        verbose_name = "通知发件箱"
+        verbose_name_plural = "通知发件箱"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='booking_outbox_due_idx'),
+        ]
@@ -0,0 +1,290 @@
+"""
+企业微信群机器人通知
+通知内容使用写入时的预约快照，预约被删除或再次修改后仍能发送当时的内容；
+发送由 booking.outbox 在事务提交后异步完成，HTTP 请求经 booking.webhook 的共享连接池、限流和熔断器发出。
+同一批次的多条变更合并为一条汇总消息（send_wechat_digest）。
+"""
+import datetime
+import json
+import logging
+import requests
+from django.utils import timezone
+from .settings_cache import get_bool, get_str
+from .webhook import DeliveryDeferred, get_webhook_config, post_json
+
+logger = logging.getLogger(__name__)
+
+# 企业微信 markdown_v2 消息内容上限为4096字节
+MAX_CONTENT_BYTES = 4096
+# 汇总消息中最多列出的变更行数，超出部分只计数
+DIGEST_MAX_ROWS = 20
+
+ACTION_TITLES = {
+    '新增': '新增会议室预约通知',
+    '修改': '会议室预约修改通知',
+    '编辑': '会议室预约修改通知',
+    '删除': '会议室预约取消(删除）通知'
+}
+
+
+def reservation_snapshot(reservation):
+    """生成通知所需的预约快照（可直接存入JSON字段）"""
+    created_at = reservation.created_at or timezone.now()
+    return {
+        'id': reservation.id,
+        'room_id': reservation.room_id,
+        'room_name': reservation.room.name,
+        'date': reservation.date.isoformat(),
+        'start': reservation.start_time.strftime('%H:%M'),
+        'end': reservation.end_time.strftime('%H:%M'),
+        'title': reservation.title,
+        'booker': reservation.booker,
+        'department': reservation.department or '',
+        'created_at': created_at.isoformat(),
+    }
+
+
+def escape_markdown_v2(text):
+    """转义markdown_v2格式中的特殊字符"""
+    if not text:
+        return text
+    # 需要转义的字符：_ * [ ] ( ) ~ ` > # + - = | { } . !
+    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+    for char in special_chars:
+        text = text.replace(char, f'\\{char}')
+    return text
+
+
+def send_wechat_notification(reservation, action='新增'):
+    """
+    发送单条预约的企业微信群机器人通知（markdown_v2格式）
+
+    Args:
+        reservation: reservation_snapshot() 生成的预约快照
+        action: 新增 / 编辑 / 删除
+
+    Raises:
+        DeliveryDeferred: Webhook 熔断或限流中，未发出请求（由发件箱延后重试，不计入发送次数）
+    """
+    # 根据action确定标题
+    title = ACTION_TITLES.get(action, '会议室预约通知')
+
+    # 构建markdown_v2格式的通知消息（转义特殊字符）
+    room_name = escape_markdown_v2(reservation['room_name'])
+    title_escaped = escape_markdown_v2(reservation['title'])
+    booker_escaped = escape_markdown_v2(reservation['booker'])
+    department_escaped = escape_markdown_v2(reservation['department'] or '未填写')
+
+    # 预先定义需要转义的字符串
+    dash_separator = "\\-"
+    triple_dash = "\\-\\-\\-"
+    date_format = datetime.date.fromisoformat(reservation['date']).strftime('%Y年%m月%d日')
+    time_range = f"{reservation['start']} {dash_separator} {reservation['end']}"
+    # 转为本地时区再格式化，避免显示为UTC
+    created_local = timezone.localtime(datetime.datetime.fromisoformat(reservation['created_at']))
+    created_time = created_local.strftime('%Y-%m-%d %H:%M:%S').replace('-', '\\-')
+
+    markdown_content = f"""# 📅 {title}
+
+## 📋 会议详情
+
+| **项目** | **内容** |
+| :--- | :--- |
+| **会议室** | {room_name} |
+| **预约日期** | {date_format} |
+| **会议时间** | {time_range} |
+| **会议主题** | {title_escaped} |
+| **预约人** | {booker_escaped} |
+| **预约部门** | {department_escaped} |
+
+{triple_dash}
+
+> 📌 创建时间：{created_time}"""
+
+    return send_markdown(markdown_content, f"{action} {reservation['title']} - {reservation['booker']}")
+
+
+def build_digest_markdown(rows, max_rows=DIGEST_MAX_ROWS):
+    """
+    生成多条变更的汇总消息：一张变更表，超出 max_rows 或消息长度上限的行只计数
+
+    Args:
+        rows: [(action, snapshot), ...]，按发生顺序
+    """
+    counts = {}
+    for action, _ in rows:
+        counts[action] = counts.get(action, 0) + 1
+    summary = '，'.join(f"{action} {count} 条" for action, count in counts.items())
+    header = f"""# 📅 会议室预约变更汇总
+
+共 {len(rows)} 条变更：{summary}
+
+| **操作** | **会议室** | **日期** | **时间** | **会议主题** | **预约人** |
+| :--- | :--- | :--- | :--- | :--- | :--- |
+"""
+    lines = []
+    size = len(header.encode('utf-8'))
+    for action, reservation in rows[:max_rows]:
+        date_format = datetime.date.fromisoformat(reservation['date']).strftime('%m月%d日')
+        line = (
+            f"| {escape_markdown_v2(action)} | {escape_markdown_v2(reservation['room_name'])} | {date_format} "
+            f"| {reservation['start']} \\- {reservation['end']} | {escape_markdown_v2(reservation['title'])} "
+            f"| {escape_markdown_v2(reservation['booker'])} |\n"
+        )
+        # 为省略说明保留空间
+        size += len(line.encode('utf-8'))
+        if size > MAX_CONTENT_BYTES - 100:
+            break
+        lines.append(line)
+    content = header + ''.join(lines)
+    if len(lines) < len(rows):
+        content += f"\n\\.\\.\\. 另有 {len(rows) - len(lines)} 条变更未列出"
+    return content.rstrip('\n')
+
+
+def send_wechat_digest(rows):
+    """
+    把多条变更合并为一条企业微信通知发送，只有一条时使用单条通知格式
+
+    Args:
+        rows: [(action, snapshot), ...]
+
+    Raises:
+        DeliveryDeferred: Webhook 熔断或限流中，未发出请求
+    """
+    if len(rows) == 1:
+        action, reservation = rows[0]
+        return send_wechat_notification(reservation, action)
+    return send_markdown(build_digest_markdown(rows), f"变更汇总 {len(rows)} 条")
+
+
+def send_markdown(markdown_content, summary):
+    """
+    发送 markdown_v2 消息到配置的企业微信群机器人
+
+    Args:
+        markdown_content: 消息内容
+        summary: 用于日志的简短说明
+
+    Returns:
+        tuple: (是否成功, 说明)
+    """
+    debug_mode = False
+    try:
+        # 检查调试模式
+        debug_mode = get_bool('debug_mode')
+        
+        # 从设置中获取企业微信Webhook URL；不存在则使用settings.DEFAULT_WEBHOOK_URL
+        webhook_url = get_str('webhook_url')
+        if not webhook_url:
+            error_msg = "Webhook URL未配置"
+            logger.warning(f"企业微信通知失败: {error_msg}")
+            if debug_mode:
+                print(f"[DEBUG] 企业微信通知失败: {error_msg}")
+            return False, error_msg
+        
+        if debug_mode:
+            print(f"[DEBUG] 使用的Webhook URL: {webhook_url}")
+            print(f"[DEBUG] 通知内容: {summary}")
+        
+        # 发送请求到企业微信群机器人
+        payload = {
+            "msgtype": "markdown_v2",
+            "markdown_v2": {
+                "content": markdown_content
+            }
+        }
+        
+        if debug_mode:
+            print(f"[DEBUG] 请求payload: {json.dumps(payload, ensure_ascii=False, indent=2)}")
+            # 添加编码调试信息
+            print(f"[DEBUG] markdown_v2内容编码: {markdown_content.encode('utf-8')}")
+            print(f"[DEBUG] markdown_v2内容长度: {len(markdown_content.encode('utf-8'))} 字节")
+        
+        logger.info(f"正在发送企业微信通知到: {webhook_url[:50]}...")
+        
+        try:
+            # 明确指定UTF-8编码的Content-Type头，确保中文字符正确传输
+            headers = {
+                'Content-Type': 'application/json; charset=utf-8'
+            }
+            
+            # 手动序列化JSON以确保UTF-8编码
+            json_data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            
+            if debug_mode:
+                print(f"[DEBUG] 发送的JSON数据: {json_data}")
+                print(f"[DEBUG] 请求头: {headers}")
+            
+            # 共享连接池发送（不使用环境变量中的代理）
+            response = post_json(webhook_url, json_data, headers=headers)
+            
+            if debug_mode:
+                print(f"[DEBUG] HTTP响应状态码: {response.status_code}")
+                print(f"[DEBUG] HTTP响应头: {dict(response.headers)}")
+                print(f"[DEBUG] HTTP响应内容: {response.text}")
+            
+            logger.info(f"企业微信API响应状态码: {response.status_code}")
+            
+            if response.status_code == 200:
+                try:
+                    result = response.json()
+                    if debug_mode:
+                        print(f"[DEBUG] 解析后的响应JSON: {result}")
+                    
+                    if result.get('errcode') == 0:
+                        success_msg = f"企业微信通知发送成功: {summary}"
+                        logger.info(success_msg)
+                        if debug_mode:
+                            print(f"[DEBUG] {success_msg}")
+                        return True, "发送成功"
+                    else:
+                        errcode = result.get('errcode', 'unknown')
+                        errmsg = result.get('errmsg', '未知错误')
+                        error_msg = f"企业微信API错误 - errcode: {errcode}, errmsg: {errmsg}"
+                        logger.error(error_msg)
+                        if debug_mode:
+                            print(f"[DEBUG] {error_msg}")
+                        return False, f"API错误: {errcode} - {errmsg}"
+                except json.JSONDecodeError as e:
+                    error_msg = f"响应JSON解析失败: {str(e)}, 响应内容: {response.text}"
+                    logger.error(error_msg)
+                    if debug_mode:
+                        print(f"[DEBUG] {error_msg}")
+                    return False, f"响应解析失败: {response.text[:100]}"
+            else:
+                error_msg = f"HTTP请求失败 - 状态码: {response.status_code}, 响应: {response.text}"
+                logger.error(error_msg)
+                if debug_mode:
+                    print(f"[DEBUG] {error_msg}")
+                return False, f"HTTP错误: {response.status_code}"
+                
+        except requests.exceptions.Timeout:
+            error_msg = f"请求超时（{get_webhook_config()['READ_TIMEOUT']}秒）"
+            logger.error(f"企业微信通知发送超时: {error_msg}")
+            if debug_mode:
+                print(f"[DEBUG] {error_msg}")
+            return False, error_msg
+        except requests.exceptions.ConnectionError as e:
+            error_msg = f"网络连接错误: {str(e)}"
+            logger.error(f"企业微信通知网络错误: {error_msg}")
+            if debug_mode:
+                print(f"[DEBUG] {error_msg}")
+            return False, f"网络连接失败: {str(e)[:100]}"
+        except requests.exceptions.RequestException as e:
+            error_msg = f"请求异常: {str(e)}"
+            logger.error(f"企业微信通知请求异常: {error_msg}")
+            if debug_mode:
+                print(f"[DEBUG] {error_msg}")
+            return False, f"请求异常: {str(e)[:100]}"
+            
+    except DeliveryDeferred:
+        raise
+    except Exception as e:
+        error_msg = f"发送企业微信通知时出现未知错误: {str(e)}"
+        logger.error(error_msg)
+        if debug_mode:
+            print(f"[DEBUG] {error_msg}")
+            import traceback
+            print(f"[DEBUG] 完整错误堆栈: {traceback.format_exc()}")
+        return False, f"未知错误: {str(e)[:100]}"
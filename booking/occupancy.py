@@ -0,0 +1,204 @@
+"""
+会议室占用位图
+每个 (会议室, 日期) 用96位整数表示一天中每15分钟的占用情况，
+预约写入时在同一事务内重建对应位图，冲突检查和空闲时段计算只需位运算。
+
+预约时间不是15分钟整数倍时，位图按覆盖的时段保守置位，
+此时位图只用于快速排除，命中后再用区间查询确认。
+"""
+import datetime
+import logging
+from .models import Reservation, RoomOccupancy
+
+logger = logging.getLogger(__name__)
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+SLOT_BYTES = SLOTS_PER_DAY // 8
+FULL_DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+REBUILD_BATCH_SIZE = 400
+# 影响占用位图的预约字段
+SLOT_FIELDS = ('room', 'date', 'start_time', 'end_time')
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _seconds_ceil(value):
+    """秒数（不足一秒的部分向上取整）"""
+    return (value.hour * 60 + value.minute) * 60 + value.second + (1 if value.microsecond else 0)
+
+
+def is_slot_aligned(value):
+    """时间是否落在时段边界上"""
+    return value.minute % SLOT_MINUTES == 0 and value.second == 0 and value.microsecond == 0
+
+
+def time_range_mask(start_time, end_time):
+    """时间段覆盖的时段位掩码（第0位为00:00-00:15）"""
+    first = _minutes(start_time) // SLOT_MINUTES
+    # 结束时间不在边界上时向上取整，覆盖不完整的时段（含秒，如 09:15:30 覆盖 09:15-09:30）
+    last = -(-_seconds_ceil(end_time) // (SLOT_MINUTES * 60))
+    if end_time == datetime.time(0, 0) or last > SLOTS_PER_DAY:
+        last = SLOTS_PER_DAY
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def mask_to_bytes(mask):
+    return mask.to_bytes(SLOT_BYTES, 'little')
+
+
+def bytes_to_mask(value):
+    return int.from_bytes(bytes(value), 'little') if value else 0
+
+
+def rebuild_occupancy(pairs):
+    """
+    按预约表重建指定 (room_id, date) 的占用位图（在调用方事务内执行）
+
+    Args:
+        pairs: 可迭代的 (room_id, date)
+    """
+    pairs = sorted(set(pairs))
+    # 分批处理，避免 IN 子句参数过多
+    for i in range(0, len(pairs), REBUILD_BATCH_SIZE):
+        _rebuild_batch(set(pairs[i:i + REBUILD_BATCH_SIZE]))
+
+
+def _rebuild_batch(pairs):
+    room_ids = {room_id for room_id, _ in pairs}
+    dates = {date for _, date in pairs}
+
+    masks = dict.fromkeys(pairs, 0)
+    rows = Reservation.objects.filter(room_id__in=room_ids, date__in=dates).values_list(
+        'room_id', 'date', 'start_time', 'end_time'
+    )
+    for room_id, date, start_time, end_time in rows:
+        key = (room_id, date)
+        if key in masks:
+            masks[key] |= time_range_mask(start_time, end_time)
+
+    existing = {
+        (occ.room_id, occ.date): occ
+        for occ in RoomOccupancy.objects.filter(room_id__in=room_ids, date__in=dates)
+        if (occ.room_id, occ.date) in pairs
+    }
+    to_create = []
+    to_update = []
+    to_delete = []
+    for key, mask in masks.items():
+        occupancy = existing.get(key)
+        if mask == 0:
+            if occupancy:
+                to_delete.append(occupancy.id)
+        elif occupancy is None:
+            to_create.append(RoomOccupancy(room_id=key[0], date=key[1], slots=mask_to_bytes(mask)))
+        elif bytes_to_mask(occupancy.slots) != mask:
+            occupancy.slots = mask_to_bytes(mask)
+            to_update.append(occupancy)
+
+    if to_delete:
+        RoomOccupancy.objects.filter(id__in=to_delete).delete()
+    if to_create:
+        RoomOccupancy.objects.bulk_create(to_create)
+    if to_update:
+        RoomOccupancy.objects.bulk_update(to_update, ['slots'])
+
+
+def get_occupancy_masks(date, room_ids=None):
+    """读取某天的占用位图 {room_id: mask}，没有预约的会议室不在结果中"""
+    queryset = RoomOccupancy.objects.filter(date=date)
+    if room_ids is not None:
+        queryset = queryset.filter(room_id__in=room_ids)
+    return {room_id: bytes_to_mask(slots) for room_id, slots in queryset.values_list('room_id', 'slots')}
+
+
+def has_conflict(room_id, date, start_time, end_time, exclude_id=None):
+    """
+    检查时间段是否与已有预约冲突
+
+    位图无重叠时直接返回；有重叠但无法由位图确定（时间未对齐或需排除自身）时用区间查询确认。
+    """
+    occupied = get_occupancy_masks(date, [room_id]).get(room_id, 0)
+    if not occupied & time_range_mask(start_time, end_time):
+        return False
+    if exclude_id is None and is_slot_aligned(start_time) and is_slot_aligned(end_time):
+        return True
+    conflicts = Reservation.objects.filter(
+        room_id=room_id,
+        date=date,
+        start_time__lt=end_time,
+        end_time__gt=start_time
+    )
+    if exclude_id is not None:
+        conflicts = conflicts.exclude(id=exclude_id)
+    return conflicts.exists()
+
+
+def find_overlaps(rows, changed, pairs=None):
+    """
+    找出与其他预约时间重叠的新增/修改预约（排序扫描，不查询数据库）
+
+    Args:
+        rows: 写入后的全部预约（对象需有 room_id、date、start_time、end_time）
+        changed: 新增或修改的预约，只报告与这些预约有关的重叠
+        pairs: 只检查这些 (room_id, date)，为空时检查全部
+
+    Returns:
+        list: 发生重叠的新增/修改预约
+    """
+    changed_keys = {id(row) for row in changed}
+    groups = {}
+    for row in rows:
+        key = (row.room_id, row.date)
+        if pairs is None or key in pairs:
+            groups.setdefault(key, []).append(row)
+
+    overlaps = {}
+    for group in groups.values():
+        group.sort(key=lambda row: (row.start_time, row.end_time))
+        # 已扫描的预约中结束最晚的一条，以及其中新增/修改的预约中结束最晚的一条
+        latest = None
+        latest_changed = None
+        for row in group:
+            if id(row) in changed_keys:
+                if latest is not None and row.start_time < latest.end_time:
+                    overlaps[id(row)] = row
+                if latest_changed is None or row.end_time > latest_changed.end_time:
+                    latest_changed = row
+            elif latest_changed is not None and row.start_time < latest_changed.end_time:
+                overlaps[id(latest_changed)] = latest_changed
+            if latest is None or row.end_time > latest.end_time:
+                latest = row
+    return list(overlaps.values())
+
+
+def free_ranges(mask, day_start=datetime.time(0, 0), day_end=None, min_minutes=SLOT_MINUTES):
+    """
+    从位图中找出空闲时间段
+
+    Returns:
+        list: [(start_time, end_time), ...]
+    """
+    first = -(-_minutes(day_start) // SLOT_MINUTES)
+    last = SLOTS_PER_DAY if day_end is None or day_end == datetime.time(0, 0) else _minutes(day_end) // SLOT_MINUTES
+    min_slots = max(1, -(-min_minutes // SLOT_MINUTES))
+
+    def to_time(slot):
+        minutes = slot * SLOT_MINUTES
+        return datetime.time(0, 0) if minutes >= 24 * 60 else datetime.time(minutes // 60, minutes % 60)
+
+    ranges = []
+    run_start = None
+    for slot in range(first, last + 1):
+        busy = slot == last or bool(mask >> slot & 1)
+        if not busy and run_start is None:
+            run_start = slot
+        elif busy and run_start is not None:
+            if slot - run_start >= min_slots:
+                ranges.append((to_time(run_start), to_time(slot)))
+            run_start = None
+    return ranges
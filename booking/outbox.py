@@ -0,0 +1,281 @@
+"""
+通知发件箱
+预约写入时在同一事务内把通知写入 NotificationOutbox，请求不再等待企业微信接口；
+事务提交后唤醒本进程的后台发送线程，由线程池并发发送。
+Web进程启动时（wsgi.py / asgi.py）即启动发送线程，发送重启前遗留的通知。
+
+发送失败按指数退避重试，超过最大次数后标记为发送失败（死信），
+可通过 `python manage.py process_outbox --replay-dead` 重新投递。
+Webhook 熔断或限流期间领取到的通知不发送，延后再试，不计入发送次数。
+
+一次领取的通知合并为一条汇总消息：同一次保存产生的多条变更、以及唤醒后 COALESCE_WINDOW
+秒内的其他变更只发送一条消息，消息数量与保存次数而不是变更行数成正比。
+多个进程（gunicorn worker、process_outbox 命令）可同时发送：每条通知先用带条件的
+UPDATE 领取租约，只有领取成功的进程发送，进程异常退出后租约到期可被重新领取。
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from .models import NotificationOutbox
+from .notifications import reservation_snapshot, send_wechat_digest
+from .webhook import DeliveryDeferred
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_DEAD = 'dead'
+
+
+def get_outbox_config():
+    """读取 settings.NOTIFICATION_OUTBOX 配置"""
+    config = {
+        'IN_PROCESS': True,  # 是否在Web进程内启动后台发送线程
+        'WORKERS': 4,  # 发送线程数
+        'BATCH_SIZE': 50,  # 每条消息最多合并的通知数
+        'COALESCE_WINDOW': 3,  # 被唤醒后等待多久再发送，合并这段时间内的其他变更（秒）
+        'POLL_INTERVAL': 30,  # 没有新通知时检查到期重试的间隔（秒）
+        'LEASE_SECONDS': 60,  # 领取后未完成发送时多久可被重新领取（秒）
+        'MAX_ATTEMPTS': 6,  # 最多发送次数，超过后进入死信
+        'BACKOFF_BASE': 30,  # 第一次重试的等待时间（秒），之后每次翻倍
+        'BACKOFF_MAX': 3600,  # 重试等待上限（秒）
+    }
+    config.update(getattr(settings, 'NOTIFICATION_OUTBOX', {}))
+    return config
+
+
+def enqueue_notifications(items):
+    """
+    在当前事务中写入通知，提交后唤醒后台发送线程
+
+    Args:
+        items: 可迭代的 (reservation, action)，action 为 新增 / 编辑 / 删除
+    """
+    entries = [
+        NotificationOutbox(action=action, reservation_id=reservation.id, payload=reservation_snapshot(reservation))
+        for reservation, action in items
+    ]
+    if not entries:
+        return
+    NotificationOutbox.objects.bulk_create(entries)
+    transaction.on_commit(wake_dispatcher)
+
+
+def retry_delay(attempts, config=None):
+    """第 attempts 次发送失败后的等待时间（秒），带随机抖动"""
+    config = config or get_outbox_config()
+    delay = min(config['BACKOFF_MAX'], config['BACKOFF_BASE'] * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_due(limit, now=None):
+    """领取到期的待发送通知（按创建顺序），返回领取成功的记录"""
+    config = get_outbox_config()
+    now = now or timezone.now()
+    lease = now + timedelta(seconds=config['LEASE_SECONDS'])
+    available = Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    candidates = list(
+        NotificationOutbox.objects.filter(available, status=STATUS_PENDING, next_attempt_at__lte=now)
+        .order_by('id').values_list('id', flat=True)[:limit]
+    )
+    claimed = [
+        entry_id for entry_id in candidates
+        if NotificationOutbox.objects.filter(available, id=entry_id, status=STATUS_PENDING).update(locked_until=lease)
+    ]
+    return list(NotificationOutbox.objects.filter(id__in=claimed).order_by('id'))
+
+
+def coalesce_events(entries):
+    """
+    合并同一批通知中同一预约的多次变更（按发生顺序）
+
+    新增后编辑仍为新增（使用最新内容），编辑后编辑只保留最新内容，编辑后删除为删除，
+    新增后删除相互抵消。删除之后的变更（预约ID被复用）作为新的一行。
+
+    Returns:
+        list: [(action, snapshot), ...]
+    """
+    rows = []
+    open_rows = {}  # reservation_id -> rows 中尚可合并的行
+    for entry in entries:
+        index = open_rows.pop(entry.reservation_id, None)
+        if index is None or rows[index] is None or entry.action == '新增':
+            if entry.action != '删除':
+                open_rows[entry.reservation_id] = len(rows)
+            rows.append((entry.action, entry.payload))
+        elif entry.action == '删除':
+            rows[index] = None if rows[index][0] == '新增' else (entry.action, entry.payload)
+        else:
+            rows[index] = (rows[index][0], entry.payload)
+            open_rows[entry.reservation_id] = index
+    return [row for row in rows if row is not None]
+
+
+def deliver(entries):
+    """
+    把一组已领取的通知合并为一条消息发送并记录结果，返回是否发送成功
+
+    Webhook 熔断或限流时不发送，通知延后到可以发送时再领取，不计入发送次数。
+    """
+    config = get_outbox_config()
+    rows = coalesce_events(entries)
+    fields = ['status', 'attempts', 'locked_until', 'sent_at', 'next_attempt_at', 'last_error']
+    try:
+        success, error_msg = send_wechat_digest(rows) if rows else (True, '')
+    except DeliveryDeferred as e:
+        retry_at = timezone.now() + timedelta(seconds=max(e.retry_after, 1))
+        for entry in entries:
+            entry.locked_until = None
+            entry.next_attempt_at = retry_at
+            entry.last_error = str(e)
+        NotificationOutbox.objects.bulk_update(entries, fields)
+        return False
+    except Exception as e:
+        success, error_msg = False, f"未知错误: {str(e)}"
+
+    now = timezone.now()
+    ids = ', '.join(f"#{entry.id}" for entry in entries)
+    for entry in entries:
+        entry.attempts += 1
+        entry.locked_until = None
+        if success:
+            entry.status = STATUS_SENT
+            entry.sent_at = now
+            entry.last_error = ''
+        elif entry.attempts >= config['MAX_ATTEMPTS']:
+            entry.status = STATUS_DEAD
+            entry.last_error = error_msg
+        else:
+            entry.next_attempt_at = now + timedelta(seconds=retry_delay(entry.attempts, config))
+            entry.last_error = error_msg
+    NotificationOutbox.objects.bulk_update(entries, fields)
+    if not success:
+        dead = [f"#{entry.id}" for entry in entries if entry.status == STATUS_DEAD]
+        logger.warning(f"通知{ids}发送失败（{len(rows)}条变更）: {error_msg}")
+        if dead:
+            logger.error(f"通知{', '.join(dead)}多次发送失败，已转入死信")
+    return success
+
+
+def _deliver_in_thread(entries):
+    close_old_connections()
+    try:
+        return deliver(entries)
+    finally:
+        close_old_connections()
+
+
+def _drain(executor, workers, config, limit=None):
+    """领取并发送到期通知直到队列为空，每 BATCH_SIZE 条合并为一条消息"""
+    result = {'sent': 0, 'failed': 0}
+    while limit is None or result['sent'] + result['failed'] < limit:
+        claim_size = config['BATCH_SIZE'] * workers
+        if limit is not None:
+            claim_size = min(claim_size, limit - result['sent'] - result['failed'])
+        entries = claim_due(claim_size)
+        if not entries:
+            break
+        groups = [entries[i:i + config['BATCH_SIZE']] for i in range(0, len(entries), config['BATCH_SIZE'])]
+        outcomes = executor.map(_deliver_in_thread, groups) if executor else map(deliver, groups)
+        for group, success in zip(groups, outcomes):
+            result['sent' if success else 'failed'] += len(group)
+    return result
+
+
+def process_outbox(workers=1, limit=None):
+    """
+    发送所有到期的通知直到队列为空（供管理命令使用）
+
+    Returns:
+        dict: {'sent': 成功数, 'failed': 失败数}（按通知条数计）
+    """
+    config = get_outbox_config()
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        return _drain(executor, workers, config, limit)
+    finally:
+        if executor:
+            executor.shutdown(wait=True)
+
+
+def replay_dead(ids=None):
+    """把死信重新放回待发送队列，返回数量"""
+    queryset = NotificationOutbox.objects.filter(status=STATUS_DEAD)
+    if ids:
+        queryset = queryset.filter(id__in=ids)
+    count = queryset.update(status=STATUS_PENDING, attempts=0, next_attempt_at=timezone.now(), locked_until=None)
+    if count:
+        transaction.on_commit(wake_dispatcher)
+    return count
+
+
+def purge_sent(before):
+    """删除早于 before 已发送的通知，返回数量"""
+    deleted, _ = NotificationOutbox.objects.filter(status=STATUS_SENT, sent_at__lt=before).delete()
+    return deleted
+
+
+def get_outbox_stats():
+    """各状态的通知数量"""
+    counts = dict(NotificationOutbox.objects.values_list('status').annotate(count=Count('id')))
+    return {status: counts.get(status, 0) for status in (STATUS_PENDING, STATUS_SENT, STATUS_DEAD)}
+
+
+class OutboxDispatcher:
+    """本进程的后台发送线程：被唤醒（等待合并窗口后）或定时检查到期通知，交给线程池发送"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='notification-outbox', daemon=True)
+                self.thread.start()
+
+    def wake(self):
+        self.start()
+        self.event.set()
+
+    def _run(self):
+        config = get_outbox_config()
+        executor = ThreadPoolExecutor(max_workers=config['WORKERS'], thread_name_prefix='notification-worker')
+        while True:
+            if self.event.wait(config['POLL_INTERVAL']):
+                # 等待合并窗口，期间的其他唤醒一并处理
+                time.sleep(config['COALESCE_WINDOW'])
+            self.event.clear()
+            close_old_connections()
+            try:
+                _drain(executor, config['WORKERS'], config)
+            except Exception as e:
+                logger.error(f"通知发送线程出错: {str(e)}")
+            finally:
+                close_old_connections()
+
+
+_dispatcher = OutboxDispatcher()
+
+
+def wake_dispatcher():
+    """唤醒后台发送线程（未启用进程内发送时由 process_outbox 命令负责发送）"""
+    if get_outbox_config()['IN_PROCESS']:
+        _dispatcher.wake()
+
+
+def start_outbox_dispatcher():
+    """
+    Web进程启动时启动后台发送线程并立即检查一次（IN_PROCESS 时）
+
+    重启前遗留的待发送和待重试通知不必等到本进程下一次写入才发送。
+    """
+    wake_dispatcher()
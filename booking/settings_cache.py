@@ -0,0 +1,123 @@
+"""
+系统设置缓存
+进程内缓存 Settings 表的全部键值，读取设置只是字典查找。
+
+本进程写入设置时（save_settings、setup_webhook、后台管理、恢复备份）由信号立即清空缓存；
+其他进程的写入通过设置数据版本（DataVersion，写入时由信号递增）发现：
+距上次检查超过 CHECK_INTERVAL 秒时读取一次版本号，版本变化才重新加载整张表。
+"""
+import logging
+import threading
+import time
+from django.conf import settings
+from .models import Settings
+from .versioning import SCOPE_SETTINGS, get_data_versions
+
+logger = logging.getLogger(__name__)
+
+# 已知设置项的默认值，可调用对象在读取时求值（以便使用 django.conf.settings 中的配置）
+SETTING_DEFAULTS = {
+    'webhook_url': lambda: getattr(settings, 'DEFAULT_WEBHOOK_URL', ''),
+    'debug_mode': False,
+}
+
+TRUE_VALUES = ('true', '1', 'yes', 'on')
+FALSE_VALUES = ('false', '0', 'no', 'off')
+
+
+def get_settings_cache_config():
+    """读取 settings.SETTINGS_CACHE 配置"""
+    config = {
+        'CHECK_INTERVAL': 2,  # 检查其他进程写入的间隔（秒），0 表示每次读取都检查
+    }
+    config.update(getattr(settings, 'SETTINGS_CACHE', {}))
+    return config
+
+
+class SettingsCache:
+    """进程内的设置缓存（线程安全）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = None
+        self.version = None
+        self.checked_at = 0.0
+
+    def get_values(self):
+        """返回当前的设置字典（调用方不得修改）"""
+        values = self.values
+        if values is not None and time.monotonic() - self.checked_at < get_settings_cache_config()['CHECK_INTERVAL']:
+            return values
+        with self.lock:
+            version = get_data_versions(SCOPE_SETTINGS)[SCOPE_SETTINGS][0]
+            if self.values is None or version != self.version:
+                self.values = dict(Settings.objects.values_list('key', 'value'))
+                self.version = version
+                logger.debug(f"重新加载系统设置（版本 {version}）")
+            self.checked_at = time.monotonic()
+            return self.values
+
+    def invalidate(self):
+        with self.lock:
+            self.values = None
+            self.version = None
+
+
+_cache = SettingsCache()
+
+
+def invalidate_settings_cache():
+    """清空本进程的设置缓存（写入设置后调用）"""
+    _cache.invalidate()
+
+
+def get_all_settings():
+    """数据库中保存的全部设置 {key: value}（不含默认值）"""
+    return dict(_cache.get_values())
+
+
+def _default(key, default):
+    if default is None:
+        default = SETTING_DEFAULTS.get(key)
+    return default() if callable(default) else default
+
+
+def get_setting(key, default=None):
+    """
+    读取设置的原始值
+
+    未保存或保存为空字符串时返回 default，未指定 default 时使用 SETTING_DEFAULTS 中的默认值。
+    """
+    value = _cache.get_values().get(key)
+    if value is None or value.strip() == '':
+        return _default(key, default)
+    return value
+
+
+def get_str(key, default=None):
+    """读取字符串设置（去掉首尾空白）"""
+    value = get_setting(key, default)
+    return '' if value is None else str(value).strip()
+
+
+def get_bool(key, default=None):
+    """读取布尔设置（true/1/yes/on 为真，false/0/no/off 为假，其他值使用默认值）"""
+    value = get_setting(key, default)
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    return bool(_default(key, default))
+
+
+def get_int(key, default=None):
+    """读取整数设置，无法解析时使用默认值"""
+    value = get_setting(key, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logger.warning(f"设置 {key} 的值不是整数: {value}")
+        return _default(key, default)
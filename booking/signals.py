@@ -0,0 +1,70 @@
+"""
+模型信号处理
+管理后台等直接通过ORM保存的数据变更也会递增数据版本、写入变更日志并更新占用位图
+"""
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from .models import Room, Reservation, Settings
+from .versioning import bump_data_version, SCOPE_ROOMS, SCOPE_RESERVATIONS, SCOPE_SETTINGS
+from .occupancy import rebuild_occupancy, SLOT_FIELDS
+from .settings_cache import invalidate_settings_cache
+from .changes import (
+    record_changes, MODEL_ROOM, MODEL_RESERVATION,
+    ACTION_CREATE, ACTION_UPDATE, ACTION_DELETE,
+)
+
+
+@receiver(post_save, sender=Room)
+def room_saved(sender, instance, created, **kwargs):
+    """会议室新增或修改"""
+    bump_data_version(SCOPE_ROOMS)
+    record_changes(MODEL_ROOM, ACTION_CREATE if created else ACTION_UPDATE, [instance.pk])
+
+
+@receiver(post_delete, sender=Room)
+def room_deleted(sender, instance, **kwargs):
+    """会议室删除"""
+    bump_data_version(SCOPE_ROOMS)
+    record_changes(MODEL_ROOM, ACTION_DELETE, [instance.pk])
+
+
+@receiver(post_init, sender=Reservation)
+def remember_reservation_slot(sender, instance, **kwargs):
+    """记录加载时的会议室和日期，修改后需要同时重建原位图"""
+    # 直接读 __dict__，避免延迟加载字段触发查询
+    instance._original_slot = (instance.__dict__.get('room_id'), instance.__dict__.get('date'))
+
+
+@receiver(post_save, sender=Reservation)
+def reservation_saved(sender, instance, created, **kwargs):
+    """预约新增或修改"""
+    bump_data_version(SCOPE_RESERVATIONS)
+    record_changes(MODEL_RESERVATION, ACTION_CREATE if created else ACTION_UPDATE, [instance.pk])
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not set(update_fields) & {'room', 'room_id', *SLOT_FIELDS}:
+        # 只更新了与时段无关的字段
+        return
+    pairs = {(instance.room_id, instance.date)}
+    original = getattr(instance, '_original_slot', (None, None))
+    if None not in original:
+        pairs.add(original)
+    rebuild_occupancy(pairs)
+    instance._original_slot = (instance.room_id, instance.date)
+
+
+@receiver(post_delete, sender=Reservation)
+def reservation_deleted(sender, instance, **kwargs):
+    """预约删除"""
+    bump_data_version(SCOPE_RESERVATIONS)
+    record_changes(MODEL_RESERVATION, ACTION_DELETE, [instance.pk])
+    rebuild_occupancy({(instance.room_id, instance.date)})
+
+
+@receiver([post_save, post_delete], sender=Settings)
+def settings_changed(sender, **kwargs):
+    """设置变更"""
+    bump_data_version(SCOPE_SETTINGS)
+    # 本事务内的读取立即看到新值，提交后再清空一次，丢弃其他线程在提交前加载的旧值
+    invalidate_settings_cache()
+    transaction.on_commit(invalidate_settings_cache)
@@ -1,6 +1,21 @@
-﻿from django.test import TestCase
+﻿from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
 from .models import Room, Reservation
 import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def read_json(response):
+    """读取普通或流式响应中的JSON"""
+    if response.streaming:
+        return json.loads(b''.join(response.streaming_content))
+    return response.json()
 
 class RoomModelTest(TestCase):
     def setUp(self):
@@ -30,3 +45,1423 @@ class ReservationModelTest(TestCase):
         reservation = Reservation.objects.get(title="测试会议")
         self.assertEqual(reservation.booker, "测试预约人")
         self.assertEqual(reservation.room.name, "测试会议室")
+
+class LoadReservationsFilterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room_a = Room.objects.create(name="会议室A", capacity=10)
+        self.room_b = Room.objects.create(name="会议室B", capacity=20)
+        self.day = datetime.date(2025, 3, 10)
+        for offset in range(3):
+            for room in (self.room_a, self.room_b):
+                Reservation.objects.create(
+                    room=room,
+                    date=self.day + datetime.timedelta(days=offset),
+                    start_time=datetime.time(9, 0),
+                    end_time=datetime.time(10, 0),
+                    title=f"会议{offset}",
+                    booker="张三"
+                )
+
+    def test_without_params_returns_all(self):
+        response = self.client.get('/api/load_reservations/')
+        self.assertEqual(len(read_json(response)), 6)
+
+    def test_date_and_room_filter(self):
+        response = self.client.get('/api/load_reservations/', {
+            'date_from': '2025-03-11', 'date_to': '2025-03-11', 'room': str(self.room_b.id)
+        })
+        data = read_json(response)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['date'], '2025-03-11')
+        self.assertEqual(data[0]['room'], str(self.room_b.id))
+
+    def test_cursor_pagination_walks_all_rows(self):
+        seen = []
+        params = {'limit': 4}
+        while True:
+            response = self.client.get('/api/load_reservations/', params)
+            seen.extend(r['id'] for r in read_json(response))
+            cursor = response.get('X-Next-Cursor')
+            if not cursor:
+                break
+            params = {'limit': 4, 'cursor': cursor}
+        self.assertEqual(sorted(seen), sorted(Reservation.objects.values_list('id', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_cached_page_keeps_next_cursor(self):
+        first = self.client.get('/api/load_reservations/', {'limit': 2})
+        first_ids = [r['id'] for r in read_json(first)]
+        second = self.client.get('/api/load_reservations/', {'limit': 2})
+        self.assertEqual([r['id'] for r in read_json(second)], first_ids)
+        self.assertIsNotNone(first.get('X-Next-Cursor'))
+        self.assertEqual(second.get('X-Next-Cursor'), first.get('X-Next-Cursor'))
+
+    def test_invalid_params_rejected(self):
+        self.assertEqual(self.client.get('/api/load_reservations/', {'date_from': '2025/03/10'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/load_reservations/', {'cursor': 'bogus'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/load_reservations/', {'limit': '0'}).status_code, 400)
+
+    def test_constant_query_count(self):
+        for i in range(20):
+            Reservation.objects.create(
+                room=self.room_a,
+                date=self.day + datetime.timedelta(days=10 + i),
+                start_time=datetime.time(9, 0),
+                end_time=datetime.time(10, 0),
+                title="批量会议",
+                booker="李四"
+            )
+        # 1次数据版本查询 + 1次预约JOIN查询
+        with self.assertNumQueries(2):
+            data = read_json(self.client.get('/api/load_reservations/'))
+        self.assertEqual(len(data), 26)
+        self.assertEqual(data[0]['room_name'], "会议室A")
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+
+    def test_not_modified_until_write(self):
+        first = self.client.get('/api/load_rooms/')
+        etag = first['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/load_rooms/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+
+        self.client.post('/api/save_rooms/', json.dumps([
+            {'id': str(self.room.id), 'name': "会议室A", 'capacity': 12}
+        ]), content_type='application/json')
+        third = self.client.get('/api/load_rooms/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third['ETag'], etag)
+
+    def test_reservation_etag_depends_on_filters_and_rooms(self):
+        plain = self.client.get('/api/load_reservations/')['ETag']
+        filtered = self.client.get('/api/load_reservations/', {'date_from': '2025-01-01'})['ETag']
+        self.assertNotEqual(plain, filtered)
+
+        # 会议室改名会影响预约列表中的 room_name
+        self.room.name = "会议室B"
+        self.room.save()
+        self.assertNotEqual(self.client.get('/api/load_reservations/')['ETag'], plain)
+
+    def test_settings_etag(self):
+        etag = self.client.get('/api/load_settings/')['ETag']
+        self.client.post('/api/save_settings/', json.dumps({'debug_mode': 'false'}), content_type='application/json')
+        response = self.client.get('/api/load_settings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+        Reservation.objects.create(
+            room=self.room,
+            date=datetime.date(2025, 3, 10),
+            start_time=datetime.time(9, 0),
+            end_time=datetime.time(10, 0),
+            title="周会",
+            booker="张三"
+        )
+
+    def test_second_read_served_from_cache(self):
+        first = read_json(self.client.get('/api/load_reservations/'))
+        # 命中缓存时只查询数据版本表
+        with self.assertNumQueries(1):
+            second = read_json(self.client.get('/api/load_reservations/'))
+        self.assertEqual(first, second)
+        stats = self.client.get('/api/cache_stats/').json()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_write_invalidates_cached_payload(self):
+        read_json(self.client.get('/api/load_rooms/'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/save_rooms/', json.dumps([
+                {'id': str(self.room.id), 'name': "大会议室", 'capacity': 30}
+            ]), content_type='application/json')
+        rooms = read_json(self.client.get('/api/load_rooms/'))
+        self.assertEqual(rooms[0]['name'], "大会议室")
+        self.assertGreaterEqual(self.client.get('/api/cache_stats/').json()['invalidations'], 1)
+
+
+class ChangeJournalTest(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+
+    def create_reservation(self, title):
+        return Reservation.objects.create(
+            room=self.room,
+            date=datetime.date(2025, 3, 10),
+            start_time=datetime.time(9, 0),
+            end_time=datetime.time(10, 0),
+            title=title,
+            booker="张三"
+        )
+
+    def test_changes_since_cursor(self):
+        cursor = self.client.get('/api/changes/').json()['cursor']
+        kept = self.create_reservation("周会")
+        removed = self.create_reservation("临时会议")
+        removed_id = removed.id
+        removed.delete()
+
+        data = self.client.get('/api/changes/', {'since': cursor}).json()
+        self.assertFalse(data['reset'])
+        self.assertEqual([r['id'] for r in data['reservations']], [kept.id])
+        self.assertEqual(data['deleted']['reservations'], [removed_id])
+
+        # 游标之后没有新变更
+        empty = self.client.get('/api/changes/', {'since': data['cursor']}).json()
+        self.assertEqual(empty['reservations'], [])
+        self.assertEqual(empty['cursor'], data['cursor'])
+
+    def test_compaction_forces_reset(self):
+        from django.core.management import call_command
+        from io import StringIO
+        self.create_reservation("周会")
+        call_command('compact_changes', keep_days=-1, stdout=StringIO())
+        data = self.client.get('/api/changes/', {'since': 0}).json()
+        self.assertTrue(data['reset'])
+        self.assertFalse(self.client.get('/api/changes/', {'since': data['cursor']}).json()['reset'])
+
+
+class EventStreamTest(TestCase):
+    def setUp(self):
+        self.room_a = Room.objects.create(name="会议室A", capacity=10)
+        self.room_b = Room.objects.create(name="会议室B", capacity=20)
+
+    def collect_events(self, room_ids, last_event_id, count):
+        from asgiref.sync import async_to_sync
+        from .events import event_generator
+
+        async def collect():
+            messages = []
+            stream = event_generator(room_ids, last_event_id)
+            try:
+                async for message in stream:
+                    messages.append(message)
+                    if len(messages) >= count:
+                        break
+            finally:
+                await stream.aclose()
+            return messages
+        return async_to_sync(collect)()
+
+    def test_replays_changes_after_last_event_id(self):
+        cursor = self.client.get('/api/changes/').json()['cursor']
+        for room in (self.room_a, self.room_b):
+            Reservation.objects.create(
+                room=room,
+                date=datetime.date(2025, 3, 10),
+                start_time=datetime.time(9, 0),
+                end_time=datetime.time(10, 0),
+                title=f"{room.name}周会",
+                booker="张三"
+            )
+        messages = self.collect_events({str(self.room_b.id)}, cursor, 2)
+        self.assertTrue(messages[0].startswith(': connected\nretry: '))
+        self.assertIn('event: changes', messages[1])
+        payload = json.loads(messages[1].split('data: ', 1)[1])
+        self.assertEqual([r['title'] for r in payload['reservations']], ["会议室B周会"])
+
+    def test_wsgi_request_rejected(self):
+        self.assertEqual(self.client.get('/api/events/').status_code, 503)
+
+
+class RoomStatusTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+        self.free_room = Room.objects.create(name="会议室B", capacity=6)
+        self.today = datetime.date(2025, 3, 10)
+        for start, end, title in [((9, 0), (10, 0), "晨会"), ((10, 0), (11, 0), "评审"), ((14, 0), (15, 0), "复盘")]:
+            Reservation.objects.create(
+                room=self.room,
+                date=self.today,
+                start_time=datetime.time(*start),
+                end_time=datetime.time(*end),
+                title=title,
+                booker="张三"
+            )
+
+    def test_summary_now_next_and_boundary(self):
+        from .api import summarize_room_status
+        rooms = Room.objects.order_by('id').values('id', 'name', 'capacity', 'status')
+        reservations = Reservation.objects.filter(date=self.today).order_by('room_id', 'start_time').values(
+            'id', 'room_id', 'start_time', 'end_time', 'title', 'booker', 'department'
+        )
+        summaries, boundary = summarize_room_status(rooms, reservations, datetime.time(9, 30))
+        busy, free = summaries
+        self.assertEqual(busy['current']['title'], "晨会")
+        self.assertEqual(busy['next']['title'], "评审")
+        # 背靠背的会议连续占用到11:00
+        self.assertEqual(busy['busy_until'], "11:00")
+        self.assertIsNone(free['current'])
+        self.assertIsNone(free['free_until'])
+        self.assertEqual(boundary, datetime.time(10, 0))
+
+        summaries, boundary = summarize_room_status(rooms, reservations, datetime.time(12, 0))
+        self.assertEqual(summaries[0]['free_until'], "14:00")
+        self.assertEqual(boundary, datetime.time(14, 0))
+
+    def test_endpoint_cached_and_conditional(self):
+        first = self.client.get('/api/room_status/')
+        self.assertEqual(len(first.json()['rooms']), 2)
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/room_status/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+    def test_endpoint_reports_next_boundary(self):
+        # 状态显示屏按 valid_until 安排下一次刷新，包含秒避免在边界前反复请求
+        from unittest import mock
+        from django.utils import timezone
+        now = timezone.make_aware(datetime.datetime.combine(self.today, datetime.time(9, 30)))
+        with mock.patch('booking.api.timezone.localtime', return_value=now):
+            self.assertEqual(self.client.get('/api/room_status/').json()['valid_until'], '10:00:00')
+
+
+class AvailabilityTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.small = Room.objects.create(name="小会议室", capacity=4, equipment="白板")
+        self.medium = Room.objects.create(name="中会议室", capacity=8, equipment="投影仪,白板")
+        self.large = Room.objects.create(name="大会议室", capacity=20, equipment="投影仪,视频会议")
+        Room.objects.create(name="维修中会议室", capacity=10, equipment="投影仪", status='maintenance')
+        Reservation.objects.create(
+            room=self.medium,
+            date=datetime.date(2025, 3, 10),
+            start_time=datetime.time(9, 0),
+            end_time=datetime.time(10, 0),
+            title="晨会",
+            booker="张三"
+        )
+
+    def search(self, **params):
+        params.setdefault('date', '2025-03-10')
+        return read_json(self.client.get('/api/availability/', params))
+
+    def test_excludes_busy_and_ranks_by_fit(self):
+        data = self.search(start='09:30', end='10:30', min_capacity=5)
+        self.assertEqual([r['name'] for r in data['rooms']], ["大会议室"])
+
+        data = self.search(start='10:00', end='11:00', min_capacity=5)
+        self.assertEqual([r['name'] for r in data['rooms']], ["中会议室", "大会议室"])
+        self.assertEqual(data['rooms'][0]['spare_seats'], 3)
+
+    def test_equipment_filter(self):
+        data = self.search(start='10:00', end='11:00', equipment='投影仪,白板')
+        self.assertEqual([r['name'] for r in data['rooms']], ["中会议室"])
+
+    def test_invalid_window(self):
+        response = self.client.get('/api/availability/', {'date': '2025-03-10', 'start': '11:00', 'end': '10:00'})
+        self.assertEqual(response.status_code, 400)
+
+
+class OccupancyBitmapTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+        self.day = datetime.date(2025, 3, 10)
+
+    def book(self, start, end, **kwargs):
+        return Reservation.objects.create(
+            room=kwargs.get('room', self.room),
+            date=kwargs.get('date', self.day),
+            start_time=datetime.time(*start),
+            end_time=datetime.time(*end),
+            title="会议",
+            booker="张三"
+        )
+
+    def test_bitmap_follows_writes(self):
+        from .occupancy import get_occupancy_masks, time_range_mask, has_conflict
+        reservation = self.book((9, 0), (10, 0))
+        self.assertEqual(get_occupancy_masks(self.day)[self.room.id], time_range_mask(datetime.time(9, 0), datetime.time(10, 0)))
+        self.assertTrue(has_conflict(self.room.id, self.day, datetime.time(9, 30), datetime.time(11, 0)))
+        self.assertFalse(has_conflict(self.room.id, self.day, datetime.time(10, 0), datetime.time(11, 0)))
+        self.assertFalse(has_conflict(self.room.id, self.day, datetime.time(9, 0), datetime.time(10, 0), exclude_id=reservation.id))
+
+        # 改到另一天后原日期的位图被清除
+        reservation.date = self.day + datetime.timedelta(days=1)
+        reservation.save()
+        self.assertNotIn(self.room.id, get_occupancy_masks(self.day))
+        reservation.delete()
+        self.assertEqual(get_occupancy_masks(reservation.date), {})
+
+    def test_unaligned_times_confirmed_by_query(self):
+        from .occupancy import has_conflict
+        self.book((9, 0), (9, 10))
+        self.assertFalse(has_conflict(self.room.id, self.day, datetime.time(9, 10), datetime.time(9, 20)))
+        self.assertTrue(has_conflict(self.room.id, self.day, datetime.time(9, 5), datetime.time(9, 20)))
+
+    def test_end_time_seconds_round_up(self):
+        from .occupancy import has_conflict
+        self.book((9, 0), (9, 15, 30))
+        self.assertTrue(has_conflict(self.room.id, self.day, datetime.time(9, 15), datetime.time(9, 30)))
+        self.assertFalse(has_conflict(self.room.id, self.day, datetime.time(9, 30), datetime.time(10, 0)))
+
+    def test_free_slots_endpoint(self):
+        self.book((9, 0), (10, 0))
+        self.book((13, 0), (14, 30))
+        data = read_json(self.client.get('/api/free_slots/', {'date': '2025-03-10', 'room': str(self.room.id)}))
+        self.assertEqual(data['rooms'][0]['free'], [
+            {'start': '08:00', 'end': '09:00'},
+            {'start': '10:00', 'end': '13:00'},
+            {'start': '14:30', 'end': '18:00'},
+        ])
+
+    def test_integrity_check_reports_overlap(self):
+        from .backup_manager import BackupManager
+        self.book((9, 0), (10, 0))
+        self.book((9, 30), (10, 30))
+        issues = BackupManager().validate_data_integrity()
+        self.assertEqual(len([i for i in issues if i['code'] == 'RESERVATION_OVERLAP']), 1)
+
+
+class IntegrityCheckTest(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+
+    def book(self, day, start, end, title="会议"):
+        return Reservation.objects.create(room=self.room, date=datetime.date(2025, 3, day), start_time=datetime.time(*start),
+                                          end_time=datetime.time(*end), title=title, booker="张三")
+
+    def test_safe_loaddata_warns_on_overlap_and_handles_errors(self):
+        from io import StringIO
+        from unittest import mock
+        from .management.commands.safe_loaddata import Command
+        self.book(10, (9, 0), (11, 0))
+        self.book(10, (10, 0), (12, 0))
+        command = Command(stdout=StringIO())
+        # 现有数据中的时间重叠只输出警告，不阻止加载
+        self.assertTrue(command.verify_loaded_data())
+        self.assertIn('时间冲突', command.stdout.getvalue())
+        with mock.patch('booking.management.commands.safe_loaddata.find_integrity_issues',
+                        side_effect=RuntimeError('数据库已锁定')):
+            self.assertFalse(command.verify_loaded_data())
+        self.assertIn('数据完整性验证失败: 数据库已锁定', command.stdout.getvalue())
+
+    def test_sweep_reports_overlaps_in_linear_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .integrity import find_integrity_issues
+        long = self.book(10, (9, 0), (12, 0))
+        self.book(10, (10, 0), (10, 30))
+        nested = self.book(10, (11, 0), (11, 30))
+        self.book(10, (12, 0), (13, 0))
+        self.book(11, (9, 0), (10, 0))
+        self.book(11, (10, 0), (9, 0), title=" ")
+        with CaptureQueriesContext(connection) as queries:
+            issues = find_integrity_issues()
+        self.assertEqual(len(queries), 2)
+        overlaps = [issue['ids'] for issue in issues if issue['code'] == 'RESERVATION_OVERLAP']
+        # 被较长预约覆盖的预约也能发现（与结束最晚的预约比较）
+        self.assertEqual(len(overlaps), 2)
+        self.assertEqual(overlaps[1], [long.id, nested.id])
+        codes = sorted((issue['code'], issue['severity']) for issue in issues if issue['code'] != 'RESERVATION_OVERLAP')
+        self.assertEqual(codes, [('RESERVATION_TIME_INVALID', 'error'), ('RESERVATION_TITLE_EMPTY', 'warning')])
+
+    def test_date_partitions_cover_all_reservations(self):
+        from .integrity import _date_partitions, check_reservations, find_integrity_issues
+        for day in range(1, 11):
+            self.book(day, (9, 0), (10, 0))
+            self.book(day, (9, 30), (10, 30))
+        partitions = _date_partitions(3)
+        self.assertEqual(len(partitions), 3)
+        issues = [issue for date_from, date_to in partitions for issue in check_reservations({self.room.id}, date_from, date_to)]
+        self.assertEqual(sorted(map(str, issues)), sorted(map(str, find_integrity_issues())))
+
+    def test_process_pool_sets_up_django_under_spawn(self):
+        from unittest import mock
+        import django
+        from .integrity import _pool_options
+        with mock.patch('multiprocessing.get_all_start_methods', return_value=['spawn']):
+            options = _pool_options()
+        self.assertEqual(options['mp_context'].get_start_method(), 'spawn')
+        self.assertIs(options['initializer'], django.setup)
+
+
+class ReservationDetailApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+        self.other = Room.objects.create(name="会议室B", capacity=6)
+        self.data = {
+            'room': str(self.room.id), 'date': '2025-03-10', 'start': '09:00', 'end': '10:00',
+            'title': '周会', 'booker': '张三',
+        }
+
+    def send(self, method, url, data=None):
+        return getattr(self.client, method)(url, json.dumps(data) if data is not None else None,
+                                            content_type='application/json')
+
+    def test_create_checks_conflict(self):
+        response = self.send('post', '/api/reservations/', self.data)
+        self.assertEqual(response.status_code, 201)
+        created = response.json()['reservation']
+        self.assertEqual((created['room'], created['start'], created['end']), (str(self.room.id), '09:00', '10:00'))
+
+        overlapping = dict(self.data, start='09:30', end='10:30')
+        self.assertEqual(self.send('post', '/api/reservations/', overlapping).status_code, 409)
+        self.assertEqual(self.send('post', '/api/reservations/', dict(overlapping, room=str(self.other.id))).status_code, 201)
+        self.assertEqual(self.send('post', '/api/reservations/', dict(self.data, end='08:00')).status_code, 400)
+
+    def test_patch_and_delete_touch_single_row(self):
+        reservation_id = self.send('post', '/api/reservations/', self.data).json()['reservation']['id']
+        self.send('post', '/api/reservations/', dict(self.data, start='10:00', end='11:00'))
+        url = f'/api/reservations/{reservation_id}/'
+
+        # 移动到与另一条预约重叠的时间被拒绝，只改标题不受影响
+        self.assertEqual(self.send('patch', url, {'end': '10:30'}).status_code, 409)
+        with self.assertNumQueries(6):
+            response = self.send('patch', url, {'title': '例会'})
+        self.assertEqual(response.json()['reservation']['title'], '例会')
+        self.assertEqual(response.json()['reservation']['end'], '10:00')
+
+        self.assertEqual(self.send('delete', url).status_code, 200)
+        self.assertEqual(self.send('delete', url).status_code, 404)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_single_row_write_returns_collection_etag(self):
+        etag = self.client.get('/api/load_reservations/')['ETag']
+        response = self.client.post('/api/reservations/', json.dumps(self.data), content_type='application/json',
+                                    HTTP_X_COLLECTION_ETAG=etag)
+        stale = etag
+        etag = response['X-Collection-ETag']
+        rows = [dict(self.data, id=response.json()['reservation']['id'])]
+        response = self.client.patch(f"/api/reservations/{rows[0]['id']}/", json.dumps({'title': '例会'}),
+                                     content_type='application/json', HTTP_X_COLLECTION_ETAG=etag)
+        etag = response['X-Collection-ETag']
+        self.assertEqual(etag, self.client.get('/api/load_reservations/')['ETag'])
+
+        # 整体保存使用更新后的ETag，不会误报冲突
+        rows[0]['title'] = '例会'
+        response = self.client.post('/api/save_reservations/', json.dumps(rows), content_type='application/json',
+                                    HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['etag'])
+
+        # 列表已过期时不返回新ETag
+        response = self.client.post('/api/reservations/', json.dumps(dict(self.data, start='11:00', end='12:00')),
+                                    content_type='application/json', HTTP_X_COLLECTION_ETAG=stale)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.has_header('X-Collection-ETag'))
+
+    def test_delete_returns_collection_etag_for_list_save(self):
+        # 管理页面删除单条预约后用返回的列表ETag整体保存（删除会议室时先保存预约）
+        keep = self.client.post('/api/reservations/', json.dumps(self.data), content_type='application/json').json()
+        removed = self.client.post('/api/reservations/', json.dumps(dict(self.data, start='11:00', end='12:00')),
+                                   content_type='application/json').json()
+        etag = self.client.get('/api/load_reservations/')['ETag']
+        response = self.client.delete(f"/api/reservations/{removed['reservation']['id']}/", HTTP_X_COLLECTION_ETAG=etag)
+        self.assertTrue(response.json()['success'])
+        etag = response['X-Collection-ETag']
+        self.assertEqual(etag, self.client.get('/api/load_reservations/')['ETag'])
+
+        rows = [dict(self.data, id=keep['reservation']['id'], title='例会')]
+        response = self.client.post('/api/save_reservations/', json.dumps(rows), content_type='application/json',
+                                    HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Reservation.objects.get(id=keep['reservation']['id']).title, '例会')
+
+
+class BulkSaveReservationsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+        self.day = datetime.date(2025, 3, 10)
+
+    def row(self, reservation_id, start, end, **kwargs):
+        data = {
+            'room': str(self.room.id), 'date': self.day.isoformat(), 'start': start, 'end': end,
+            'title': '会议', 'booker': '张三', 'department': '',
+        }
+        if reservation_id is not None:
+            data['id'] = reservation_id
+        data.update(kwargs)
+        return data
+
+    def post(self, rows):
+        return self.client.post('/api/save_reservations/', json.dumps(rows), content_type='application/json')
+
+    def test_diff_applies_only_changes(self):
+        from .models import ChangeLog
+        from .occupancy import get_occupancy_masks, time_range_mask
+        kept = Reservation.objects.create(room=self.room, date=self.day, start_time=datetime.time(9, 0),
+                                          end_time=datetime.time(10, 0), title="会议", booker="张三")
+        moved = Reservation.objects.create(room=self.room, date=self.day, start_time=datetime.time(11, 0),
+                                           end_time=datetime.time(12, 0), title="会议", booker="张三")
+        removed = Reservation.objects.create(room=self.room, date=self.day, start_time=datetime.time(14, 0),
+                                             end_time=datetime.time(15, 0), title="会议", booker="张三")
+        cursor = ChangeLog.objects.latest('id').id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post([
+                self.row(kept.id, '09:00', '10:00'),
+                self.row(moved.id, '16:00', '17:00'),
+                self.row(None, '10:00', '11:00', title='新会议'),
+            ])
+        self.assertTrue(response.json()['success'])
+
+        self.assertFalse(Reservation.objects.filter(id=removed.id).exists())
+        moved.refresh_from_db()
+        self.assertEqual(moved.start_time, datetime.time(16, 0))
+        actions = set(ChangeLog.objects.filter(id__gt=cursor).values_list('object_id', 'action'))
+        created_id = Reservation.objects.get(title='新会议').id
+        self.assertEqual(actions, {(moved.id, 'update'), (removed.id, 'delete'), (created_id, 'create')})
+        expected = 0
+        for start, end in ((9, 10), (10, 11), (16, 17)):
+            expected |= time_range_mask(datetime.time(start, 0), datetime.time(end, 0))
+        self.assertEqual(get_occupancy_masks(self.day)[self.room.id], expected)
+
+    def test_query_count_independent_of_rows(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        rows = [self.row(None, '%02d:00' % (8 + i % 10), '%02d:30' % (8 + i % 10), date=(self.day + datetime.timedelta(days=i // 10)).isoformat())
+                for i in range(1200)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.post(rows).json()['success'])
+        self.assertEqual(Reservation.objects.count(), 1200)
+        self.assertLess(len(queries), 50)
+
+
+class BulkSaveRoomsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def post(self, rows):
+        return self.client.post('/api/save_rooms/', json.dumps(rows), content_type='application/json')
+
+    def test_diff_applies_only_changes(self):
+        from .models import ChangeLog
+        kept = Room.objects.create(name="会议室A", capacity=10)
+        renamed = Room.objects.create(name="会议室B", capacity=10)
+        removed = Room.objects.create(name="会议室C", capacity=10)
+        booked = Room.objects.create(name="会议室D", capacity=10)
+        Reservation.objects.create(room=booked, date=datetime.date(2025, 3, 10), start_time=datetime.time(9, 0),
+                                   end_time=datetime.time(10, 0), title="会议", booker="张三")
+        cursor = ChangeLog.objects.latest('id').id
+
+        rows = [
+            {'id': str(kept.id), 'name': "会议室A", 'capacity': 10},
+            {'id': str(renamed.id), 'name': "大会议室", 'capacity': 30},
+            {'id': str(booked.id), 'name': "会议室D", 'capacity': 10},
+            # 前端临时ID：同名时更新已有会议室，否则新增
+            {'id': 'room_1', 'name': "会议室A", 'capacity': 10},
+            {'id': 'room_2', 'name': "培训室", 'capacity': 50},
+        ]
+        self.assertTrue(self.post(rows).json()['success'])
+        self.assertFalse(Room.objects.filter(id=removed.id).exists())
+        self.assertEqual(Room.objects.get(id=renamed.id).version, 2)
+        self.assertEqual(Room.objects.get(id=kept.id).version, 1)
+        created = Room.objects.get(name="培训室")
+        actions = set(ChangeLog.objects.filter(id__gt=cursor).values_list('object_id', 'action'))
+        self.assertEqual(actions, {(renamed.id, 'update'), (removed.id, 'delete'), (created.id, 'create')})
+
+        # 有预约的会议室不能删除
+        response = self.post([row for row in rows if row['id'] != str(booked.id)])
+        self.assertEqual(response.status_code, 500)
+        self.assertIn("会议室D", response.json()['error'])
+        self.assertTrue(Room.objects.filter(id=booked.id).exists())
+
+    def test_query_count_independent_of_rooms(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        counts = []
+        for size in (12, 300):
+            Room.objects.all().delete()
+            Room.objects.bulk_create([Room(name=f"会议室{i}", capacity=10) for i in range(size)])
+            rooms = list(Room.objects.order_by('id'))
+            Reservation.objects.create(room=rooms[0], date=datetime.date(2025, 3, 10), start_time=datetime.time(9, 0),
+                                       end_time=datetime.time(10, 0), title="会议", booker="张三")
+            # 修改一半、删除四分之一、新增四分之一
+            rows = [{'id': str(room.id), 'name': room.name, 'capacity': 20 if i % 2 else 10}
+                    for i, room in enumerate(rooms[:size * 3 // 4])]
+            rows += [{'id': f'room_new{i}', 'name': f"新会议室{i}", 'capacity': 8} for i in range(size // 4)]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(self.post(rows).json()['success'])
+            self.assertEqual(Room.objects.count(), size)
+            counts.append(len(queries))
+            logger.info(f"保存{size}个会议室: {len(queries)}次查询")
+        self.assertEqual(counts[0], counts[1])
+
+
+class OptimisticConcurrencyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+        self.reservation = Reservation.objects.create(
+            room=self.room, date=datetime.date(2025, 3, 10), start_time=datetime.time(9, 0),
+            end_time=datetime.time(10, 0), title="周会", booker="张三"
+        )
+
+    def load(self):
+        response = self.client.get('/api/load_reservations/')
+        return read_json(response), response['ETag']
+
+    def save(self, rows, etag):
+        return self.client.post('/api/save_reservations/', json.dumps(rows),
+                                content_type='application/json', HTTP_IF_MATCH=etag)
+
+    def test_patch_requires_current_version(self):
+        url = f'/api/reservations/{self.reservation.id}/'
+        self.assertEqual(self.client.get(url)['ETag'], '"1"')
+        response = self.client.patch(url, json.dumps({'title': '例会'}), content_type='application/json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response['ETag'], '"2"')
+
+        response = self.client.patch(url, json.dumps({'title': '晨会'}), content_type='application/json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['conflicts'][0]['title'], '例会')
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"1"').status_code, 409)
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"2"').status_code, 200)
+
+    def test_stale_list_does_not_delete_new_rows(self):
+        rows_a, etag_a = self.load()
+        rows_b, etag_b = self.load()
+
+        # A 新增一条预约
+        new_row = dict(rows_a[0], start='11:00', end='12:00', title='评审')
+        del new_row['id'], new_row['version']
+        response = self.save(rows_a + [new_row], etag_a)
+        self.assertTrue(response.json()['success'])
+        self.assertTrue(response.json()['etag'])
+
+        # B 基于旧列表保存（不含A新增的预约）被拒绝
+        response = self.save(rows_b, etag_b)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([row['title'] for row in response.json()['conflicts']], ['评审'])
+        self.assertEqual(Reservation.objects.count(), 2)
+
+        # B 修改A已修改过的预约同样被拒绝
+        Reservation.objects.filter(id=self.reservation.id).update(version=5)
+        rows, etag = self.load()
+        stale = dict(rows[0], version=4, title='改名')
+        self.assertEqual(self.save([stale, rows[1]], etag).status_code, 409)
+        response = self.save([dict(rows[0], title='改名'), rows[1]], etag)
+        self.assertTrue(response.json()['success'])
+        self.reservation.refresh_from_db()
+        self.assertEqual((self.reservation.title, self.reservation.version), ('改名', 6))
+
+
+class ConcurrentBookingTest(TransactionTestCase):
+    """多个线程同时预约同一会议室：同一时段只能成功一次，锁等待时重试而不是报错"""
+
+    THREADS = 16
+
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+
+    def run_threads(self, payloads):
+        from django.db import connection
+        from django.test import Client
+        barrier = threading.Barrier(len(payloads))
+        statuses = []
+        lock = threading.Lock()
+
+        def worker(payload):
+            client = Client()
+            try:
+                barrier.wait()
+                response = client.post('/api/reservations/', json.dumps(payload), content_type='application/json')
+                with lock:
+                    statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        # 写锁等待超时后的重试由 run_in_write_transaction 以警告日志记录，按日志计数
+        retries = []
+        handler = logging.Handler(logging.WARNING)
+        handler.emit = retries.append
+        transactions_logger = logging.getLogger('booking.transactions')
+        transactions_logger.addHandler(handler)
+        threads = [threading.Thread(target=worker, args=(payload,)) for payload in payloads]
+        started = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            transactions_logger.removeHandler(handler)
+        elapsed = time.perf_counter() - started
+        return statuses, elapsed, len(retries)
+
+    def payload(self, hour):
+        return {
+            'room': str(self.room.id), 'date': '2025-03-10', 'start': '%02d:00' % hour, 'end': '%02d:45' % hour,
+            'title': '会议', 'booker': '张三',
+        }
+
+    @override_settings(WRITE_LOCK={'MAX_ATTEMPTS': 50, 'BACKOFF_BASE': 0.01, 'BACKOFF_MAX': 0.1})
+    def test_same_slot_books_once(self):
+        statuses, elapsed, retries = self.run_threads([self.payload(9)] * self.THREADS)
+        self.assertEqual(sorted(statuses), [201] + [409] * (self.THREADS - 1))
+        self.assertEqual(Reservation.objects.count(), 1)
+        logger.info(f"同一时段并发预约: {self.THREADS}个请求 {elapsed:.3f}秒，"
+                    f"{self.THREADS / elapsed:.1f}次/秒，重试{retries}次")
+
+    @override_settings(WRITE_LOCK={'MAX_ATTEMPTS': 50, 'BACKOFF_BASE': 0.01, 'BACKOFF_MAX': 0.1})
+    def test_distinct_slots_all_succeed(self):
+        statuses, elapsed, retries = self.run_threads([self.payload(hour) for hour in range(self.THREADS)])
+        self.assertEqual(statuses, [201] * self.THREADS)
+        self.assertEqual(Reservation.objects.count(), self.THREADS)
+        logger.info(f"不同时段并发预约: {self.THREADS}个请求 {elapsed:.3f}秒，"
+                    f"{self.THREADS / elapsed:.1f}次/秒，重试{retries}次")
+
+
+@override_settings(NOTIFICATION_OUTBOX={'IN_PROCESS': False, 'MAX_ATTEMPTS': 3, 'BACKOFF_BASE': 30})
+class NotificationOutboxTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+
+    def book(self):
+        return self.client.post('/api/reservations/', json.dumps({
+            'room': str(self.room.id), 'date': '2025-03-10', 'start': '09:00', 'end': '10:00',
+            'title': '周会', 'booker': '张三',
+        }), content_type='application/json')
+
+    def test_request_only_writes_outbox(self):
+        from unittest import mock
+        from .models import NotificationOutbox
+        with mock.patch('booking.notifications.post_json') as post:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.book().status_code, 201)
+        post.assert_not_called()
+        entry = NotificationOutbox.objects.get()
+        self.assertEqual((entry.action, entry.status, entry.payload['title']), ('新增', 'pending', '周会'))
+
+        # 删除后通知仍带有原预约内容
+        self.client.delete(f"/api/reservations/{entry.reservation_id}/")
+        self.assertEqual(NotificationOutbox.objects.filter(action='删除').get().payload['start'], '09:00')
+
+    def test_retry_backoff_and_dead_letter(self):
+        from unittest import mock
+        from django.core.management import call_command
+        from django.utils import timezone
+        from .models import NotificationOutbox
+        from .outbox import process_outbox
+        self.book()
+        entry = NotificationOutbox.objects.get()
+
+        with mock.patch('booking.outbox.send_wechat_digest', return_value=(False, 'HTTP错误: 502')) as send:
+            self.assertEqual(process_outbox(), {'sent': 0, 'failed': 1})
+            entry.refresh_from_db()
+            self.assertEqual((entry.status, entry.attempts), ('pending', 1))
+            self.assertGreater(entry.next_attempt_at, timezone.now())
+            # 未到重试时间不会再次发送
+            self.assertEqual(process_outbox(), {'sent': 0, 'failed': 0})
+            for _ in range(2):
+                NotificationOutbox.objects.update(next_attempt_at=timezone.now())
+                process_outbox()
+            self.assertEqual(send.call_count, 3)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.last_error), ('dead', 'HTTP错误: 502'))
+
+        with mock.patch('booking.outbox.send_wechat_digest', return_value=(True, '发送成功')):
+            call_command('process_outbox', '--replay-dead', '--workers', '1', stdout=open(os.devnull, 'w'))
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), ('sent', 1))
+
+
+class OutboxDispatcherStartupTest(TransactionTestCase):
+    """发送线程使用自己的数据库连接，需要已提交的数据"""
+
+    @override_settings(NOTIFICATION_OUTBOX={'IN_PROCESS': True, 'COALESCE_WINDOW': 0, 'POLL_INTERVAL': 3600})
+    def test_startup_drains_due_rows_without_new_write(self):
+        from unittest import mock
+        from django.utils import timezone
+        from .models import NotificationOutbox
+        from .outbox import OutboxDispatcher, start_outbox_dispatcher
+        entry = NotificationOutbox.objects.create(
+            action='新增', reservation_id=1, payload={'title': '周会'},
+            next_attempt_at=timezone.now() - datetime.timedelta(minutes=5),
+        )
+        with mock.patch('booking.outbox._dispatcher', OutboxDispatcher()), \
+                mock.patch('booking.outbox.send_wechat_digest', return_value=(True, '发送成功')):
+            start_outbox_dispatcher()
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                entry.refresh_from_db()
+                if entry.status == 'sent':
+                    break
+                time.sleep(0.05)
+        self.assertEqual(entry.status, 'sent')
+
+
+class StubWebhookServer:
+    """本地模拟的企业微信Webhook（HTTP/1.1，支持长连接）"""
+
+    def __init__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        stub = self
+        self.status = 200
+        self.requests = []
+        self.bodies = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.requests.append(self.client_address)
+                stub.bodies.append(json.loads(body))
+                body = json.dumps({'errcode': 0, 'errmsg': 'ok'}).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/cgi-bin/webhook/send?key=test' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(
+    NOTIFICATION_OUTBOX={'IN_PROCESS': False},
+    WEBHOOK_CLIENT={'FAILURE_THRESHOLD': 2, 'RECOVERY_TIMEOUT': 0.2},
+)
+class WebhookClientTest(TestCase):
+    def setUp(self):
+        from .models import Settings
+        from .webhook import reset_webhook_client
+        reset_webhook_client()
+        self.addCleanup(reset_webhook_client)
+        self.stub = StubWebhookServer()
+        self.addCleanup(self.stub.close)
+        Settings.objects.create(key='webhook_url', value=self.stub.url)
+        self.snapshot = {
+            'id': 1, 'room_id': 1, 'room_name': '会议室A', 'date': '2025-03-10', 'start': '09:00', 'end': '10:00',
+            'title': '周会', 'booker': '张三', 'department': '', 'created_at': '2025-03-01T08:00:00+00:00',
+        }
+
+    def test_connection_reused(self):
+        from .notifications import send_wechat_notification
+        from .webhook import get_webhook_stats
+        for _ in range(3):
+            self.assertEqual(send_wechat_notification(self.snapshot), (True, '发送成功'))
+        self.assertEqual(len(self.stub.requests), 3)
+        # 三次请求复用同一个连接
+        self.assertEqual(len(set(self.stub.requests)), 1)
+        stats = get_webhook_stats()
+        self.assertEqual((stats['calls'], stats['success']), (3, 3))
+        self.assertIsNotNone(stats['latency_ms']['p95'])
+
+    def test_circuit_breaker_fails_fast_and_recovers(self):
+        from django.utils import timezone
+        from .models import NotificationOutbox
+        from .notifications import send_wechat_notification
+        from .outbox import process_outbox
+        from .webhook import CircuitOpenError, get_webhook_stats
+        self.stub.status = 502
+        for _ in range(2):
+            self.assertEqual(send_wechat_notification(self.snapshot), (False, 'HTTP错误: 502'))
+        with self.assertRaises(CircuitOpenError):
+            send_wechat_notification(self.snapshot)
+        self.assertEqual(len(self.stub.requests), 2)
+
+        # 熔断期间发件箱延后发送，不计入发送次数
+        room = Room.objects.create(name="会议室A", capacity=10)
+        self.client.post('/api/reservations/', json.dumps({
+            'room': str(room.id), 'date': '2025-03-10', 'start': '09:00', 'end': '10:00',
+            'title': '周会', 'booker': '张三',
+        }), content_type='application/json')
+        self.assertEqual(process_outbox(), {'sent': 0, 'failed': 1})
+        entry = NotificationOutbox.objects.get()
+        self.assertEqual((entry.status, entry.attempts), ('pending', 0))
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+        self.assertEqual(len(self.stub.requests), 2)
+
+        # 熔断时间结束后探测成功即恢复
+        self.stub.status = 200
+        time.sleep(0.25)
+        self.assertEqual(send_wechat_notification(self.snapshot), (True, '发送成功'))
+        stats = get_webhook_stats()
+        self.assertEqual(list(stats['circuits'].values()), [{'state': 'closed', 'failures': 0}])
+        self.assertEqual(stats['rejected'], 2)
+
+    def test_token_bucket_limits_rate(self):
+        from .notifications import send_wechat_notification
+        from .webhook import RateLimitedError
+        with self.settings(WEBHOOK_CLIENT={'RATE_LIMIT': 2, 'RATE_PERIOD': 60, 'RATE_LIMIT_WAIT': 0}):
+            for _ in range(2):
+                self.assertTrue(send_wechat_notification(self.snapshot)[0])
+            with self.assertRaises(RateLimitedError) as raised:
+                send_wechat_notification(self.snapshot)
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertGreater(raised.exception.retry_after, 25)
+
+
+@override_settings(NOTIFICATION_OUTBOX={'IN_PROCESS': False})
+class NotificationDigestTest(TestCase):
+    def setUp(self):
+        from .models import Settings
+        from .webhook import reset_webhook_client
+        cache.clear()
+        reset_webhook_client()
+        self.addCleanup(reset_webhook_client)
+        self.stub = StubWebhookServer()
+        self.addCleanup(self.stub.close)
+        Settings.objects.create(key='webhook_url', value=self.stub.url)
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+
+    def save(self, rows):
+        return self.client.post('/api/save_reservations/', json.dumps([
+            {'room': str(self.room.id), 'date': '2025-03-10', 'start': start, 'end': end,
+             'title': title, 'booker': '张三', 'department': '', **extra}
+            for start, end, title, extra in rows
+        ]), content_type='application/json')
+
+    def test_bulk_save_sends_one_digest(self):
+        from .outbox import process_outbox
+        self.assertTrue(self.save([('%02d:00' % hour, '%02d:30' % hour, '会议%d' % hour, {}) for hour in range(8, 18)]).json()['success'])
+        self.assertEqual(process_outbox(workers=1), {'sent': 10, 'failed': 0})
+        self.assertEqual(len(self.stub.requests), 1)
+        content = self.stub.bodies[0]['markdown_v2']['content']
+        self.assertIn('共 10 条变更：新增 10 条', content)
+        self.assertIn('会议17', content)
+
+    def test_coalesce_events(self):
+        from .models import NotificationOutbox
+        from .outbox import coalesce_events
+
+        def entry(reservation_id, action, title):
+            return NotificationOutbox(reservation_id=reservation_id, action=action, payload={'title': title})
+
+        rows = coalesce_events([
+            entry(1, '新增', 'a'), entry(1, '编辑', 'a2'),  # 新增后编辑 -> 新增（最新内容）
+            entry(2, '新增', 'b'), entry(2, '删除', 'b'),  # 新增后删除 -> 抵消
+            entry(3, '编辑', 'c'), entry(3, '编辑', 'c2'), entry(3, '删除', 'c2'),  # -> 删除
+            entry(4, '删除', 'd'), entry(4, '新增', 'e'),  # ID被复用 -> 两行
+        ])
+        self.assertEqual([(action, payload['title']) for action, payload in rows],
+                         [('新增', 'a2'), ('删除', 'c2'), ('删除', 'd'), ('新增', 'e')])
+
+
+class SettingsCacheTest(TestCase):
+    def setUp(self):
+        from .settings_cache import invalidate_settings_cache
+        invalidate_settings_cache()
+        self.addCleanup(invalidate_settings_cache)
+
+    @override_settings(DEFAULT_WEBHOOK_URL='https://example.invalid/hook')
+    def test_typed_getters_and_defaults(self):
+        from .models import Settings
+        from .settings_cache import get_bool, get_int, get_str
+        self.assertEqual(get_str('webhook_url'), 'https://example.invalid/hook')
+        self.assertFalse(get_bool('debug_mode'))
+        self.assertEqual(get_int('page_size', 50), 50)
+        Settings.objects.create(key='debug_mode', value='True')
+        Settings.objects.create(key='page_size', value='20')
+        self.assertTrue(get_bool('debug_mode'))
+        self.assertEqual(get_int('page_size', 50), 20)
+
+    @override_settings(SETTINGS_CACHE={'CHECK_INTERVAL': 60})
+    def test_reads_are_cached_and_invalidated(self):
+        from django.db.models import F
+        from .models import DataVersion, Settings
+        from .settings_cache import get_str
+        Settings.objects.create(key='webhook_url', value='http://a')
+        with self.assertNumQueries(2):
+            self.assertEqual(get_str('webhook_url'), 'http://a')
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                get_str('webhook_url')
+
+        # 本进程通过接口写入时立即失效
+        self.client.post('/api/save_settings/', json.dumps({'webhook_url': 'http://b'}), content_type='application/json')
+        self.assertEqual(get_str('webhook_url'), 'http://b')
+
+        # 其他进程写入（不经过本进程信号）：到检查间隔后通过版本号发现
+        Settings.objects.filter(key='webhook_url').update(value='http://c')
+        DataVersion.objects.filter(scope='settings').update(version=F('version') + 1)
+        self.assertEqual(get_str('webhook_url'), 'http://b')
+        with self.settings(SETTINGS_CACHE={'CHECK_INTERVAL': 0}):
+            self.assertEqual(get_str('webhook_url'), 'http://c')
+            with self.assertNumQueries(1):
+                get_str('webhook_url')
+
+
+class BackupFormatTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from .backup_manager import BackupManager
+        from .models import Settings
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.manager = BackupManager(temp_dir.name)
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+        for hour in range(8, 12):
+            Reservation.objects.create(room=self.room, date=datetime.date(2025, 3, 10), start_time=datetime.time(hour, 0),
+                                       end_time=datetime.time(hour, 30), title="会议", booker="张三")
+        Settings.objects.create(key='debug_mode', value='false')
+
+    def test_streamed_gzip_backup_round_trip(self):
+        import gzip
+        with self.settings(BACKUP_SETTINGS={'COMPRESS_BACKUPS': True, 'COMPRESSION': 'gzip'}):
+            success, path, _ = self.manager.create_backup('manual', '测试')
+        self.assertTrue(success)
+        self.assertTrue(path.endswith('.jsonl.gz'))
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([lines[0]['type'], lines[-1]['type']], ['metadata', 'summary'])
+        self.assertEqual(lines[-1]['counts'], {'rooms': 1, 'reservations': 4, 'settings': 1})
+
+        listed = self.manager.list_backups()
+        self.assertEqual((listed[0]['description'], listed[0]['rooms_count'], listed[0]['reservations_count']), ('测试', 1, 4))
+
+        Reservation.objects.all().delete()
+        self.assertTrue(self.manager.restore_backup(path)[0])
+        self.assertEqual(Reservation.objects.count(), 4)
+
+    def test_legacy_json_backup_still_readable(self):
+        import os
+        legacy = {
+            'metadata': {'backup_type': 'manual', 'description': '旧备份', 'version': '1.0'},
+            'rooms': [{'id': 7, 'name': '旧会议室', 'capacity': 6, 'description': '', 'equipment': '', 'status': 'available'}],
+            'reservations': [{'id': 3, 'room_id': 7, 'date': '2025-01-02', 'start_time': '09:00', 'end_time': '10:00',
+                              'title': '旧会议', 'booker': '李四', 'department': ''}],
+            'settings': [{'key': 'webhook_url', 'value': '', 'description': ''}],
+        }
+        path = os.path.join(self.manager.backup_dir, 'backup_manual_20240101_000000.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(legacy, f, ensure_ascii=False)
+        listed = self.manager.list_backups()
+        self.assertEqual((listed[0]['description'], listed[0]['rooms_count'], listed[0]['reservations_count']), ('旧备份', 1, 1))
+        self.assertTrue(self.manager.restore_backup(path)[0])
+        self.assertEqual(list(Reservation.objects.values_list('id', 'room__name')), [(3, '旧会议室')])
+
+    def test_catalog_lists_without_reading_backups(self):
+        from unittest import mock
+        success, path, _ = self.manager.create_backup('manual', '目录')
+        self.assertTrue(success)
+        with open(path, 'rb') as f:
+            content = f.read()
+        with mock.patch('booking.backup_manager.iter_backup_records', side_effect=AssertionError('不应读取备份')):
+            listed = self.manager.list_backups()
+        self.assertEqual((listed[0]['description'], listed[0]['reservations_count'], listed[0]['settings_count']), ('目录', 4, 1))
+        self.assertTrue(self.manager.validate_backup(path))
+
+        # 内容被改动（大小不变）时校验和不一致
+        with open(path, 'wb') as f:
+            f.write(content[:-1] + bytes([content[-1] ^ 1]))
+        self.assertFalse(self.manager.validate_backup(path))
+
+    def test_bulk_restore_preserves_created_at(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import RoomOccupancy
+        created = datetime.datetime(2024, 5, 6, 7, 8, 9, tzinfo=datetime.timezone.utc)
+        Reservation.objects.update(created_at=created)
+        extra = [Reservation(room=self.room, date=datetime.date(2025, 3, 11) + datetime.timedelta(days=i // 4), start_time=datetime.time(8 + i % 4, 0),
+                             end_time=datetime.time(8 + i % 4, 45), title="会议", booker="张三") for i in range(2000)]
+        Reservation.objects.bulk_create(extra)
+        success, path, _ = self.manager.create_backup('manual')
+        self.assertTrue(success)
+
+        Room.objects.create(name="会议室B", capacity=4)
+        progress = []
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.manager._restore_records(path, {}, lambda key, count: progress.append((key, count))))
+        # 分批写入，查询数远少于行数
+        self.assertLess(len(queries), 100)
+        self.assertEqual(progress, [('rooms', 1), ('reservations', 1000), ('reservations', 2000), ('reservations', 2004), ('settings', 1)])
+        self.assertEqual(list(Room.objects.values_list('name', flat=True)), ["会议室A"])
+        self.assertEqual(Reservation.objects.filter(created_at=created).count(), 4)
+        self.assertEqual(RoomOccupancy.objects.count(), 1 + 500)
+
+    def test_restored_row_versions_do_not_regress(self):
+        reservation = Reservation.objects.first()
+        reservation.title = "改名"
+        reservation.save()
+        backed_up = Reservation.objects.get(id=reservation.id).version
+        _, path, _ = self.manager.create_backup('manual')
+        for title in ("再改", "又改"):
+            reservation.title = title
+            reservation.save()
+        before = Reservation.objects.get(id=reservation.id).version
+        self.assertGreater(before, backed_up)
+
+        self.assertEqual(self.manager.restore_backup(path), (True, "数据恢复成功"))
+        restored = Reservation.objects.get(id=reservation.id)
+        self.assertEqual(restored.title, "改名")
+        # 恢复前读取的版本号（before 及更早）都不能再匹配恢复后的数据
+        self.assertGreater(restored.version, before)
+
+
+class SnapshotBackupTest(TransactionTestCase):
+    """快照按页恢复不能在事务中执行，使用 TransactionTestCase"""
+
+    def setUp(self):
+        import tempfile
+        from .backup_manager import BackupManager
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.manager = BackupManager(temp_dir.name)
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+        for hour in range(8, 12):
+            Reservation.objects.create(room=self.room, date=datetime.date(2025, 3, 10), start_time=datetime.time(hour, 0),
+                                       end_time=datetime.time(hour, 30), title="会议", booker="张三")
+
+    def test_snapshot_round_trip(self):
+        from .changes import collect_changes, get_current_cursor
+        from .models import NotificationOutbox
+        from .versioning import SCOPE_RESERVATIONS, get_data_versions
+        with self.settings(BACKUP_SETTINGS={'COMPRESS_BACKUPS': True, 'COMPRESSION': 'gzip'}):
+            success, path, _ = self.manager.create_snapshot('manual', '快照')
+        self.assertTrue(success)
+        self.assertTrue(path.endswith('.sqlite3.gz'))
+        self.assertTrue(self.manager.validate_backup(os.path.basename(path)))
+        listed = self.manager.list_backups()
+        self.assertEqual((listed[0]['description'], listed[0]['rooms_count'], listed[0]['reservations_count']), ('快照', 1, 4))
+
+        Reservation.objects.filter(start_time=datetime.time(8, 0)).delete()
+        added = Reservation.objects.create(room=self.room, date=datetime.date(2025, 3, 11), start_time=datetime.time(9, 0),
+                                           end_time=datetime.time(10, 0), title="新会议", booker="李四")
+        version = get_data_versions(SCOPE_RESERVATIONS)[SCOPE_RESERVATIONS][0]
+        cursor = get_current_cursor()
+        row_version = Reservation.objects.get(id=added.id).version
+
+        self.assertEqual(self.manager.restore_backup(path), (True, "数据恢复成功"))
+        self.assertEqual(Reservation.objects.count(), 4)
+        self.assertTrue(all(v > row_version for v in Reservation.objects.values_list('version', flat=True)))
+        self.assertFalse(Reservation.objects.filter(id=added.id).exists())
+        # 版本号和游标都不回退，恢复前已同步的客户端按差异更新
+        self.assertGreater(get_data_versions(SCOPE_RESERVATIONS)[SCOPE_RESERVATIONS][0], version)
+        changes = collect_changes(cursor)
+        self.assertFalse(changes['reset'])
+        self.assertIn(added.id, changes['deleted']['reservation'])
+        self.assertFalse(NotificationOutbox.objects.filter(status='pending').exists())
+
+    def test_command_rolls_back_snapshot_when_verification_fails(self):
+        from unittest import mock
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from .integrity import make_issue, SEVERITY_ERROR
+        _, path, _ = self.manager.create_snapshot('manual', '快照')
+        Reservation.objects.all().delete()
+        issue = make_issue('RESERVATION_OVERLAP', SEVERITY_ERROR, [1, 2], '时间冲突')
+        with self.settings(BACKUP_SETTINGS={'BACKUP_DIR': self.manager.backup_dir}), \
+                mock.patch('booking.backup_manager.BackupManager.validate_data_integrity', return_value=[issue]):
+            with self.assertRaisesMessage(CommandError, '已回滚到恢复前的数据'):
+                call_command('restore_backup', path, '--force', stdout=open(os.devnull, 'w'))
+        self.assertEqual(Reservation.objects.count(), 0)
+        self.assertEqual(Room.objects.count(), 1)
+
+    def test_backup_from_copy_matches_orm_serialization(self):
+        from .backup_manager import load_backup
+        from .models import DataVersion
+        success, path, _ = self.manager.create_backup('manual', '副本')
+        self.assertTrue(success)
+        self.assertEqual([name for name in os.listdir(self.manager.backup_dir) if 'partial' in name], [])
+        data = load_backup(path)
+        self.assertEqual(data['rooms'], list(self.manager._serialize_rooms()))
+        self.assertEqual(data['reservations'], list(self.manager._serialize_reservations()))
+        self.assertEqual(data['metadata']['data_versions']['reservations'],
+                         DataVersion.objects.get(scope='reservations').version)
+
+    def test_differential_on_snapshot_base(self):
+        _, path, _ = self.manager.create_snapshot('manual', '快照')
+        Reservation.objects.filter(start_time=datetime.time(8, 0)).delete()
+        Reservation.objects.create(room=self.room, date=datetime.date(2025, 3, 11), start_time=datetime.time(9, 0),
+                                   end_time=datetime.time(10, 0), title="新会议", booker="李四")
+        success, diff_path, message = self.manager.create_differential()
+        self.assertTrue(success, message)
+        expected = sorted(Reservation.objects.values_list('date', 'start_time', 'title'))
+
+        Reservation.objects.all().delete()
+        self.assertEqual(self.manager.restore_backup(diff_path), (True, "数据恢复成功"))
+        self.assertEqual(sorted(Reservation.objects.values_list('date', 'start_time', 'title')), expected)
+
+    def test_failed_differential_rolls_back_snapshot_base(self):
+        from unittest import mock
+        self.manager.create_snapshot('manual', '快照')
+        Reservation.objects.create(room=self.room, date=datetime.date(2025, 3, 11), start_time=datetime.time(9, 0),
+                                   end_time=datetime.time(10, 0), title="新会议", booker="李四")
+        success, diff_path, message = self.manager.create_differential()
+        self.assertTrue(success, message)
+        Reservation.objects.filter(title="新会议").update(title="恢复前")
+        expected = sorted(Reservation.objects.values_list('date', 'start_time', 'title'))
+
+        with mock.patch.object(self.manager, '_apply_differential', side_effect=ValueError("差异备份损坏")):
+            success, message = self.manager.restore_backup(diff_path)
+        self.assertFalse(success)
+        self.assertIn("已回滚到恢复前的数据", message)
+        self.assertEqual(sorted(Reservation.objects.values_list('date', 'start_time', 'title')), expected)
+
+
+class BackupSchedulerTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from .backup_manager import BackupManager
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.manager = BackupManager(temp_dir.name)
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+
+    def test_skips_backup_when_data_unchanged(self):
+        from .backup_scheduler import run_scheduled_backup
+        self.assertIsNotNone(run_scheduled_backup(self.manager)['created'])
+        self.assertTrue(run_scheduled_backup(self.manager)['skipped'])
+        Reservation.objects.create(room=self.room, date=datetime.date(2025, 3, 10), start_time=datetime.time(9, 0),
+                                   end_time=datetime.time(10, 0), title="会议", booker="张三")
+        self.assertIsNotNone(run_scheduled_backup(self.manager)['created'])
+        self.assertEqual(len(self.manager.list_backups()), 2)
+
+    def test_retention_by_count_and_age_keeps_latest(self):
+        for i in range(4):
+            self.manager.create_backup('auto', str(i))
+        self.assertEqual(len(self.manager.prune_backups(max_backups=2, keep_days=30)), 2)
+        self.assertEqual(len(self.manager.prune_backups(max_backups=2, keep_days=0)), 1)
+        listed = self.manager.list_backups()
+        self.assertEqual([backup['description'] for backup in listed], ['3'])
+        self.assertEqual(os.listdir(os.path.join(self.manager.backup_dir, '.catalog')), [listed[0]['filename'] + '.json'])
+
+    def test_differential_between_full_backups(self):
+        from .backup_scheduler import run_scheduled_backup
+        backup_settings = {'AUTO_BACKUP_DIFFERENTIAL': True, 'FULL_BACKUP_INTERVAL': 3600}
+        with self.settings(BACKUP_SETTINGS=backup_settings):
+            full = run_scheduled_backup(self.manager)['created']
+            Reservation.objects.create(room=self.room, date=datetime.date(2025, 3, 10), start_time=datetime.time(9, 0),
+                                       end_time=datetime.time(10, 0), title="会议", booker="张三")
+            diff = run_scheduled_backup(self.manager)['created']
+        self.assertIn('backup_diff_', os.path.basename(diff))
+        self.assertEqual(self.manager.backup_chain(diff), [full, diff])
+
+    def test_file_lock_allows_one_scheduler(self):
+        from .backup_scheduler import SchedulerLock
+        first, second = SchedulerLock(self.manager.backup_dir), SchedulerLock(self.manager.backup_dir)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_scheduler_retries_lock_on_short_interval(self):
+        from unittest import mock
+        from .backup_scheduler import BackupScheduler, SchedulerLock
+        holder = SchedulerLock(self.manager.backup_dir)
+        self.assertTrue(holder.acquire())
+        self.addCleanup(holder.release)
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 1:
+                holder.release()
+            else:
+                raise KeyboardInterrupt
+
+        backup_settings = {'AUTO_BACKUP_INTERVAL': 6 * 3600, 'SCHEDULER_LOCK_RETRY': 60}
+        with self.settings(BACKUP_SETTINGS=backup_settings), \
+                mock.patch('booking.backup_scheduler.BackupManager', return_value=self.manager), \
+                mock.patch('booking.backup_scheduler.run_scheduled_backup') as run_backup, \
+                mock.patch('booking.backup_scheduler.close_old_connections'), \
+                mock.patch('booking.backup_scheduler.time.sleep', side_effect=fake_sleep):
+            with self.assertRaises(KeyboardInterrupt):
+                BackupScheduler()._run()
+        # 未拿到锁时一分钟后重试，接替后才按备份间隔等待
+        self.assertEqual(sleeps, [60, 6 * 3600])
+        run_backup.assert_called_once_with(self.manager)
+
+
+class DifferentialBackupTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from .backup_manager import BackupManager
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.manager = BackupManager(temp_dir.name)
+        self.room = Room.objects.create(name="会议室A", capacity=10)
+        self.reservations = [
+            Reservation.objects.create(room=self.room, date=datetime.date(2025, 3, 10) + datetime.timedelta(days=i),
+                                       start_time=datetime.time(9, 0), end_time=datetime.time(10, 0),
+                                       title=f"会议{i}", booker="张三")
+            for i in range(20)
+        ]
+
+    def make_changes(self):
+        """基础备份之后：修改一条、删除一条、新增一个会议室和一条预约"""
+        changed = self.reservations[0]
+        changed.title = "改期会议"
+        changed.start_time = datetime.time(14, 0)
+        changed.end_time = datetime.time(15, 0)
+        changed.save()
+        self.deleted_id = self.reservations[1].id
+        self.reservations[1].delete()
+        room = Room.objects.create(name="会议室B", capacity=6)
+        Reservation.objects.create(room=room, date=datetime.date(2025, 3, 10), start_time=datetime.time(9, 0),
+                                   end_time=datetime.time(10, 0), title="新会议", booker="李四")
+
+    def snapshot_rows(self):
+        from .models import RoomOccupancy
+        return (
+            list(Room.objects.order_by('id').values_list('id', 'name', 'capacity')),
+            list(Reservation.objects.order_by('id').values_list('id', 'room_id', 'date', 'start_time', 'title')),
+            list(RoomOccupancy.objects.order_by('room_id', 'date').values_list('room_id', 'date', 'slots')),
+        )
+
+    def test_differential_contains_only_changes(self):
+        from .backup_manager import load_backup
+        success, base_path, _ = self.manager.create_backup('manual', 'base')
+        self.assertTrue(success)
+        self.make_changes()
+        success, diff_path, message = self.manager.create_differential()
+        self.assertTrue(success, message)
+        data = load_backup(diff_path)
+        self.assertEqual(data['metadata']['base'], os.path.basename(base_path))
+        self.assertEqual(len(data['rooms']), 1)
+        self.assertEqual(len(data['reservations']), 2)
+        self.assertEqual(data['deleted'], [{'model': 'reservation', 'id': self.deleted_id}])
+        self.assertEqual(self.manager.backup_chain(diff_path), [base_path, diff_path])
+
+    def test_restore_replays_chain(self):
+        self.manager.create_backup('manual', 'base')
+        self.make_changes()
+        _, first_diff, _ = self.manager.create_differential()
+        self.reservations[2].delete()
+        _, second_diff, message = self.manager.create_differential(base=os.path.basename(first_diff))
+        self.assertIsNotNone(second_diff, message)
+        expected = self.snapshot_rows()
+
+        Reservation.objects.all().delete()
+        Room.objects.create(name="多余的会议室", capacity=3)
+        success, message = self.manager.restore_backup(second_diff)
+        self.assertTrue(success, message)
+        self.assertEqual(self.snapshot_rows(), expected)
+        self.assertTrue(self.manager.validate_backup(second_diff))
+
+    def test_modified_base_breaks_chain(self):
+        _, base_path, _ = self.manager.create_backup('manual', 'base', compress=False)
+        self.make_changes()
+        _, diff_path, _ = self.manager.create_differential()
+        with open(base_path, 'a', encoding='utf-8') as f:
+            f.write('\n')
+        self.assertFalse(self.manager.validate_backup(diff_path))
+        success, message = self.manager.restore_backup(diff_path)
+        self.assertFalse(success)
+        self.assertIn('被改动', message)
+
+    def test_prune_keeps_base_of_kept_differential(self):
+        _, base_path, _ = self.manager.create_backup('manual', 'base')
+        self.make_changes()
+        self.manager.create_differential()
+        self.manager.prune_backups(max_backups=1, keep_days=30)
+        self.assertEqual(len(self.manager.list_backups()), 2)
+        self.assertTrue(os.path.exists(base_path))
@@ -0,0 +1,73 @@
+"""
+写事务
+预约的冲突检查和写入必须在同一个事务中完成，且在读取之前就拿到写锁，
+否则两个请求可能同时读到"无冲突"后各自写入同一时段。
+
+SQLite 上 Django 4.2 的 atomic() 以 BEGIN（DEFERRED）开始，第一次写入时才申请写锁；
+这里进入事务后先执行一条不修改数据的 UPDATE，效果等同 BEGIN IMMEDIATE：
+其他写事务在 busy timeout 内排队等待，而不是读完后在升级写锁时互相冲突。
+其他数据库上同一条 UPDATE 会锁住数据版本行，同样使预约写入串行化。
+
+仍然拿不到锁（database is locked）时整个事务按指数退避重试，重试次数有上限。
+"""
+import logging
+import random
+import time
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from .models import DataVersion
+
+logger = logging.getLogger(__name__)
+
+
+def get_write_lock_config():
+    """读取 settings.WRITE_LOCK 配置"""
+    config = {
+        'MAX_ATTEMPTS': 5,  # 包括第一次在内的最多尝试次数
+        'BACKOFF_BASE': 0.05,  # 第一次重试前的等待时间（秒），之后每次翻倍
+        'BACKOFF_MAX': 1.0,  # 单次等待上限（秒）
+    }
+    config.update(getattr(settings, 'WRITE_LOCK', {}))
+    return config
+
+
+def is_lock_error(error):
+    """是否为 SQLite 锁等待超时（database is locked / database table is locked）"""
+    return isinstance(error, OperationalError) and 'locked' in str(error)
+
+
+def acquire_write_lock(scope):
+    """在当前事务中立即获取写锁（不修改数据）"""
+    DataVersion.objects.filter(scope=scope).update(version=F('version'))
+
+
+def run_in_write_transaction(scope, func, *args, **kwargs):
+    """
+    在先拿写锁的短事务中执行 func，锁等待超时时整体重试
+
+    func 中注册的 on_commit 回调随失败的事务一起丢弃，重试成功后只执行一次。
+    已处于外层事务中时无法单独重试，直接执行。
+
+    Returns:
+        func 的返回值
+    """
+    if connection.in_atomic_block:
+        acquire_write_lock(scope)
+        return func(*args, **kwargs)
+
+    config = get_write_lock_config()
+    attempt = 1
+    while True:
+        try:
+            with transaction.atomic():
+                acquire_write_lock(scope)
+                return func(*args, **kwargs)
+        except OperationalError as e:
+            if not is_lock_error(e) or attempt >= config['MAX_ATTEMPTS']:
+                raise
+            # 全抖动（full jitter），避免重试的请求再次同时争抢
+            delay = random.uniform(0, min(config['BACKOFF_MAX'], config['BACKOFF_BASE'] * 2 ** (attempt - 1)))
+            logger.warning(f"写锁等待超时，{delay:.3f}秒后第{attempt}次重试: {str(e)}")
+            time.sleep(delay)
+            attempt += 1
@@ -2,6 +2,7 @@ from django.urls import path
 from django.contrib import admin
 from . import views
 from . import api
+from . import events
 
 urlpatterns = [
     # Django管理员
@@ -20,5 +21,14 @@ urlpatterns = [
     path('api/save_rooms/', api.save_rooms, name='save_rooms'),
     path('api/save_reservations/', api.save_reservations, name='save_reservations'),
     path('api/save_settings/', api.save_settings, name='save_settings'),
+    path('api/reservations/', api.create_reservation, name='create_reservation'),
+    path('api/reservations/<int:reservation_id>/', api.reservation_detail, name='reservation_detail'),
+    path('api/room_status/', api.room_status, name='api_room_status'),
+    path('api/availability/', api.availability, name='availability'),
+    path('api/free_slots/', api.free_slots, name='free_slots'),
+    path('api/changes/', api.load_changes, name='load_changes'),
+    path('api/events/', events.event_stream, name='event_stream'),
+    path('api/cache_stats/', api.cache_stats, name='cache_stats'),
+    path('api/webhook_stats/', api.webhook_stats, name='webhook_stats'),
 
 ]
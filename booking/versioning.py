@@ -0,0 +1,147 @@
+"""
+数据版本管理
+为会议室、预约、设置三类数据维护递增版本号，
+供 load_* 接口生成 ETag / Last-Modified 并响应条件请求
+"""
+import hashlib
+import logging
+from functools import wraps
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from .models import DataVersion
+from .cache import invalidate_payloads
+
+logger = logging.getLogger(__name__)
+
+SCOPE_ROOMS = 'rooms'
+SCOPE_RESERVATIONS = 'reservations'
+SCOPE_SETTINGS = 'settings'
+ALL_SCOPES = (SCOPE_ROOMS, SCOPE_RESERVATIONS, SCOPE_SETTINGS)
+
+
+def bump_data_version(*scopes):
+    """递增指定范围的数据版本（在调用方事务内执行，回滚时一并回滚）"""
+    now = timezone.now()
+    for scope in scopes:
+        updated = DataVersion.objects.filter(scope=scope).update(
+            version=F('version') + 1, updated_at=now
+        )
+        if not updated:
+            DataVersion.objects.get_or_create(scope=scope, defaults={'version': 1, 'updated_at': now})
+    # 事务提交后清理依赖这些数据的响应缓存
+    transaction.on_commit(lambda: invalidate_payloads(*scopes))
+
+
+def get_data_versions(*scopes):
+    """
+    读取数据版本
+
+    Returns:
+        dict: {scope: (version, updated_at)}，缺失的范围视为版本0
+    """
+    rows = DataVersion.objects.filter(scope__in=scopes).values_list('scope', 'version', 'updated_at')
+    versions = {scope: (version, updated_at) for scope, version, updated_at in rows}
+    for scope in scopes:
+        versions.setdefault(scope, (0, None))
+    return versions
+
+
+def make_etag(versions, query_string=''):
+    """根据各范围版本号和查询参数生成强ETag"""
+    parts = [f"{scope}:{versions[scope][0]}" for scope in sorted(versions)]
+    if query_string:
+        parts.append(query_string)
+    digest = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def get_collection_etag(*scopes):
+    """不带过滤参数的 load_* 接口当前的ETag，保存整个列表时用于 If-Match 校验"""
+    return make_etag(get_data_versions(*scopes))
+
+
+def parse_if_match(request):
+    """
+    读取 If-Match 请求头
+
+    Returns:
+        str | None: 去掉弱校验前缀的ETag（保留引号）；未提供或为 * 时返回None
+    """
+    return parse_etag_header(request.headers.get('If-Match', ''))
+
+
+def parse_etag_header(value):
+    """去掉ETag请求头的空白和弱校验前缀（保留引号），为空或为 * 时返回None"""
+    value = value.strip()
+    if not value or value == '*':
+        return None
+    if value.startswith('W/'):
+        value = value[2:]
+    return value
+
+
+def parse_row_version(request, data=None):
+    """
+    读取单行写入的期望版本：If-Match: "<版本号>" 或请求体中的 version
+
+    Raises:
+        ValueError: 版本号格式错误
+    """
+    value = parse_if_match(request)
+    if value is not None:
+        value = value.strip('"')
+    elif isinstance(data, dict) and data.get('version') not in (None, ''):
+        value = str(data['version'])
+    if value is None:
+        return None
+    if not value.isdigit():
+        raise ValueError(f'版本号格式错误: {value}')
+    return int(value)
+
+
+def claim_row_version(model, pk, expected):
+    """
+    校验行版本并锁定该行（在调用方事务内执行）
+
+    用一条带版本条件的UPDATE同时完成比较和加写锁，避免先读后写之间被其他worker修改。
+    版本一致返回True，之后再正常 save() 递增版本。
+    """
+    return model.objects.filter(pk=pk, version=expected).update(version=expected) == 1
+
+
+def versioned_response(*scopes):
+    """
+    条件请求装饰器
+
+    响应携带 ETag 和 Last-Modified；客户端带 If-None-Match / If-Modified-Since
+    且数据未变化时直接返回 304，只查询数据版本表，不执行视图。
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            versions = get_data_versions(*scopes)
+            # 不同过滤参数返回不同内容，参数排序后计入ETag
+            query_string = '&'.join(sorted(request.GET.urlencode().split('&'))) if request.GET else ''
+            etag = make_etag(versions, query_string)
+            # 供 cache.cached_payload 复用为缓存键
+            request.data_etag = etag
+            timestamps = [updated_at for _, updated_at in versions.values() if updated_at]
+            last_modified = int(max(timestamps).timestamp()) if timestamps else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+            response.headers.setdefault('ETag', etag)
+            if last_modified and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(last_modified)
+            # 允许浏览器缓存，但每次使用前必须重新验证
+            patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
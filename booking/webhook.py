@@ -0,0 +1,313 @@
+"""
+Webhook HTTP 客户端
+所有通知共用一个 requests.Session，连接池保持长连接，避免每条通知都重新建立 TCP/TLS 连接。
+
+每个 Webhook 地址有一个令牌桶限流器，使发送频率低于企业微信群机器人的限制（每分钟20条）；
+令牌不足且需等待超过 RATE_LIMIT_WAIT 秒时抛出 RateLimitedError，由发件箱延后发送。
+限流器在进程内计数，多个进程同时发送时应按进程数分摊 RATE_LIMIT。
+
+每个 Webhook 地址还有一个熔断器：连续失败（连接错误、超时、5xx、429）达到阈值后熔断，
+熔断期间的请求不发出网络请求，直接抛出 CircuitOpenError；熔断时间结束后放行一个探测请求，
+成功则恢复，失败则重新熔断。
+
+每次调用记录耗时和结果，统计为本进程内最近 LATENCY_WINDOW 次调用的延迟分位数。
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+def get_webhook_config():
+    """读取 settings.WEBHOOK_CLIENT 配置"""
+    config = {
+        'CONNECT_TIMEOUT': 3,  # 建立连接超时（秒）
+        'READ_TIMEOUT': 10,  # 等待响应超时（秒）
+        'POOL_SIZE': 10,  # 每个主机保持的连接数
+        'FAILURE_THRESHOLD': 5,  # 连续失败多少次后熔断
+        'RECOVERY_TIMEOUT': 30,  # 熔断多久后放行探测请求（秒）
+        'LATENCY_WINDOW': 200,  # 延迟统计保留的最近调用次数
+        'RATE_LIMIT': 18,  # 每个 RATE_PERIOD 内最多发送的消息数（企业微信限制为每分钟20条）
+        'RATE_PERIOD': 60,  # 限流周期（秒）
+        'RATE_LIMIT_WAIT': 5,  # 令牌不足时最多等待的时间（秒），超过则延后发送
+    }
+    config.update(getattr(settings, 'WEBHOOK_CLIENT', {}))
+    return config
+
+
+class DeliveryDeferred(Exception):
+    """暂时不能发送（未发出请求），retry_after 秒后再试"""
+
+    def __init__(self, url, retry_after, message):
+        super().__init__(message)
+        self.url = url
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(DeliveryDeferred):
+    """熔断期间拒绝发送"""
+
+    def __init__(self, url, retry_after):
+        super().__init__(url, retry_after, f"Webhook熔断中，{retry_after:.0f}秒后重试")
+
+
+class RateLimitedError(DeliveryDeferred):
+    """超出发送频率限制"""
+
+    def __init__(self, url, retry_after):
+        super().__init__(url, retry_after, f"超出Webhook发送频率限制，{retry_after:.0f}秒后重试")
+
+
+class TokenBucket:
+    """令牌桶限流器（线程安全）：容量 RATE_LIMIT，每 RATE_PERIOD 秒补满"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = None
+        self.updated_at = time.monotonic()
+
+    def acquire(self, url, config):
+        """取一个令牌，需要等待时最多等待 RATE_LIMIT_WAIT 秒，否则抛出 RateLimitedError"""
+        capacity = config['RATE_LIMIT']
+        rate = capacity / config['RATE_PERIOD']
+        with self.lock:
+            now = time.monotonic()
+            if self.tokens is None:
+                self.tokens = capacity
+            self.tokens = min(capacity, self.tokens + (now - self.updated_at) * rate)
+            self.updated_at = now
+            wait = (1 - self.tokens) / rate if self.tokens < 1 else 0
+            if wait > config['RATE_LIMIT_WAIT']:
+                raise RateLimitedError(url, wait)
+            # 先扣除令牌（可为负数），后来的调用按顺序排在后面等待
+            self.tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+
+    def snapshot(self):
+        with self.lock:
+            return {'tokens': None if self.tokens is None else round(self.tokens, 2)}
+
+
+class CircuitBreaker:
+    """单个 Webhook 地址的熔断器（线程安全）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def before_call(self, url, config):
+        """请求前检查，熔断中时抛出 CircuitOpenError"""
+        with self.lock:
+            if self.state == STATE_CLOSED:
+                return
+            remaining = self.opened_at + config['RECOVERY_TIMEOUT'] - time.monotonic()
+            if self.state == STATE_OPEN and remaining <= 0:
+                self.state = STATE_HALF_OPEN
+                self.probing = False
+            if self.state == STATE_HALF_OPEN and not self.probing:
+                # 只放行一个探测请求，其余请求在探测结束前继续拒绝
+                self.probing = True
+                return
+            raise CircuitOpenError(url, max(remaining, 0))
+
+    def release_probe(self):
+        """放行的探测请求未发出时，允许下一个请求探测"""
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != STATE_CLOSED:
+                logger.info("Webhook探测成功，熔断恢复")
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self, config):
+        with self.lock:
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN or self.failures >= config['FAILURE_THRESHOLD']:
+                if self.state != STATE_OPEN:
+                    logger.warning(f"Webhook连续失败{self.failures}次，熔断{config['RECOVERY_TIMEOUT']}秒")
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def snapshot(self):
+        with self.lock:
+            return {'state': self.state, 'failures': self.failures}
+
+
+class LatencyStats:
+    """调用次数和最近调用的延迟分位数（线程安全）"""
+
+    def __init__(self, window):
+        self.lock = threading.Lock()
+        self.durations = deque(maxlen=window)
+        self.counts = {'success': 0, 'failure': 0, 'rejected': 0, 'throttled': 0}
+
+    def record(self, outcome, duration=None):
+        with self.lock:
+            self.counts[outcome] += 1
+            if duration is not None:
+                self.durations.append(duration)
+
+    def snapshot(self):
+        with self.lock:
+            durations = sorted(self.durations)
+            stats = dict(self.counts)
+        stats['calls'] = stats['success'] + stats['failure']
+        if durations:
+            def percentile(p):
+                return durations[min(len(durations) - 1, math.ceil(p * len(durations)) - 1)]
+            stats['latency_ms'] = {
+                'avg': round(sum(durations) / len(durations) * 1000, 1),
+                'p50': round(percentile(0.5) * 1000, 1),
+                'p95': round(percentile(0.95) * 1000, 1),
+                'max': round(durations[-1] * 1000, 1),
+            }
+        else:
+            stats['latency_ms'] = None
+        return stats
+
+
+_lock = threading.Lock()
+_session = None
+_breakers = {}
+_buckets = {}
+_latency = None
+
+
+def get_session():
+    """进程内共享的 Session（首次使用时创建）"""
+    global _session
+    with _lock:
+        if _session is None:
+            config = get_webhook_config()
+            session = requests.Session()
+            # 不读取环境变量中的代理配置，避免代理连接问题
+            session.trust_env = False
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config['POOL_SIZE'])
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def _get_breaker(url):
+    with _lock:
+        breaker = _breakers.get(url)
+        if breaker is None:
+            breaker = _breakers[url] = CircuitBreaker()
+        return breaker
+
+
+def _get_bucket(url):
+    with _lock:
+        bucket = _buckets.get(url)
+        if bucket is None:
+            bucket = _buckets[url] = TokenBucket()
+        return bucket
+
+
+def _get_latency():
+    global _latency
+    with _lock:
+        if _latency is None:
+            _latency = LatencyStats(get_webhook_config()['LATENCY_WINDOW'])
+        return _latency
+
+
+def post_json(url, data, headers=None):
+    """
+    通过共享连接池发送 POST 请求，经过限流器和熔断器并记录耗时
+
+    Args:
+        url: Webhook 地址
+        data: 已编码的请求体（bytes）
+        headers: 请求头
+
+    Returns:
+        requests.Response
+
+    Raises:
+        CircuitOpenError: 熔断中，未发出请求
+        RateLimitedError: 超出发送频率限制，未发出请求
+        requests.exceptions.RequestException: 网络错误或超时
+    """
+    config = get_webhook_config()
+    breaker = _get_breaker(url)
+    latency = _get_latency()
+    try:
+        breaker.before_call(url, config)
+    except CircuitOpenError:
+        latency.record('rejected')
+        raise
+    try:
+        _get_bucket(url).acquire(url, config)
+    except RateLimitedError:
+        # 放弃本次调用（包括熔断恢复时的探测），不影响熔断状态
+        breaker.release_probe()
+        latency.record('throttled')
+        raise
+
+    started = time.perf_counter()
+    try:
+        response = get_session().post(
+            url, data=data, headers=headers,
+            timeout=(config['CONNECT_TIMEOUT'], config['READ_TIMEOUT'])
+        )
+    except requests.exceptions.RequestException:
+        latency.record('failure', time.perf_counter() - started)
+        breaker.record_failure(config)
+        raise
+    duration = time.perf_counter() - started
+
+    # 5xx 和 429 说明服务端暂时不可用；其他状态码（包括业务错误码）说明服务可达
+    if response.status_code >= 500 or response.status_code == 429:
+        latency.record('failure', duration)
+        breaker.record_failure(config)
+    else:
+        latency.record('success', duration)
+        breaker.record_success()
+    logger.debug(f"Webhook响应 {response.status_code}，耗时 {duration * 1000:.1f}ms")
+    return response
+
+
+def get_webhook_stats():
+    """本进程的 Webhook 调用统计和各地址的熔断状态"""
+    stats = _get_latency().snapshot()
+    with _lock:
+        breakers = list(_breakers.items())
+    # 地址中包含密钥，只显示前缀
+    stats['circuits'] = {url[:50]: breaker.snapshot() for url, breaker in breakers}
+    with _lock:
+        buckets = list(_buckets.items())
+    stats['rate_limits'] = {url[:50]: bucket.snapshot() for url, bucket in buckets}
+    return stats
+
+
+def reset_webhook_client():
+    """关闭连接池并清空熔断、限流状态和统计（配置变更或测试时使用）"""
+    global _session, _latency
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _latency = None
+        _breakers.clear()
+        _buckets.clear()
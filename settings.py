@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -60,9 +61,46 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(Path(__file__).resolve().parent, "data", "db.sqlite3"),
+        'OPTIONS': {
+            # 等待其他写事务释放锁的时间（秒），超时后由 booking.transactions 退避重试
+            'timeout': 5,
+        },
     }
 }
 
+# 缓存配置：默认使用进程内存缓存；多worker部署（如 gunicorn -w 4）时
+# 设置环境变量 CACHE_BACKEND=file 或 CACHE_BACKEND=db 让各进程共享缓存
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+if CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(Path(__file__).resolve().parent, "data", "cache"),
+        }
+    }
+elif CACHE_BACKEND == 'db':
+    # 需先执行 python manage.py createcachetable
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'booking_cache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'booking',
+        }
+    }
+
+# 接口响应缓存
+BOOKING_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 3600,  # 缓存条目最长保留时间（秒），数据变更时会提前失效
+    'MAX_PAYLOAD_BYTES': 5 * 1024 * 1024,  # 超过该大小的响应不缓存
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -188,11 +226,68 @@ if not os.path.exists(LOGS_DIR):
 
 # 备份配置
 BACKUP_SETTINGS = {
-    'BACKUP_DIR': os.path.join(BASE_DIR, 'backups'),
+    # 与数据库同在 data/ 目录下（Docker 中挂载为持久化卷）
+    'BACKUP_DIR': os.path.join(Path(__file__).resolve().parent, 'data', 'backups'),
     'MAX_BACKUPS': 30,  # 保留最近30个备份
+    'KEEP_DAYS': 30,  # 删除早于30天的备份（最新的备份总是保留）
+    # 定时备份：每隔 AUTO_BACKUP_INTERVAL 秒检查一次，数据未变化时跳过
     'AUTO_BACKUP_ENABLED': True,
+    'AUTO_BACKUP_INTERVAL': 6 * 3600,
+    'AUTO_BACKUP_SNAPSHOT': False,  # 定时备份使用整库快照
+    # 两次全量备份（间隔 FULL_BACKUP_INTERVAL 秒）之间只创建差异备份
+    'AUTO_BACKUP_DIFFERENTIAL': False,
+    'FULL_BACKUP_INTERVAL': 24 * 3600,
+    # Web进程内运行定时备份线程；设为 False 时需运行 python manage.py backup_scheduler --loop
+    'SCHEDULER_IN_PROCESS': os.environ.get('BACKUP_IN_PROCESS', '1') == '1' and sys.argv[1:2] != ['test'],
+    'SCHEDULER_LOCK_RETRY': 60,  # 未拿到定时备份文件锁的进程每隔多少秒重试，持锁进程退出后由其接替
     'BACKUP_ON_SAVE': True,  # 在保存数据时自动备份
-    'COMPRESS_BACKUPS': True,  # 压缩备份文件
+    'COMPRESS_BACKUPS': True,  # 压缩备份文件（JSON Lines + zstd/gzip）
+    'COMPRESSION': 'auto',  # auto：已安装 zstandard 时使用 zstd，否则 gzip
+    # 快照备份（backup_data --snapshot）每步复制的页数和步间暂停（秒），暂停期间写入请求可继续
+    'SNAPSHOT_PAGES': 1024,
+    'SNAPSHOT_SLEEP': 0.005,
+}
+
+# 变更日志（增量同步）配置
+CHANGE_JOURNAL = {
+    'KEEP_DAYS': 7,  # compact_changes 默认保留最近7天的变更
+}
+
+# 预约写事务的锁等待重试（booking.transactions）
+WRITE_LOCK = {
+    'MAX_ATTEMPTS': 5,  # 包括第一次在内的最多尝试次数
+    'BACKOFF_BASE': 0.05,  # 第一次重试前的最长等待（秒），之后每次翻倍
+    'BACKOFF_MAX': 1.0,  # 单次等待上限（秒）
+}
+
+# 企业微信通知发件箱（booking.outbox）
+NOTIFICATION_OUTBOX = {
+    # Web进程内启动后台发送线程；设为 False 时需运行 python manage.py process_outbox --loop
+    # 运行测试时不启动
+    'IN_PROCESS': os.environ.get('NOTIFICATION_IN_PROCESS', '1') == '1' and sys.argv[1:2] != ['test'],
+    'WORKERS': 4,  # 发送线程数
+    'COALESCE_WINDOW': 3,  # 合并这段时间内的变更为一条汇总消息（秒）
+    'MAX_ATTEMPTS': 6,  # 最多发送次数，超过后进入死信
+    'BACKOFF_BASE': 30,  # 第一次重试的等待时间（秒），之后每次翻倍
+    'BACKOFF_MAX': 3600,  # 重试等待上限（秒）
+}
+
+# 企业微信Webhook客户端：共享连接池、熔断和超时
+WEBHOOK_CLIENT = {
+    'CONNECT_TIMEOUT': 3,  # 建立连接超时（秒）
+    'READ_TIMEOUT': 10,  # 等待响应超时（秒）
+    'FAILURE_THRESHOLD': 5,  # 连续失败多少次后熔断
+    'RECOVERY_TIMEOUT': 30,  # 熔断多久后放行探测请求（秒）
+    # 企业微信群机器人每分钟最多20条消息；多个进程同时发送时按进程数分摊
+    'RATE_LIMIT': 18,
+    'RATE_PERIOD': 60,
+}
+
+# SSE 事件推送配置（/api/events/，需以ASGI方式部署）
+EVENT_STREAM = {
+    'POLL_INTERVAL': 1.0,  # 每个进程轮询变更日志的间隔（秒）
+    'HEARTBEAT_INTERVAL': 15,  # 心跳间隔（秒）
+    'MAX_CONNECTION_AGE': 600,  # 单个连接最长保持时间（秒）
 }
 
 # 确保备份目录存在
@@ -203,6 +298,11 @@ if not os.path.exists(BACKUP_DIR):
 # 企业微信Webhook默认配置（可被数据库Settings表覆盖）
 DEFAULT_WEBHOOK_URL = os.environ.get('WECHAT_WEBHOOK_URL', '')
 
+# 系统设置进程内缓存：每隔 CHECK_INTERVAL 秒检查一次其他进程是否修改了设置
+SETTINGS_CACHE = {
+    'CHECK_INTERVAL': 2,
+}
+
 # 改善Windows CMD输出刷新：在DEBUG下使用更频繁的flush
 # 优化输出缓冲，解决CMD窗口显示问题
 import sys
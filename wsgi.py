@@ -5,3 +5,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
 
 application = get_wsgi_application()
+
+# Web进程内的定时备份线程（多个 worker 通过文件锁只运行一个）
+# 和通知发送线程（启动时即发送重启前遗留的待发送通知）
+from booking.backup_scheduler import start_backup_scheduler  # noqa: E402
+from booking.outbox import start_outbox_dispatcher  # noqa: E402
+
+start_backup_scheduler()
+start_outbox_dispatcher()